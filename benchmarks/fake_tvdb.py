@@ -0,0 +1,127 @@
+"""Local HTTP stand-in for the TheTVDB v2 endpoints used by TVDBClient
+
+Serves /login, /refresh_token, /search/series, /series/{id} and /series/{id}/episodes (100 episodes
+per page with 'links') for a library from benchmarks.synthetic, honouring Accept-Language.
+Every response is delayed by a configurable latency to mimic a remote API.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+PAGE_SIZE = 100
+FILLER = 'A long overview nobody reads. ' * 20
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None):
+        data = json.dumps(body if body is not None else {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.server.fake.hit('login')
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        time.sleep(self.server.fake.latency)
+        self._send(200, {'token': 'fake-token'})
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        language = self.headers.get('Accept-Language') or 'en'
+        time.sleep(fake.latency)
+
+        if url.path == '/refresh_token':
+            fake.hit('refresh_token')
+            return self._send(200, {'token': 'fake-token'})
+
+        if url.path == '/search/series':
+            fake.hit('search_series')
+            name = query.get('name', [''])[0]
+            found = [i for i in fake.library if name.lower() in i['names']['en'].lower()]
+            if not found:
+                return self._send(404, {'Error': 'Resource not found'})
+            return self._send(200, {'data': [{'seriesName': i['names']['en'], 'firstAired': '2003-10-04',
+                                              'id': i['id'], 'overview': FILLER} for i in found]})
+
+        match = re.match(r'^/series/(\d+)(/episodes)?$', url.path)
+        series = fake.series.get(int(match.group(1))) if match else None
+        if series is None:
+            return self._send(404, {'Error': 'Resource not found'})
+
+        if not match.group(2):
+            fake.hit('series')
+            return self._send(200, {'data': {'id': series['id'], 'seriesName': series['names'].get(language),
+                                             'overview': FILLER}})
+
+        fake.hit('series_episodes')
+        page = int(query.get('page', ['1'])[0])
+        last = max(1, (len(series['episodes']) + PAGE_SIZE - 1) // PAGE_SIZE)
+        episodes = series['episodes'][(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        self._send(200, {
+            'links': {'first': 1, 'last': last, 'next': page + 1 if page < last else None,
+                      'prev': page - 1 if page > 1 else None},
+            'data': [{'id': series['id'] * 10000 + i['absolute'], 'airedSeason': i['season'],
+                      'airedEpisodeNumber': i['episode'], 'absoluteNumber': i['absolute'],
+                      'episodeName': i['names'].get(language), 'overview': FILLER,
+                      'directors': ['someone'], 'guestStars': ['someone else']} for i in episodes],
+        })
+
+
+class FakeTVDBServer:
+    """ Run the fake API on a background thread
+
+    Arguments:
+        library {list} -- return of benchmarks.synthetic.generate_library()
+
+    Keyword Arguments:
+        latency {float} -- seconds added to every response (default: {0.0})
+
+    Example:
+        with FakeTVDBServer(library, latency=0.05) as server:
+            config['TVDB_BASE_URL'] = server.url
+    """
+
+    def __init__(self, library, latency=0.0):
+        self.library = library
+        self.series = {i['id']: i for i in library}
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self._server.server_address)
+
+    def hit(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,222 @@
+"""Timed, repeatable benchmarks of subrename hot paths
+
+    python -m benchmarks.run --series 20 --episodes 50 --latency 0.02 --output before.json
+    python -m benchmarks.run --series 20 --episodes 50 --latency 0.02 --compare before.json
+
+Every scenario runs on a freshly generated synthetic library and reports the median wall time of its
+repeats, throughput and peak traced memory. Results are JSON so runs of different commits can be compared.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_tvdb import FakeTVDBServer
+from benchmarks.synthetic import generate_library
+from subrename import main, parse_media
+from subrename.episodes import EpisodeIndex
+from subrename.metrics import METRICS
+from subrename.utils import Config
+
+BENCH_CONFIG = {
+    "MEDIA_FILE_NAME_FORMATS": ["{series} - S{season}E{episode} - {quality}"],
+    "MEDIA_EXTS": [".mkv", ".avi", ".mp4"],
+    "SUBTITLES_EXTS": [".srt", ".ssa", ".ass"],
+    "SEARCH_LANGS": ["en", "ja", "zh"],
+    "SUBTITLE_LANG": "zh",
+    "SEASON_EPISODE_FORMATS": ["S{season}E{episode}", "S{season}EP{episode}", "Season {season} Episode {episode}",
+                               "Season{season} Episode{episode}", "Season {season} EP-{episode}",
+                               "S{season} EP-{episode}"],
+    "EPISODE_ONLY_FORMATS": ["EP{episode}", "EP-{episode}", "第{episode}集", "episode {episode}", "[{episode}]",
+                             "第{episode}話"],
+    "MAX_WORKERS": 8,
+}
+
+
+def measure(func, repeats):
+    """ Run func repeats times
+
+    Returns:
+        [dict] -- median seconds, all timings, peak traced memory in KiB and the last return value
+    """
+    timings = []
+    peak = 0
+    result = None
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {'seconds': statistics.median(timings), 'timings': timings, 'peak_kib': peak // 1024, 'result': result}
+
+
+def _episode_dicts(series, language):
+    return [{'airedSeason': i['season'], 'airedEpisodeNumber': i['episode'], 'absoluteNumber': i['absolute'],
+             'episodeName': i['names'][language]} for i in series['episodes']]
+
+
+def scenario_scan_media(root, library, args):
+    config = Config(BENCH_CONFIG)
+
+    def run():
+        return sum(len(scan.media_files) + len(scan.sub_files)
+                   for scan in parse_media.scan_library(root, config.media_exts, config.subtitles_exts,
+                                                        max_workers=args.workers))
+    stats = measure(run, args.repeats)
+    stats['items'] = stats.pop('result')
+    stats['unit'] = 'files'
+    return stats
+
+
+def _directories(root, config):
+    for scan in parse_media.scan_library(root, config.media_exts, config.subtitles_exts):
+        yield scan, parse_media.parse_file_names(scan.media_files, fformat=config.media_formats)
+
+
+def _series_table(library):
+    return {i['names']['en']: {'id': i['id'], 'names': set(i['names'].values())} for i in library}
+
+
+def _episode_index(library, config):
+    episode_index = EpisodeIndex()
+    for series in library:
+        for language in config.search_languages:
+            episode_index.add_episodes(series['names']['en'], _episode_dicts(series, language), language=language)
+    return episode_index
+
+
+def scenario_find_matching_subs(root, library, args):
+    config = Config(BENCH_CONFIG)
+    directories = list(_directories(root, config))
+    series_table = _series_table(library)
+    episode_index = _episode_index(library, config)
+
+    def run():
+        return sum(len(main.match_directory(media_files, scan.sub_files, series_table, episode_index, config=config))
+                   for scan, media_files in directories)
+    stats = measure(run, args.repeats)
+    stats['items'] = sum(len(media_files) for _, media_files in directories)
+    stats['matched'] = stats.pop('result')
+    stats['unit'] = 'media files'
+    return stats
+
+
+def scenario_episode_lookup(root, library, args):
+    config = Config(BENCH_CONFIG)
+    media = [info for _, media_files in _directories(root, config) for info in media_files.values()]
+
+    def run():
+        episode_index = _episode_index(library, config)
+        return sum(len(main.find_episode_metadata_for_media(info, episode_index)['names']) for info in media)
+    stats = measure(run, args.repeats)
+    stats['result'] = None
+    stats['items'] = len(media)
+    stats['unit'] = 'lookups (index build included)'
+    return stats
+
+
+def scenario_main(root, library, args):
+    timings, peaks, requests, stages = [], [], {}, {}
+    items = sum(len(i['episodes']) for i in library)
+    for repeat in range(args.repeats):
+        with tempfile.TemporaryDirectory() as work:
+            library_root = os.path.join(work, 'library')
+            generate_library(library_root, args.series, args.episodes, BENCH_CONFIG, seasons=args.seasons,
+                             seed=args.seed)
+            with FakeTVDBServer(library, latency=args.latency) as server:
+                config = dict(BENCH_CONFIG, TVDB_BASE_URL=server.url,
+                              CACHE_PATH=os.path.join(work, 'cache.sqlite'),
+                              STATE_PATH=os.path.join(work, 'state.json'),
+                              RENAME_JOURNAL=os.path.join(work, 'renames.jsonl'),
+                              TOKEN_PATH=os.path.join(work, 'token.json'),
+                              SERIES_INDEX_PATH=os.path.join(work, 'series.json'),
+                              LOG_FILE=os.path.join(work, 'subrename.log'),
+                              TVDB_RATE_LIMIT=args.rate_limit, TVDB_BURST=args.rate_limit)
+                config_path = os.path.join(work, 'config.json')
+                with open(config_path, 'w') as fn:
+                    json.dump(config, fn)
+                argv = [library_root, '--recursive', '--config', config_path]
+                if args.no_cache:
+                    argv.append('--no-cache')
+                stats = measure(lambda: main.main(argv), 1)
+                timings.append(stats['seconds'])
+                peaks.append(stats['peak_kib'])
+                requests = dict(server.requests)
+                stages = {i['labels']['stage']: i['value']
+                          for i in METRICS.summary()['counters'].get('stage_seconds', [])}
+    return {'seconds': statistics.median(timings), 'timings': timings, 'peak_kib': max(peaks),
+            'items': items, 'unit': 'media files', 'http_requests': requests, 'stage_seconds': stages}
+
+
+SCENARIOS = {
+    'scan_media': scenario_scan_media,
+    'find_matching_subs': scenario_find_matching_subs,
+    'episode_lookup': scenario_episode_lookup,
+    'main': scenario_main,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark subrename hot paths on a synthetic library.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='one of {0} (default: all)'.format(', '.join(sorted(SCENARIOS))))
+    parser.add_argument('--series', type=int, default=10)
+    parser.add_argument('--episodes', type=int, default=50, help='episodes per season')
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.02, help='fake API latency in seconds')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1, help='scanner threads for scan_media')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate-limit', type=float, default=1000.0,
+                        help='client requests per second in the main scenario (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='run main() without the response cache')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: {0}'.format(', '.join(sorted(unknown))))
+    return args
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    scenarios = args.scenarios or sorted(SCENARIOS)
+    results = {'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'scenarios')},
+               'python': sys.version.split()[0], 'scenarios': {}}
+    with tempfile.TemporaryDirectory() as root:
+        library = generate_library(root, args.series, args.episodes, BENCH_CONFIG, seasons=args.seasons,
+                                   seed=args.seed)
+        for name in scenarios:
+            stats = SCENARIOS[name](root, library, args)
+            stats.pop('result', None)
+            stats['throughput'] = stats['items'] / stats['seconds'] if stats['seconds'] else None
+            results['scenarios'][name] = stats
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fn:
+            baseline = json.load(fn).get('scenarios', {})
+    for name, stats in results['scenarios'].items():
+        line = '{0:<20} {1:>9.3f} s {2:>12.1f} {3}/s {4:>9} KiB peak'.format(
+            name, stats['seconds'], stats['throughput'] or 0, stats['unit'], stats['peak_kib'])
+        if name in baseline:
+            line += '  ({0:+.1%} time vs baseline)'.format(stats['seconds'] / baseline[name]['seconds'] - 1)
+        if 'http_requests' in stats:
+            line += '  http {0}'.format(stats['http_requests'])
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as fn:
+            json.dump(results, fn, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,109 @@
+"""Generate synthetic libraries for benchmarks
+
+A library is N series x M episodes laid out as '<series>/Season <n>/' directories. Every media file
+gets one subtitle named in a randomly picked fan-sub style: by episode name (in any language), by
+every SEASON_EPISODE_FORMATS and EPISODE_ONLY_FORMATS entry, with dots, underscores and group tags.
+Episode names are made of words only, like real ones ('The Storm', 'Heart of the Moon'), so short
+names sharing letters with the subtitle names of other episodes exercise the default matching tiers.
+The metadata returned describes the series for the fake TheTVDB server.
+"""
+import os
+import random
+
+WORDS = ['window', 'dream', 'orbit', 'debris', 'moon', 'signal', 'harbor', 'silence', 'return', 'trip',
+         'lunar', 'station', 'fools', 'heart', 'garden', 'shadow', 'engine', 'winter', 'letter', 'storm']
+JA_WORDS = ['窓', '夢', '軌道', '月', '信号', '港', '沈黙', '帰還', '旅', '駅', '心', '庭', '影', '冬', '手紙', '嵐']
+ZH_WORDS = ['窗', '梦', '轨道', '月亮', '信号', '港口', '沉默', '归来', '旅程', '车站', '心', '花园', '影子', '冬天']
+GROUPS = ['SubGroup', 'FanSub', 'HorribleSubs', '字幕組']
+NAME_PATTERNS = {
+    'en': ['The {0}', '{0}', '{0} {1}', '{0} of the {1}', 'A {0} {1}'],
+    'ja': ['{0}', '{0}の{1}', '{0}と{1}'],
+    'zh': ['{0}', '{0}的{1}', '{0}与{1}'],
+}
+LANGUAGE_WORDS = {'en': WORDS, 'ja': JA_WORDS, 'zh': ZH_WORDS}
+
+
+def _episode_name(rng, language, used):
+    # Names are unique within a series, a third word is added once two word names run out
+    words = LANGUAGE_WORDS[language]
+    for attempt in range(100):
+        pattern = rng.choice(NAME_PATTERNS[language])
+        name = pattern.format(*[rng.choice(words) for _ in range(2)])
+        if attempt >= 50:
+            name = '{0} {1}'.format(name, rng.choice(words))
+        name = name[0].upper() + name[1:]
+        if name not in used:
+            used.add(name)
+            return name
+    raise ValueError("Cannot generate more {0} episode names, use fewer episodes".format(language))
+
+
+def _episode_names(rng, used):
+    return dict((language, _episode_name(rng, language, used.setdefault(language, set())))
+                for language in sorted(NAME_PATTERNS))
+
+
+def _sub_name(rng, series, season, episode, names, config):
+    styles = ['name'] + ['se:' + i for i in config.get('SEASON_EPISODE_FORMATS', [])] + \
+             ['ep:' + i for i in config.get('EPISODE_ONLY_FORMATS', [])]
+    style = rng.choice(styles)
+    ext = rng.choice(config.get('SUBTITLES_EXTS', ['.srt', '.ass']))
+    if style == 'name':
+        language = rng.choice(sorted(names))
+        return '[{0}] {1} - {2}{3}'.format(rng.choice(GROUPS), series['names'][language], names[language], ext)
+
+    kind, fmt = style.split(':', 1)
+    number = fmt.replace('{season}', '{0:02d}'.format(season)).replace('{episode}', '{0:02d}'.format(episode))
+    series_name = series['names']['en']
+    if rng.random() < 0.5:
+        series_name = series_name.replace(' ', rng.choice(['.', '_']))
+    if kind == 'ep' and rng.random() < 0.3:
+        series_name = series['names'][rng.choice(['ja', 'zh'])]
+    return '[{0}] {1} {2} [1080p]{3}'.format(rng.choice(GROUPS), series_name, number, ext)
+
+
+def generate_library(root, n_series, n_episodes, config, seasons=1, seed=0, media_ext='.mkv'):
+    """ Create an empty-file library and return its metadata
+
+    Arguments:
+        root {str} -- directory to create the library in
+        n_series {int} -- number of series
+        n_episodes {int} -- episodes per season
+        config {dict} -- subrename config, for the subtitle formats
+
+    Keyword Arguments:
+        seasons {int} -- seasons per series (default: {1})
+        seed {int} -- random seed, the same seed gives the same library (default: {0})
+        media_ext {str} -- media file extension (default: {'.mkv'})
+
+    Returns:
+        [list] -- series dicts with 'id', 'names' ({language: name}) and 'episodes'
+                  ([{'season', 'episode', 'absolute', 'names'}])
+    """
+    rng = random.Random(seed)
+    library = []
+    for series_number in range(n_series):
+        en_name = 'Show {0} {1}'.format(rng.choice(WORDS).title(), series_number)
+        series = {
+            'id': 100000 + series_number,
+            'names': {'en': en_name,
+                      'ja': '{0}{1}'.format(rng.choice(JA_WORDS), series_number),
+                      'zh': '{0}{1}'.format(rng.choice(ZH_WORDS), series_number)},
+            'episodes': [],
+        }
+        absolute = 0
+        used = {}
+        for season in range(1, seasons + 1):
+            season_dir = os.path.join(root, en_name, 'Season {0}'.format(season))
+            os.makedirs(season_dir, exist_ok=True)
+            for episode in range(1, n_episodes + 1):
+                absolute += 1
+                names = _episode_names(rng, used)
+                series['episodes'].append({'season': season, 'episode': episode, 'absolute': absolute,
+                                           'names': names})
+                media = '{0} - S{1:02d}E{2:02d} - 1080p{3}'.format(en_name, season, episode, media_ext)
+                open(os.path.join(season_dir, media), 'w').close()
+                sub = _sub_name(rng, series, season, episode, names, config)
+                open(os.path.join(season_dir, sub.replace(os.sep, ' ')), 'w').close()
+        library.append(series)
+    return library
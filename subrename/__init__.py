@@ -0,0 +1,4 @@
+import logging
+
+# Library callers see nothing unless they configure logging, main() logs to LOG_FILE
+logging.getLogger('subrename').addHandler(logging.NullHandler())
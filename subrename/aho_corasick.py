@@ -0,0 +1,81 @@
+"""Aho-Corasick automaton for finding many patterns in one pass over a text
+"""
+from collections import deque
+
+
+class Automaton:
+    """ Multi-pattern substring matcher
+
+    Arguments:
+        patterns {iterable} -- patterns to look for, empty patterns are ignored
+
+    Example:
+        >>> automaton = Automaton(['he', 'she', 'hers'])
+        >>> sorted(automaton.patterns[i] for i in automaton.find_all('ushers'))
+        ['he', 'hers', 'she']
+    """
+
+    def __init__(self, patterns):
+        self.patterns = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build_fail_links()
+
+    def _add(self, pattern):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                self._output[next_node] = self._output[next_node] + self._output[self._fail[next_node]]
+
+    def iter_matches(self, text):
+        """ Stream text through the automaton
+
+        Arguments:
+            text {str} -- text to search
+
+        Yields:
+            [tuple] -- (end position, pattern index) for every occurrence
+        """
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for pattern_index in self._output[node]:
+                yield position, pattern_index
+
+    def find_all(self, text):
+        """ Indexes of all patterns occurring in text
+
+        Arguments:
+            text {str} -- text to search
+
+        Returns:
+            [set] -- pattern indexes
+        """
+        return set(pattern_index for _, pattern_index in self.iter_matches(text))
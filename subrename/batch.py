@@ -0,0 +1,344 @@
+"""Batch mode: many library roots in one run, matched by a pool of worker processes
+
+The parent process scans every root, resolves every series once through its provider and
+response cache, and fetches their episodes. Directories are grouped by series into shards of
+at most BATCH_SHARD_SIZE directories, and each shard is sent to a worker process with only the
+episode data of its series. Workers return rename plans, the parent applies them in one run of
+the rename journal and records the state journal. A directory failing does not stop the others,
+every directory gets an entry in the report:
+
+    python -m subrename.main --workers 8 --manifest folders.txt --report report.json
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from subrename import parse_media
+from subrename.episodes import EpisodeIndex
+from subrename.main import media_series, pending_directory, plan_directory, record_state, resolve_series
+from subrename.metrics import METRICS
+from subrename.renamer import RenameExecutor, RenamePlan
+from subrename.sub_content import PREFIX_BYTES, SubtitleInspector
+from subrename.utils import Config
+
+log = logging.getLogger('subrename.batch')
+
+SHARD_SIZE = 50
+
+Shard = namedtuple('Shard', ['config', 'series_table', 'episode_index', 'directories', 'inspect_bytes'])
+DirectoryResult = namedtuple('DirectoryResult', ['path', 'plan', 'error'])
+
+
+def read_manifest(path):
+    """ Library roots listed in a manifest file, one per line, blank lines and '#' comments ignored
+    """
+    with open(path, encoding='utf-8') as fn:
+        return [line.strip() for line in fn if line.strip() and not line.lstrip().startswith('#')]
+
+
+def make_shards(directories, shard_size=SHARD_SIZE):
+    """ Group directories of the same series, at most shard_size directories per group
+
+    Arguments:
+        directories {list} -- (DirectoryScan, media files, subtitle files) of every directory
+
+    Keyword Arguments:
+        shard_size {int} -- directories per shard (default: {SHARD_SIZE})
+
+    Returns:
+        [list] -- lists of directories
+    """
+    groups = {}
+    for item in directories:
+        groups.setdefault(tuple(media_series(item[1])), []).append(item)
+    shards = []
+    for key in sorted(groups):
+        items = groups[key]
+        shards += [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+    return shards
+
+
+def match_shard(shard):
+    """ Plan the renames of every directory of a shard, errors are caught per directory
+
+    Arguments:
+        shard {Shard} -- directories with the series and episodes they need
+
+    Returns:
+        [list] -- DirectoryResult of every directory
+    """
+    inspector = SubtitleInspector(max_workers=1, prefix_bytes=shard.inspect_bytes) if shard.inspect_bytes else None
+    results = []
+    for path, media_files, sub_files in shard.directories:
+        try:
+            sub_info = inspector.inspect(path, sub_files) if inspector is not None else {}
+            plan = plan_directory(path, media_files, sub_files, shard.series_table, shard.episode_index,
+                                  shard.config, sub_info=sub_info)
+        except Exception as e:
+            log.exception("Failed to match '{0}'".format(path))
+            results.append(DirectoryResult(path, None, '{0}: {1}'.format(type(e).__name__, e)))
+        else:
+            results.append(DirectoryResult(path, plan, None))
+    return results
+
+
+def _match_shard_in_worker(shard):
+    # Counters of the worker process go back to the parent with the results
+    METRICS.reset()
+    return match_shard(shard), METRICS.summary()['counters']
+
+
+class BatchReport:
+    """ Outcome of every directory of a batch run
+
+    Attributes:
+        directories {dict} -- {path: entry}, entries have a status ('done', 'skipped' or 'failed'),
+                              the number of media files, matched, renamed and conflicting subtitles
+                              and a list of errors. A directory with any error failed, it is not
+                              recorded in the state journal so the next run tries it again.
+    """
+    STATUSES = ('done', 'skipped', 'failed')
+
+    def __init__(self):
+        self.directories = {}
+        self.duration = 0.0
+
+    def add(self, path, status, media_files=0):
+        self.directories[path] = {'status': status, 'media_files': media_files, 'matched': 0, 'renamed': 0,
+                                  'conflicts': 0, 'errors': []}
+        return self.directories[path]
+
+    def error(self, path, message):
+        entry = self.directories[path]
+        entry['status'] = 'failed'
+        entry['errors'].append(message)
+
+    def totals(self):
+        totals = dict((status, 0) for status in self.STATUSES)
+        for entry in self.directories.values():
+            totals[entry['status']] += 1
+            for key in ('media_files', 'matched', 'renamed', 'conflicts'):
+                totals[key] = totals.get(key, 0) + entry[key]
+            totals['errors'] = totals.get('errors', 0) + len(entry['errors'])
+        return totals
+
+    @property
+    def failed(self):
+        return sorted(path for path, entry in self.directories.items() if entry['status'] == 'failed')
+
+    def as_dict(self):
+        return {'duration_seconds': self.duration, 'totals': self.totals(),
+                'directories': [dict(entry, path=path) for path, entry in sorted(self.directories.items())]}
+
+    def describe(self):
+        """ Human readable summary, a line per directory with errors and a line of totals
+        """
+        lines = ['{0}: {1} {2}'.format(path, entry['status'].upper(), '; '.join(entry['errors']))
+                 for path, entry in sorted(self.directories.items()) if entry['errors']]
+        totals = self.totals()
+        lines.append('{0} directories: {1} done, {2} skipped, {3} failed; {4} of {5} media files matched, '
+                     '{6} subtitles renamed, {7} conflicts in {8:.1f} s'.format(
+                         len(self.directories), totals['done'], totals['skipped'], totals['failed'],
+                         totals.get('matched', 0), totals.get('media_files', 0), totals.get('renamed', 0),
+                         totals.get('conflicts', 0), self.duration))
+        return lines
+
+    def write(self, path):
+        """ Write the report as JSON, atomically
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as fn:
+            json.dump(self.as_dict(), fn, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def run_batch(roots, db_client, config, recursive=True, workers=None, shard_size=None, state=None, force=False,
+              executor=None, dry_run=False, resolver=None, inspect=False):
+    """ Match and rename subtitles of many library roots
+
+    Arguments:
+        roots {list} -- library roots or season folders
+        db_client {TVShowProvider} -- metadata provider, used by this process only
+        config {Config} -- loaded config
+
+    Keyword Arguments:
+        recursive {bool} -- process every directory below the roots (default: {True})
+        workers {int} -- worker processes, 1 to match in this process
+                         (default: {None}, BATCH_WORKERS or os.cpu_count())
+        shard_size {int} -- directories per shard (default: {None}, BATCH_SHARD_SIZE or SHARD_SIZE)
+        state {StateJournal} -- journal of earlier runs, updated with this run (default: {None})
+        force {bool} -- process every media file, only record the new state (default: {False})
+        executor {RenameExecutor} -- executor applying the renames (default: {None}, no journal)
+        dry_run {bool} -- only print the rename plan (default: {False})
+        resolver {SeriesResolver} -- index of known series names, consulted before searching (default: {None})
+        inspect {bool} -- inspect subtitle contents, see sub_content (default: {False})
+
+    Returns:
+        [BatchReport] -- outcome of every directory
+    """
+    config = Config.coerce(config)
+    if not config.media_formats:
+        raise ValueError("Missing media file format, define it in config.json MEDIA_FILE_NAME_FORMATS")
+    workers = workers or config.get('BATCH_WORKERS') or os.cpu_count() or 1
+    shard_size = shard_size or config.get('BATCH_SHARD_SIZE') or SHARD_SIZE
+    executor = executor or RenameExecutor()
+    inspect_bytes = (config.get('INSPECT_BYTES') or PREFIX_BYTES) if inspect else None
+    report = BatchReport()
+    start = time.perf_counter()
+
+    pool = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=workers)
+        # Start the workers while this process has no other threads, forking with threads holding locks is unsafe
+        pool.submit(os.getpid).result()
+    fetch_pool = ThreadPoolExecutor(max_workers=max(1, getattr(db_client, 'max_workers', 1)))
+    try:
+        directories, scans = _scan_roots(roots, config, report, recursive=recursive, state=state, force=force,
+                                         dry_run=dry_run)
+        episode_index = EpisodeIndex()
+        series_futures = {}
+        for _, media_files, _ in directories:
+            for series in media_series(media_files):
+                if series not in series_futures:
+                    series_futures[series] = fetch_pool.submit(
+                        resolve_series, series, db_client, config, episode_index, resolver=resolver)
+        # Shards are built as their series arrive and dispatched right away
+        shards = (_make_shard(items, config, series_futures, episode_index, report, inspect_bytes)
+                  for items in make_shards(directories, shard_size))
+        _match_shards(shards, report, pool)
+    finally:
+        fetch_pool.shutdown(wait=False)
+        if pool is not None:
+            pool.shutdown()
+
+    _apply(report, scans, executor, state, dry_run)
+    report.duration = time.perf_counter() - start
+    return report
+
+
+def _scan_roots(roots, config, report, recursive=True, state=None, force=False, dry_run=False):
+    """ Scan every root, directories failing or skipped are added to the report
+
+    Returns:
+        [tuple] -- (DirectoryScan, media files, subtitle files) of the pending directories,
+                   {path: DirectoryScan} of every directory
+    """
+    directories, scans = [], {}
+    for root in roots:
+        if not os.path.isdir(root):
+            report.add(root, 'failed')
+            report.error(root, 'Not a directory')
+            continue
+        for scan in METRICS.timed_iter(parse_media.scan_library(
+                root, config.media_exts, config.subtitles_exts, recursive=recursive,
+                max_workers=config.get('MAX_WORKERS', 8)), 'scan'):
+            scans[scan.path] = scan
+            try:
+                pending = pending_directory(scan, config, state=state, force=force, dry_run=dry_run)
+            except Exception as e:
+                report.add(scan.path, 'failed')
+                report.error(scan.path, '{0}: {1}'.format(type(e).__name__, e))
+                continue
+            if pending is None:
+                report.add(scan.path, 'skipped')
+            else:
+                directories.append((scan, pending[0], pending[1]))
+    return directories, scans
+
+
+def _make_shard(items, config, series_futures, episode_index, report, inspect_bytes=None):
+    """ Wait for the series of a group of directories and build their shard
+
+    Directories are added to the report, those with a series that cannot be resolved as failed.
+
+    Returns:
+        [Shard] -- directories with the series and episodes they need
+    """
+    names = sorted(set(series for item in items for series in media_series(item[1])))
+    series_table, series_errors = {}, {}
+    for series in names:
+        try:
+            series_table.update(series_futures[series].result())
+        except Exception as e:
+            series_errors[series] = "Cannot get metadata of series '{0}': {1}".format(series, e)
+            log.error(series_errors[series])
+    for scan, media_files, _ in items:
+        report.add(scan.path, 'done', len(media_files))
+        for series in media_series(media_files):
+            if series in series_errors:
+                report.error(scan.path, series_errors[series])
+    return Shard(config, series_table, episode_index.subset(names),
+                 [(scan.path, media_files, sub_files) for scan, media_files, sub_files in items], inspect_bytes)
+
+
+def _match_shards(shards, report, pool=None):
+    """ Match shards in the worker pool, or in this process without one, and collect their plans
+
+    Arguments:
+        shards {iterable} -- Shard of every group of directories
+        report {BatchReport} -- report the plans and errors are added to
+
+    Keyword Arguments:
+        pool {ProcessPoolExecutor} -- worker processes (default: {None}, match in this process)
+    """
+    if pool is None:
+        for shard in shards:
+            _collect(report, shard, match_shard(shard))
+        return
+    shard_futures = dict((pool.submit(_match_shard_in_worker, shard), shard) for shard in shards)
+    for future in as_completed(shard_futures):
+        shard = shard_futures[future]
+        try:
+            results, counters = future.result()
+        except Exception as e:
+            log.error("Worker failed on {0} directories: {1}".format(len(shard.directories), e))
+            results = [DirectoryResult(path, None, 'Worker failed: {0}'.format(e))
+                       for path, _, _ in shard.directories]
+        else:
+            METRICS.merge_counters(counters)
+        _collect(report, shard, results)
+
+
+def _collect(report, shard, results):
+    for result in results:
+        entry = report.directories[result.path]
+        if result.error is not None:
+            report.error(result.path, result.error)
+            continue
+        entry['plan'] = result.plan
+        entry['matched'] = len(result.plan.ops) + len(result.plan.unchanged)
+        entry['conflicts'] = len(result.plan.conflicts)
+
+
+def _apply(report, scans, executor, state, dry_run):
+    """ Apply the plans of all directories in one run of the executor and record their state
+    """
+    plans = {path: entry.pop('plan') for path, entry in report.directories.items() if 'plan' in entry}
+    plan = RenamePlan()
+    for path in sorted(plans):
+        plan.extend(plans[path])
+    if dry_run:
+        for line in plan.describe():
+            print(line)
+        return
+
+    with METRICS.timer('rename'):
+        results = executor.apply(plan)
+    METRICS.incr('renames', sum(i.ok for i in results), result='done')
+    METRICS.incr('renames', sum(not i.ok for i in results), result='failed')
+    done = dict((path, list(dir_plan.unchanged)) for path, dir_plan in plans.items())
+    for result in results:
+        if result.ok:
+            report.directories[result.op.directory]['renamed'] += 1
+            done[result.op.directory].append(result.op)
+        else:
+            report.error(result.op.directory, "Cannot rename '{0}': {1}".format(result.op.src, result.error))
+    if state is not None:
+        for path, ops in done.items():
+            if report.directories[path]['status'] == 'done':
+                record_state(state, scans[path], ops)
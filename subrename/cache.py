@@ -0,0 +1,203 @@
+"""Persistent on-disk cache for online database responses
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger('subrename.cache')
+
+CacheEntry = namedtuple('CacheEntry', ['data', 'stored_at', 'last_modified', 'fresh'])
+
+DAY = 24 * 60 * 60
+FLUSH_ACCESSES = 1000
+
+
+class ResponseCache:
+    """ SQLite backed response cache
+
+    Entries are keyed by url, query parameters and language, expire after a per-endpoint TTL
+    and are evicted least recently used first once the cache holds more than `max_entries`.
+    Cache hits do not write: access times are kept in memory and written with the next stored
+    response, every FLUSH_ACCESSES hits or by flush().
+
+    Modes:
+        normal  -- serve fresh entries, fetch (or revalidate) stale or missing ones
+        offline -- serve any cached entry, never touch the network
+        refresh -- ignore cached entries, fetch everything and store the results
+    """
+    MODES = ('normal', 'offline', 'refresh')
+    DEFAULT_TTLS = {
+        'search_series': 7 * DAY,
+        'series': 7 * DAY,
+        'series_episodes': DAY,
+    }
+    DEFAULT_TTL = DAY
+    DEFAULT_PATH = os.path.join('~', '.cache', 'subrename', 'responses.sqlite')
+
+    def __init__(self, path, ttls=None, max_entries=20000, mode='normal'):
+        if mode not in self.MODES:
+            raise ValueError("Unknown cache mode '{0}', use one of {1}".format(mode, self.MODES))
+        self.path = path
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_entries = max_entries
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._accessed = {}
+
+        if path != ':memory:':
+            dir_name = os.path.dirname(os.path.abspath(path))
+            os.makedirs(dir_name, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Write ahead logging: readers never wait for a writer, commits sync at checkpoints only
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, body TEXT NOT NULL, '
+                           'stored_at REAL NOT NULL, accessed_at REAL NOT NULL, last_modified TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._conn.commit()
+        self._count = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    @classmethod
+    def from_config(cls, config, mode='normal'):
+        """ Create a cache from CACHE_* settings in config.json
+
+        Arguments:
+            config {dict} -- loaded config
+
+        Keyword Arguments:
+            mode {str} -- one of ResponseCache.MODES (default: {'normal'})
+
+        Returns:
+            [ResponseCache] -- cache instance
+        """
+        path = os.path.expanduser(config.get('CACHE_PATH') or cls.DEFAULT_PATH)
+        return cls(path,
+                   ttls=config.get('CACHE_TTLS'),
+                   max_entries=config.get('CACHE_MAX_ENTRIES', 20000),
+                   mode=mode)
+
+    @property
+    def offline(self):
+        return self.mode == 'offline'
+
+    @staticmethod
+    def make_key(url, query_params=None, language=None):
+        """ Build a stable cache key from request attributes
+
+        Arguments:
+            url {str} -- request url
+
+        Keyword Arguments:
+            query_params {dict} -- query parameters (default: {None})
+            language {str} -- Accept-Language header value (default: {None})
+
+        Returns:
+            [str] -- cache key
+        """
+        params = json.dumps(sorted((query_params or {}).items()), ensure_ascii=False)
+        return '{0}|{1}|{2}'.format(url, params, language or '')
+
+    def get(self, endpoint, key):
+        """ Look up a cached response
+
+        Arguments:
+            endpoint {str} -- endpoint name, selects the TTL
+            key {str} -- key from make_key()
+
+        Returns:
+            [CacheEntry] -- cached entry (possibly stale), None if missing or in refresh mode
+        """
+        if self.mode == 'refresh':
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT body, stored_at, last_modified FROM responses WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= FLUSH_ACCESSES:
+                self._write_accessed()
+                self._conn.commit()
+
+        body, stored_at, last_modified = row
+        fresh = now - stored_at < self.ttls.get(endpoint, self.DEFAULT_TTL)
+        return CacheEntry(json.loads(body), stored_at, last_modified, fresh)
+
+    def set(self, endpoint, key, data, last_modified=None):
+        """ Store a response and evict least recently used entries above max_entries
+
+        Arguments:
+            endpoint {str} -- endpoint name
+            key {str} -- key from make_key()
+            data {object} -- JSON serializable response body
+
+        Keyword Arguments:
+            last_modified {str} -- Last-Modified header of the response (default: {None})
+        """
+        now = time.time()
+        body = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._accessed.pop(key, None)
+            self._write_accessed()
+            exists = self._conn.execute('SELECT 1 FROM responses WHERE key = ?', (key,)).fetchone() is not None
+            self._conn.execute('INSERT OR REPLACE INTO responses '
+                               '(key, endpoint, body, stored_at, accessed_at, last_modified) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               (key, endpoint, body, now, now, last_modified))
+            if not exists:
+                self._count += 1
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, key):
+        """ Mark an entry as revalidated, restarting its TTL
+        """
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(key, None)
+            self._conn.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?',
+                               (now, now, key))
+            self._conn.commit()
+
+    def flush(self):
+        """ Write the access times of the cache hits not written yet
+        """
+        with self._lock:
+            if self._accessed:
+                self._write_accessed()
+                self._conn.commit()
+
+    def _write_accessed(self):
+        if self._accessed:
+            self._conn.executemany('UPDATE responses SET accessed_at = ? WHERE key = ?',
+                                   [(accessed_at, key) for key, accessed_at in self._accessed.items()])
+            self._accessed = {}
+
+    def _evict(self):
+        # The running count misses entries stored by other processes, count them only when it runs over
+        if self._count <= self.max_entries:
+            return
+        self._count = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess > 0:
+            log.debug('Evicting {0} cache entries'.format(excess))
+            self._conn.execute('DELETE FROM responses WHERE key IN '
+                               '(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)', (excess,))
+            self._count -= excess
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,137 @@
+"""Index episode metadata fetched from online databases
+"""
+import sys
+import threading
+
+EMPTY_NAMES = frozenset()
+
+
+class EpisodeRecord:
+    """ The fields of an episode used for matching
+
+    names is a tuple of the interned names in all languages, name_set the same names as a
+    frozenset, built when a name is added and shared by every lookup.
+    """
+    __slots__ = ('season', 'episode', 'absolute', 'names', 'name_set')
+
+    def __init__(self, season, episode, absolute=None):
+        self.season = season
+        self.episode = episode
+        self.absolute = absolute
+        self.names = ()
+        self.name_set = EMPTY_NAMES
+
+    def add_name(self, name):
+        if name not in self.name_set:
+            self.names += (sys.intern(name),)
+            self.name_set = frozenset(self.names)
+
+    def __repr__(self):
+        return 'EpisodeRecord(season={0}, episode={1}, absolute={2}, names={3})'.format(
+            self.season, self.episode, self.absolute, self.names)
+
+
+class EpisodeIndex:
+    """ Compact episode store keyed by (series, season, episode) and by (series, absolute number)
+
+    Only season, episode, absolute number and names in all languages are kept from the raw episode
+    data, so episodes can be added while responses stream in and dropped right after.
+    Adding is thread safe, lookups return the read-only frozenset of names in all languages
+    kept by every record.
+    """
+    SEASON_KEY = 'airedSeason'
+    EPISODE_KEY = 'airedEpisodeNumber'
+    ABS_EPISODE_KEY = 'absoluteNumber'
+    EPISODE_NAME_KEY = 'episodeName'
+
+    def __init__(self):
+        self._by_season_episode = {}
+        self._by_absolute = {}
+        self._series_records = {}
+        self._lock = threading.Lock()
+
+    def add_episodes(self, series, episodes, language=None):
+        """ Add episodes of a series
+
+        Arguments:
+            series {str} -- series name used in media files
+            episodes {iterable} -- episode dicts as returned by TVShowProvider.get_episodes_by_series_id()
+
+        Keyword Arguments:
+            language {str} -- language of the episode names, names of all languages are kept together
+                              (default: {None})
+        """
+        with self._lock:
+            records = self._series_records.setdefault(series, [])
+        for episode in episodes:
+            name = episode.get(self.EPISODE_NAME_KEY)
+            if not name:
+                continue
+            key = (series, episode.get(self.SEASON_KEY), episode.get(self.EPISODE_KEY))
+            absolute = episode.get(self.ABS_EPISODE_KEY)
+            with self._lock:
+                record = self._by_season_episode.get(key)
+                if record is None:
+                    record = self._by_season_episode[key] = EpisodeRecord(key[1], key[2])
+                    records.append(record)
+                if record.absolute is None and absolute is not None:
+                    record.absolute = absolute
+                    self._by_absolute.setdefault((series, absolute), record)
+                record.add_name(name)
+
+    @staticmethod
+    def _names(record):
+        return EMPTY_NAMES if record is None else record.name_set
+
+    def names(self, series, season, episode):
+        """ Names of an episode in all languages
+
+        Returns:
+            [frozenset] -- episode names, empty if the episode is unknown
+        """
+        return self._names(self._by_season_episode.get((series, season, episode)))
+
+    def names_by_absolute(self, series, absolute):
+        """ Names of an episode in all languages by its absolute number (anime)
+
+        Returns:
+            [frozenset] -- episode names, empty if the episode is unknown
+        """
+        return self._names(self._by_absolute.get((series, absolute)))
+
+    def series_episode_names(self, series):
+        """ All episode names of a series in all languages
+        """
+        return [name for record in self._series_records.get(series, ()) for name in record.names]
+
+    def records(self, series):
+        """ Episode records of a series
+        """
+        return list(self._series_records.get(series, ()))
+
+    def subset(self, series_names):
+        """ Index of some of the series only, sharing their records, ex: to send to a worker process
+        """
+        index = EpisodeIndex()
+        with self._lock:
+            for series in series_names:
+                if series not in self._series_records:
+                    continue
+                records = index._series_records[series] = list(self._series_records[series])
+                for record in records:
+                    index._by_season_episode[(series, record.season, record.episode)] = record
+                    if record.absolute is not None:
+                        index._by_absolute.setdefault((series, record.absolute), record)
+        return index
+
+    def __contains__(self, series):
+        return series in self._series_records
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,260 @@
+"""Offline metadata provider backed by a local SQLite store
+
+The store is bulk imported from JSON dumps, so air-gapped machines can match whole libraries
+without calling the online database:
+
+    python -m subrename.local_db metadata.sqlite dump.json [more.jsonl ...]
+
+A dump is a JSON list of series (or {"series": [...]}), or JSON lines with one series per line:
+
+    {"id": 75796, "seriesName": {"en": "Planetes", "ja": "プラネテス"}, "imdbId": "tt0816398",
+     "firstAired": "2003-10-04",
+     "episodes": {"en": [{"airedSeason": 1, "airedEpisodeNumber": 1, "absoluteNumber": 1,
+                          "episodeName": "Outside the Atmosphere"}, ...],
+                  "ja": [...]}}
+
+A plain string seriesName and a plain episode list are taken as the dump's default language.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+from subrename.providers import TVShowProvider
+
+log = logging.getLogger('subrename.local_db')
+
+DEFAULT_LANGUAGE = 'en'
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS series ('
+    'id INTEGER PRIMARY KEY, imdb_id TEXT, first_aired TEXT)',
+    'CREATE INDEX IF NOT EXISTS series_imdb ON series (imdb_id)',
+    'CREATE TABLE IF NOT EXISTS series_names ('
+    'series_id INTEGER NOT NULL, language TEXT NOT NULL, name TEXT NOT NULL, name_key TEXT NOT NULL, '
+    'PRIMARY KEY (series_id, language)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS series_names_key ON series_names (name_key)',
+    # Clustered on the lookup key: one seek per episode, one contiguous range per (series, language)
+    'CREATE TABLE IF NOT EXISTS episodes ('
+    'series_id INTEGER NOT NULL, language TEXT NOT NULL, season INTEGER NOT NULL, episode INTEGER NOT NULL, '
+    'absolute INTEGER, name TEXT, PRIMARY KEY (series_id, language, season, episode)) WITHOUT ROWID',
+)
+
+
+def name_key(name):
+    """ Search key of a series name, case and surrounding white space insensitive
+    """
+    return ' '.join(name.split()).casefold()
+
+
+def _by_language(value, language):
+    if isinstance(value, dict):
+        return value
+    return {language: value} if value is not None else {}
+
+
+def iter_dump(path):
+    """ Iterate over the series of a JSON or JSON lines dump
+
+    Arguments:
+        path {str} -- dump file, '.jsonl' files are read line by line
+
+    Returns:
+        [iterator] -- series dicts
+    """
+    with open(path, encoding='utf-8') as fn:
+        if path.endswith('.jsonl'):
+            for line in fn:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(fn)
+    if isinstance(data, dict):
+        data = data.get('series', [data] if 'id' in data else [])
+    yield from data
+
+
+class LocalProvider(TVShowProvider):
+    """ TVShowProvider answering from a local SQLite store
+
+    Series names are searched through an index on their casefolded form, episodes are stored
+    clustered by (series, language, season, episode). Responses have the same shape as TVDBClient's.
+
+    Arguments:
+        path {str} -- SQLite file, created if missing
+
+    Keyword Arguments:
+        mmap_size {int} -- bytes of the database file read through mmap (default: {256 MiB})
+    """
+    SEASON_KEY = 'airedSeason'
+    EPISODE_KEY = 'airedEpisodeNumber'
+    EPISODE_NAME_KEY = 'episodeName'
+    ABS_EPISODE_KEY = 'absoluteNumber'
+
+    def __init__(self, path, mmap_size=256 * 1024 * 1024):
+        super().__init__()
+        self.path = path
+        self.max_workers = 1
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA mmap_size = {0:d}'.format(mmap_size))
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        """ Open the store at LOCAL_DB_PATH of config.json
+        """
+        path = config.get('LOCAL_DB_PATH')
+        if not path:
+            raise ValueError("Missing LOCAL_DB_PATH in config.json")
+        return cls(os.path.expanduser(path))
+
+    def import_series(self, series_list, language=DEFAULT_LANGUAGE):
+        """ Bulk import series, replacing the ones already stored
+
+        Arguments:
+            series_list {iterable} -- series dicts in the dump format of this module
+
+        Keyword Arguments:
+            language {str} -- language of plain string names and plain episode lists (default: {'en'})
+
+        Returns:
+            [int] -- number of series imported
+        """
+        count = 0
+        with self._lock:
+            try:
+                for series in series_list:
+                    self._import_one(series, language)
+                    count += 1
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        log.info("Imported {0} series into '{1}'".format(count, self.path))
+        return count
+
+    def import_dump(self, path, language=DEFAULT_LANGUAGE):
+        """ Bulk import a JSON or JSON lines dump file, see iter_dump()
+        """
+        return self.import_series(iter_dump(path), language=language)
+
+    def _import_one(self, series, language):
+        series_id = int(series['id'])
+        self._conn.execute('DELETE FROM series_names WHERE series_id = ?', (series_id,))
+        self._conn.execute('DELETE FROM episodes WHERE series_id = ?', (series_id,))
+        self._conn.execute('INSERT OR REPLACE INTO series (id, imdb_id, first_aired) VALUES (?, ?, ?)',
+                           (series_id, series.get('imdbId'), series.get('firstAired')))
+        self._conn.executemany(
+            'INSERT INTO series_names (series_id, language, name, name_key) VALUES (?, ?, ?, ?)',
+            [(series_id, lang, name, name_key(name))
+             for lang, name in _by_language(series.get('seriesName'), language).items() if name])
+        episodes = series.get('episodes') or {}
+        if not isinstance(episodes, dict):
+            episodes = {language: episodes}
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO episodes (series_id, language, season, episode, absolute, name) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((series_id, lang, i.get(self.SEASON_KEY) or 0, i[self.EPISODE_KEY], i.get(self.ABS_EPISODE_KEY),
+              i.get(self.EPISODE_NAME_KEY))
+             for lang, items in episodes.items() for i in items if i.get(self.EPISODE_KEY) is not None))
+
+    def _series(self, series_id, language):
+        with self._lock:
+            row = self._conn.execute('SELECT id, imdb_id, first_aired FROM series WHERE id = ?',
+                                     (series_id,)).fetchone()
+            if row is None:
+                raise LookupError("Series '{0}' is not in the local database.".format(series_id))
+            name = self._conn.execute('SELECT name FROM series_names WHERE series_id = ? AND language = ?',
+                                      (series_id, language or DEFAULT_LANGUAGE)).fetchone()
+        return {'id': row[0], 'imdbId': row[1], 'firstAired': row[2], 'seriesName': name[0] if name else None}
+
+    def get_series_by_id(self, tvdb_id, language=None):
+        """ Series info, seriesName is None if it has no name in language
+        """
+        return self._series(int(tvdb_id), language)
+
+    def get_series_by_imdb_id(self, imdb_id):
+        with self._lock:
+            row = self._conn.execute('SELECT id FROM series WHERE imdb_id = ?', (imdb_id,)).fetchone()
+        if row is None:
+            raise LookupError("IMDb id '{0}' is not in the local database.".format(imdb_id))
+        return self._series(row[0], None)
+
+    def find_series_by_name(self, series_name):
+        """ Series whose name in any language starts with series_name, ignoring case
+
+        Names equal to series_name come first and are returned as such, so exact matching
+        works for media files named in any language.
+        """
+        key = name_key(series_name)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT n.series_id, n.name, n.name_key, s.first_aired FROM series_names n '
+                'JOIN series s ON s.id = n.series_id WHERE n.name_key >= ? AND n.name_key < ? '
+                'ORDER BY n.name_key != ?, n.series_id', (key, key + '\U0010ffff', key)).fetchall()
+        if not rows:
+            raise LookupError("There are no data for this term.")
+        found = {}
+        for series_id, name, _, first_aired in rows:
+            found.setdefault(series_id, {'name': name, 'air_date': first_aired, 'tvdb_id': series_id})
+        return list(found.values())
+
+    def get_episode(self, tvdb_id, season, episode, language=None):
+        """ One episode by season and episode number
+
+        Returns:
+            [dict] -- episode dict, None if it is not stored
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT season, episode, absolute, name FROM episodes '
+                'WHERE series_id = ? AND language = ? AND season = ? AND episode = ?',
+                (int(tvdb_id), language or DEFAULT_LANGUAGE, season, episode)).fetchone()
+        return self._episode(row) if row else None
+
+    def _episode(self, row):
+        return {self.SEASON_KEY: row[0], self.EPISODE_KEY: row[1], self.ABS_EPISODE_KEY: row[2],
+                self.EPISODE_NAME_KEY: row[3]}
+
+    def get_episodes_by_series_id(self, tvdb_id, language=None):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT season, episode, absolute, name FROM episodes WHERE series_id = ? AND language = ? '
+                'ORDER BY season, episode', (int(tvdb_id), language or DEFAULT_LANGUAGE)).fetchall()
+        if not rows:
+            # Raise like the online API for unknown series, a series without episodes in language is empty
+            self._series(int(tvdb_id), language)
+        return [self._episode(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='subrename.local_db',
+                                     description='Import JSON metadata dumps into a local subrename database.')
+    parser.add_argument('database', help='SQLite file to create or update')
+    parser.add_argument('dumps', nargs='+', help='JSON or JSON lines (.jsonl) dump files')
+    parser.add_argument('--language', default=DEFAULT_LANGUAGE,
+                        help='language of names given as plain strings (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    provider = LocalProvider(args.database)
+    try:
+        total = sum(provider.import_dump(path, language=args.language) for path in args.dumps)
+    finally:
+        provider.close()
+    print('Imported {0} series into {1}'.format(total, args.database), file=sys.stderr)
+    return total
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,84 @@
+import argparse
 import logging
-import re
-import sys
-from copy import deepcopy
-from os import rename
-from os.path import splitext, join
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import expanduser, join, splitext
 
 from subrename import parse_media
-from subrename import tvdb_api
-from subrename.utils import load_config
+from subrename.cache import ResponseCache
+from subrename.episodes import EpisodeIndex
+from subrename.metrics import METRICS
+from subrename.registry import create_provider
+from subrename.resolver import SeriesResolver, split_year
+from subrename.matcher import FUZZY_THRESHOLD, EpisodeNameIndex, FuzzyNameIndex, SubtitleIndex, normalize_text
+from subrename.renamer import RenameExecutor, RenamePlan, plan_renames
+from subrename.state import StateJournal
+from subrename.sub_content import SubtitleInspector
+from subrename.utils import Config, load_config, parallel_map
 
 log = logging.getLogger('subrename')
-log.setLevel(logging.DEBUG)
-fh = logging.FileHandler('subrename.log', mode='w')
-formatter = logging.Formatter('[%(asctime)s] [ %(name)-25s ] [ %(levelname)-8s ] %(message)s')
-fh.setFormatter(formatter)
-log.addHandler(fh)
 
+RENAME_JOURNAL = join('~', '.cache', 'subrename', 'renames.jsonl')
+LOG_FILE = 'subrename.log'
 
-def get_series_ids(media_files, db_client):
+
+def setup_logging(path=LOG_FILE):
+    """ Log everything to a file truncated on every run, done by main() so importing subrename has no side effects
+
+    Keyword Arguments:
+        path {str} -- log file (default: {LOG_FILE})
+    """
+    log.setLevel(logging.DEBUG)
+    for handler in [i for i in log.handlers if getattr(i, 'subrename_main', False)]:
+        log.removeHandler(handler)
+        handler.close()
+    fh = logging.FileHandler(path, mode='w', delay=True)
+    fh.subrename_main = True
+    formatter = logging.Formatter('[%(asctime)s] [ %(name)-25s ] [ %(levelname)-8s ] %(message)s')
+    fh.setFormatter(formatter)
+    log.addHandler(fh)
+
+
+def _first_aired_year(search_result):
+    year = split_year(search_result['name'])[1]
+    air_date = search_result.get('air_date') or ''
+    if year is None and air_date[:4].isdigit():
+        year = int(air_date[:4])
+    return year
+
+
+def _pick_series(series, possible_series, name, year):
+    """ The search result meaning series: its exact name, else the same name first aired in year
+    """
+    matching_series = [i for i in possible_series
+                       if i['name'] == series and (year is None or _first_aired_year(i) == year)]
+    if not matching_series:
+        key = normalize_text(name)
+        matching_series = [i for i in possible_series if normalize_text(split_year(i['name'])[0]) == key]
+        if year is not None:
+            matching_series = [i for i in matching_series if _first_aired_year(i) == year]
+    if not matching_series:
+        raise ValueError("Cannot find exact series name '{0}'".format(series))
+    elif len(matching_series) > 1:
+        raise ValueError("More than one match are found with name '{0}', \
+            need more information (maybe year)".format(series))
+    return matching_series[0]
+
+
+def get_series_ids(media_files, db_client, resolver=None):
     """ Get series db id for existing media files
 
+    Names known to the resolver are not searched, a trailing year ('Doctor Who (2005)') picks
+    between series of the same name.
+
     Arguments:
         media_files {list} -- list of dicts
 
+    Keyword Arguments:
+        resolver {SeriesResolver} -- index of known series names, learns the names searched (default: {None})
+
     Raises:
         ValueError: if not exact name is found
         ValueError: if more than one exact name is found
@@ -30,80 +86,115 @@ def get_series_ids(media_files, db_client):
     Returns:
         [dict] -- {'series_name': tvbd_id}
     """
-    series_names = set([i['series'] for i in media_files.values()])
+    series_names = sorted(set([i['series'] for i in media_files.values()]))
+    resolver = resolver or SeriesResolver()
 
     series_table = {}
+    to_search = []
     for series in series_names:
-        possible_series = db_client.find_series_by_name(series)
-        matching_series = [i for i in possible_series if i['name'] == series]
-        if not matching_series:
-            raise ValueError("Cannot find exact series name '{0}'".format(series))
-        elif len(matching_series) > 1:
-            raise ValueError("More than one match are found with name '{0}', \
-                need more information (maybe year)".format(series))
-        series_table[series] = {'id': matching_series[0]['tvdb_id'],
-                                'names': [series]}
+        series_id = resolver.resolve(series)
+        if series_id is None:
+            to_search.append(series)
+        else:
+            METRICS.incr('series_resolutions', source='index')
+            series_table[series] = {'id': series_id, 'names': [series]}
+
+    queries = [resolver.search_query(series) for series in to_search]
+    search_results = parallel_map(db_client.find_series_by_name, [name for name, _ in queries],
+                                  max_workers=getattr(db_client, 'max_workers', 1))
+    for series, (name, year), possible_series in zip(to_search, queries, search_results):
+        METRICS.incr('series_resolutions', source='search')
+        series_id = _pick_series(series, possible_series, name, year)['tvdb_id']
+        key = normalize_text(name)
+        if len([i for i in possible_series if normalize_text(split_year(i['name'])[0]) == key]) > 1:
+            # Only the name including the year means this series, the bare name stays ambiguous
+            resolver.mark_ambiguous(name)
+        resolver.learn(series, series_id)
+        series_table[series] = {'id': series_id, 'names': [series]}
 
     return series_table
 
 
-def update_series_alt_names(series_table, db_client):
+def update_series_alt_names(series_table, db_client, config=None, resolver=None):
     """ Update names in other languages for series
 
+    With a resolver, names are fetched in every search language, English included since the
+    media files may use an alias, and only the ones it does not know yet.
+
     Arguments:
         series_table {dict} -- series table with name(en) to id mapping
                                 ex: {'Planetes': {'id':75796, 'names': ['Planetes']}}
 
+    Keyword Arguments:
+        config {Config} -- loaded config (default: {None}, use load_config())
+        resolver {SeriesResolver} -- index of known series names, learns the names fetched (default: {None})
+
     Returns:
         series_table -- updated series_table with other names
                                 ex: {'Planetes': {'id':75796, 'names': ['Planetes', 'プラネテス', '星空之旅']}}
     """
-    config = load_config()
-    search_languages = set(config.get('SEARCH_LANGS', ['en']))
-    search_languages.remove('en')
-
+    config = Config.coerce(load_config() if config is None else config)
+    if resolver is None:
+        search_languages = [i for i in config.search_languages if i != 'en']
+        known = {}
+    else:
+        search_languages = config.search_languages
+        known = {series: resolver.names(series_table[series]['id']) for series in series_table}
+
+    pairs = [(series, language) for series in series_table for language in search_languages
+             if language not in known.get(series, ())]
+    results = parallel_map(lambda req: db_client.get_series_by_id(series_table[req[0]]['id'], language=req[1]),
+                           pairs, max_workers=getattr(db_client, 'max_workers', 1))
+    for (series, language), metadata in zip(pairs, results):
+        series_name = metadata.get('seriesName')
+        if series_name:
+            series_table[series]['names'].append(series_name)
+        if resolver is not None:
+            resolver.learn_name(series_table[series]['id'], language, series_name)
     for series in series_table:
-        for language in search_languages:
-            metadata = db_client.get_series_by_id(series_table[series]['id'], language=language)
-            series_name = metadata.get('seriesName')
-            if series_name:
-                series_table[series]['names'].append(series_name)
-        series_table[series]['names'] = set(series_table[series]['names'])
+        names = known.get(series, {})
+        series_table[series]['names'] = set(series_table[series]['names']) | \
+            set(names[i] for i in search_languages if names.get(i))
 
     return series_table
 
 
-def find_episode_metadata_for_media(media_info, data_cache):
+def find_episode_metadata_for_media(media_info, episode_index):
     """ For given episode season/number, find all names in all languages
 
     Arguments:
         media_info {dict} -- return of parse_media.parse_file_name()
-        data_cache {dict} -- cached data fetched from online database (TheTVDB, etc)
+        episode_index {EpisodeIndex} -- index of data fetched from online database (TheTVDB, etc)
 
     Returns:
-        [dict] -- media_info plus names
+        [dict] -- media_info plus names, names are shared with the index and must not be modified
     """
-    episode = deepcopy(media_info)
-    episode['names'] = set(i.get('episodeName') for i in data_cache[episode['series']]
-                           if i['airedSeason'] == episode['season'] and i['airedEpisodeNumber'] == episode['episode']
-                           and i.get('episodeName'))
-    return episode
+    series = media_info['series']
+    names = episode_index.names(series, media_info['season'], media_info['episode'])
+    if not names and media_info.get('absolute') is not None:
+        names = episode_index.names_by_absolute(series, media_info['absolute'])
+    return dict(media_info, names=names)
 
 
-def find_matching_subs(media_info, sub_files):
+def find_matching_subs(media_info, sub_files, sub_index=None, name_index=None, fuzzy_index=None):
     """ Look for match subtitle file
 
     Arguments:
         media_info {dict} -- episode info
         sub_files {list} -- list of subtitle files
 
+    Keyword Arguments:
+        sub_index {SubtitleIndex} -- prebuilt index of sub_files, built from config if not given (default: {None})
+        name_index {EpisodeNameIndex} -- prebuilt episode name index of the series (default: {None})
+        fuzzy_index {FuzzyNameIndex} -- approximate episode name index of sub_files, no fuzzy matching
+                                        if None (default: {None})
+
     Returns:
         [str] -- matching subtitle file name if it is found,
                  otherwise None
     """
-    config = load_config()
-    season_episode_fmts = config.get('SEASON_EPISODE_FORMATS', [])
-    episode_only_fmts = config.get('EPISODE_ONLY_FORMATS', [])
+    if sub_index is None:
+        sub_index = build_sub_index(sub_files)
 
     series = media_info['series']
     season = media_info['season']
@@ -113,23 +204,69 @@ def find_matching_subs(media_info, sub_files):
     log.info('Searching for series {0}, season {1}, episode {2}'.format(series, season, episode))
 
     # 1, episode name matching
-    match = _match_sub_by_name(names, sub_files=sub_files)
+    match = _match_sub_by_name(names, sub_files=sub_files, name_index=name_index)
     if match:
+        METRICS.incr('matches', tier='name')
         return match
 
     # 2, season/episode number matching
-    match = _match_sub_by_season_episode(season, episode, series_names, sub_files, season_episode_fmts)
+    match = sub_index.match_season_episode(season, episode, series_names)
     if match:
+        METRICS.incr('matches', tier='season_episode')
         return match
 
     # 3, episode only matching
     log.warning('Looking for a matching subtitle with episode number only.')
-    match = _match_sub_by_episode(episode, series_names, sub_files, episode_only_fmts)
+    match = sub_index.match_episode(episode, series_names)
     if match:
+        METRICS.incr('matches', tier='episode')
         return match
 
+    # 4, approximate episode name matching, only when no number identifies the episode
+    if fuzzy_index is not None:
+        match = fuzzy_index.match(names)
+        if match:
+            METRICS.incr('matches', tier='fuzzy_name')
+            return match
+    METRICS.incr('matches', tier='none')
+
+
+def build_sub_index(sub_files, config=None):
+    """ Index subtitle files with the number formats from config.json
+
+    Arguments:
+        sub_files {list} -- list of subtitle files
+
+    Keyword Arguments:
+        config {Config} -- loaded config (default: {None}, use load_config())
+
+    Returns:
+        [SubtitleIndex] -- index for season/episode and episode only matching
+    """
+    config = Config.coerce(load_config() if config is None else config)
+    return SubtitleIndex(sub_files, patterns=config.sub_patterns)
+
+
+def build_fuzzy_index(sub_files, config=None):
+    """ Index subtitle files for approximate episode name matching
+
+    Arguments:
+        sub_files {list} -- list of subtitle files
+
+    Keyword Arguments:
+        config {Config} -- loaded config (default: {None}, use load_config())
 
-def _match_sub_by_name(names, sub_files):
+    Returns:
+        [FuzzyNameIndex] -- index scoring at least FUZZY_NAME_THRESHOLD, None if the threshold is null
+    """
+    config = Config.coerce(load_config() if config is None else config)
+    threshold = config.get('FUZZY_NAME_THRESHOLD', FUZZY_THRESHOLD)
+    if threshold is None:
+        return None
+    return FuzzyNameIndex(sub_files, threshold=threshold)
+
+
+def _match_sub_by_name(names, sub_files, name_index=None):
     """Match by exact name
 
     Use possible episode names to match subtitle files
@@ -138,98 +275,562 @@ def _match_sub_by_name(names, sub_files):
         names {list} -- possible episode names in different languages
         sub_files {list} -- existing subtitle files
 
+    Keyword Arguments:
+        name_index {EpisodeNameIndex} -- index over sub_files including all names (default: {None})
+
     Returns:
         [str] -- if match is found, return matching file name, otherwise None
     """
-    for name in names:
-        for sub_file in sub_files:
-            if name.lower() in sub_file.lower():
-                log.info('Name match FOUND: {0} in {1}'.format(name, sub_file))
-                return sub_file
+    if name_index is None:
+        name_index = EpisodeNameIndex(names, sub_files)
+    return name_index.match(names)
+
 
+def parse_args(argv=None):
+    """ Parse command line arguments
 
-def _match_sub_by_season_episode(season, episode, series_names, sub_files, formats):
-    """ Match by season/episode number
+    Keyword Arguments:
+        argv {list} -- arguments without program name (default: {None}, use sys.argv)
 
-    Requires series name in subtitle file name
+    Returns:
+        [argparse.Namespace] -- parsed arguments
+    """
+    parser = argparse.ArgumentParser(prog='subrename', description='Rename subtitle files to match media files.')
+    parser.add_argument('paths', nargs='*', metavar='path',
+                        help='directory with media and subtitle files, several directories run in batch mode')
+    parser.add_argument('-c', '--config', help='config file (default: config.json next to the subrename package)')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='process every directory below path')
+    parser.add_argument('--full', action='store_true',
+                        help='process every directory, even ones unchanged since the last run')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and process new files as they appear')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='print the planned renames without renaming anything')
+    parser.add_argument('--rollback', action='store_true',
+                        help='undo the renames of the last run recorded in the rename journal and exit')
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--offline', dest='cache_mode', action='store_const', const='offline',
+                            help='answer from the local cache only, never contact the online database')
+    cache_mode.add_argument('--refresh', dest='cache_mode', action='store_const', const='refresh',
+                            help='ignore cached responses and fetch everything again')
+    parser.add_argument('--local-db', metavar='FILE',
+                        help='answer from a local metadata database (see subrename.local_db) instead of the PROVIDERS')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='batch mode: file listing directories to process, one per line')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='batch mode: worker processes matching directories (default: BATCH_WORKERS or CPUs)')
+    parser.add_argument('--report', metavar='FILE',
+                        help='batch mode: write a JSON report of every directory')
+    parser.add_argument('--inspect', action='store_true',
+                        help='read subtitle contents for their language and ASS title (see INSPECT_SUBTITLES)')
+    parser.add_argument('--metrics-json', metavar='FILE',
+                        help='write a JSON summary of stage timings, HTTP, cache and match counters')
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help='write the run metrics as a Prometheus textfile collector file')
+    cache_mode.add_argument('--no-cache', dest='cache_mode', action='store_const', const=None,
+                            help='do not use the local response cache')
+    parser.set_defaults(cache_mode='normal')
+    args = parser.parse_args(argv)
+    args.batch = len(args.paths) > 1 or bool(args.manifest or args.workers or args.report)
+    if not (args.paths or args.manifest or args.rollback):
+        parser.error('the following arguments are required: path')
+    if args.batch and args.watch:
+        parser.error('--watch takes a single path, not batch mode')
+    args.path = args.paths[0] if len(args.paths) == 1 else None
+    return args
+
+
+def fetch_episodes(series_table, db_client, search_languages, episode_index=None):
+    """ Query all series episode data, fanned out over (series, language) pairs
+
+    Only the fields needed for matching are kept while the pages stream in.
 
     Arguments:
-        season {int} -- season number
-        episode {int} -- episode number
-        names {[type]} -- [description]
-        sub_files {[type]} -- [description]
-        formats {[type]} -- [description]
+        series_table {dict} -- return of get_series_ids()
+        db_client {TVShowProvider} -- online database client
+        search_languages {list} -- languages to fetch episode names in
+
+    Keyword Arguments:
+        episode_index {EpisodeIndex} -- index to add the episodes to (default: {None}, new index)
 
     Returns:
-        [type] -- [description]
+        [EpisodeIndex] -- episode names of all series
     """
+    if episode_index is None:
+        episode_index = EpisodeIndex()
+    pairs = [(series, language) for series in series_table for language in search_languages]
+    parallel_map(lambda req: episode_index.add_episodes(
+        req[0], db_client.iter_episodes_by_series_id(series_table[req[0]]['id'], language=req[1]), language=req[1]),
+        pairs, max_workers=getattr(db_client, 'max_workers', 1))
+    return episode_index
+
+
+def _search_name(sub_file, info):
+    """ Subtitle name with the title found in its content, ex: '1 Planetes - 01.ass'
+    """
+    if info is None or not info.title:
+        return sub_file
+    stem, ext = splitext(sub_file)
+    return '{0} {1}{2}'.format(stem, info.title, ext)
+
+
+def match_directory(media_files, sub_files, series_table, episode_index, config=None, sub_info=None):
+    """ Find the matching subtitle for every media file of one directory
+
+    With inspected subtitles, ASS titles are matched along with the file names, and subtitles
+    in SUBTITLE_LANG win ties between subtitles matching the same media file.
+
+    Arguments:
+        media_files {dict} -- return of parse_media.parse_file_names()
+        sub_files {list} -- subtitle files in the same directory
+        series_table {dict} -- return of update_series_alt_names()
+        episode_index {EpisodeIndex} -- episode names of all series
+
+    Keyword Arguments:
+        config {Config} -- loaded config (default: {None}, use load_config())
+        sub_info {dict} -- {subtitle file: sub_content.SubtitleInfo} (default: {None})
+
+    Returns:
+        [list] -- (media file, subtitle file) pairs
+    """
+    config = Config.coerce(load_config() if config is None else config)
+    sub_files = list(sub_files)
+    if sub_info:
+        preferred = config.get('SUBTITLE_LANG')
+        # Indexes keep the first subtitle of equal matches, sort the wanted language first
+        sub_files.sort(key=lambda i: getattr(sub_info.get(i), 'language', None) != preferred)
+    sub_names = {}
     for sub_file in sub_files:
-        sub_file_tmp = sub_file.lower().replace('.', ' ').replace('_', ' ')
-        for fmt in formats:
-            pattern = fmt.replace('{season}', '([0-9]{1,3})').replace('{episode}', '([0-9]{1,3})')
-            match = re.findall(pattern.lower(), sub_file_tmp)
-            if match:
-                sub_season, sub_episode = match[0]
-                if int(sub_season) == season and int(sub_episode) == episode \
-                        and any(sn.lower() in sub_file_tmp for sn in series_names):
-                    log.info("S/E match is found '{0}'".format(sub_file))
-                    return sub_file
-
-
-def _match_sub_by_episode(episode, series_names, sub_files, formats):
-    for sub_file in sub_files:
-        sub_file_tmp = sub_file.lower().replace('.', ' ').replace('_', ' ')
-        for fmt in formats:
-            pattern = fmt.replace('{episode}', '([0-9]{1,3})').replace('[', r'\[').replace(']', r'\]')
-            match = re.findall(pattern.lower(), sub_file_tmp)
-            if match:
-                sub_episode = match[0]
-                if int(sub_episode) == episode and any(sn.lower() in sub_file_tmp for sn in series_names):
-                    log.info("Episode number match is found '{0}'".format(sub_file))
-                    return sub_file
-
-
-def main():
-    config = load_config()
-    subtitles_exts = config.get('SUBTITLES_EXTS', ['.srt', '.ssa', '.ass'])
-    search_languages = config.get('SEARCH_LANGS', ['en'])
-
-    path = sys.argv[1]
-
-    db_client = tvdb_api.TVDBClient()
-    media_files = parse_media.scan_media(path)
-    series_table = get_series_ids(media_files, db_client)
-    series_table = update_series_alt_names(series_table, db_client)
-
-    # Query all series espisode data
-    data_cache = {}
-    for series, info in series_table.items():
-        tvdb_id = info.get('id')
-        for language in search_languages:
-            data = data_cache.setdefault(series, [])
-            data += db_client.get_episodes_by_series_id(tvdb_id, language=language)
-        data_cache[series] = data
-
-    sub_files = parse_media.get_file_names(path=path, exts=subtitles_exts)
+        name = _search_name(sub_file, (sub_info or {}).get(sub_file))
+        sub_names[name if name not in sub_names else sub_file] = sub_file
+    sub_files = list(sub_names)
+
+    sub_index = build_sub_index(sub_files, config=config)
+    fuzzy_index = build_fuzzy_index(sub_files, config=config)
 
+    name_indexes = {}
     matching_subs = []
     for media_file, metadata in media_files.items():
-        episode_meta = find_episode_metadata_for_media(metadata, data_cache)
-        episode_meta['series_names'] = series_table.get(episode_meta['series'])['names']
-        sub_file = find_matching_subs(episode_meta, sub_files)
+        if metadata['series'] not in series_table:
+            continue
+        episode_meta = find_episode_metadata_for_media(metadata, episode_index)
+        episode_meta['series_names'] = series_table[episode_meta['series']]['names']
+        if episode_meta['series'] not in name_indexes:
+            name_indexes[episode_meta['series']] = EpisodeNameIndex(
+                episode_index.series_episode_names(episode_meta['series']), sub_files)
+        sub_file = find_matching_subs(episode_meta, sub_files, sub_index=sub_index,
+                                      name_index=name_indexes[episode_meta['series']], fuzzy_index=fuzzy_index)
         if sub_file:
-            matching_subs.append((media_file, sub_file))
+            matching_subs.append((media_file, sub_names[sub_file]))
         else:
             log.warning("No subtitle is found.")
+    return matching_subs
+
+
+def rename_subs(path, matching_subs, language, executor=None):
+    """ Rename matching subtitles after their media file
+
+    Arguments:
+        path {str} -- directory of the files
+        matching_subs {list} -- return of match_directory()
+        language {str} -- language suffix of the renamed subtitles
 
-    # Rename matching subtitles
-    for media_file, sub_file in matching_subs:
-        filename, _ = splitext(media_file)
-        _, sub_ext = splitext(sub_file)
-        new_sub = '{0}.{1}{2}'.format(filename, config['SUBTITLE_LANG'], sub_ext)
-        if sub_file != new_sub:
-            log.info("Renaming {0} to {1}".format(sub_file, new_sub))
-            rename(join(path, sub_file), join(path, new_sub))
+    Keyword Arguments:
+        executor {RenameExecutor} -- executor applying the renames (default: {None}, no journal)
+
+    Returns:
+        [dict] -- {subtitle file: new subtitle file} for every subtitle renamed or already named right
+    """
+    plan = plan_renames(path, matching_subs, language)
+    results = (executor or RenameExecutor()).apply(plan)
+    renamed = {op.src: op.dst for op in plan.unchanged}
+    renamed.update((result.op.src, result.op.dst) for result in results if result.ok)
+    return renamed
+
+
+def subtitle_language(sub_info, default):
+    """ Language suffix of a subtitle: the language found in its content, else default
+    """
+    if not sub_info:
+        return default
+
+    def language(sub_file):
+        info = sub_info.get(sub_file)
+        return info.language if info is not None and info.language else default
+    return language
+
+
+def record_state(state, scan, ops):
+    """ Record a directory in the state journal after applying renames ops
+    """
+    new_names = {op.src: op.dst for op in ops}
+    sub_files = [new_names.get(i, i) for i in scan.sub_files]
+    state.record(scan.path, scan.media_files, sub_files, {op.media_file: op.dst for op in ops})
+
+
+def resolve_series(series, db_client, config, episode_index, resolver=None):
+    """ Resolve a series name, fetch its names in the search languages and add its episodes to episode_index
+
+    Arguments:
+        series {str} -- series name of media files
+        db_client {TVShowProvider} -- online database client
+        config {Config} -- loaded config
+        episode_index {EpisodeIndex} -- index to add the episodes to
+
+    Keyword Arguments:
+        resolver {SeriesResolver} -- index of known series names, consulted before searching (default: {None})
+
+    Returns:
+        [dict] -- series table of the series, see update_series_alt_names()
+    """
+    with METRICS.timer('series_resolution'):
+        table = get_series_ids({series: {'series': series}}, db_client, resolver=resolver)
+    with METRICS.timer('alt_names'):
+        table = update_series_alt_names(table, db_client, config=config, resolver=resolver)
+    with METRICS.timer('episode_fetch'):
+        fetch_episodes(table, db_client, config.search_languages, episode_index=episode_index)
+    return table
+
+
+def pending_directory(scan, config, state=None, force=False, dry_run=False):
+    """ Parsed media files and subtitles of a directory that still need matching
+
+    Arguments:
+        scan {DirectoryScan} -- scanned directory
+        config {Config} -- loaded config
+
+    Keyword Arguments:
+        state {StateJournal} -- journal of earlier runs, directories without work are recorded (default: {None})
+        force {bool} -- process every media file (default: {False})
+        dry_run {bool} -- do not record anything (default: {False})
+
+    Returns:
+        [tuple] -- (media files, subtitle files), None if there is nothing to do
+    """
+    if state is not None and not force and state.is_unchanged(scan.path, scan.media_files, scan.sub_files):
+        log.debug("Skipping unchanged directory '{0}'".format(scan.path))
+        return None
+    with METRICS.timer('parse'):
+        media_files = parse_media.parse_file_names(scan.media_files, fformat=config.media_formats)
+    sub_files = scan.sub_files
+    if state is not None and not force:
+        media_files, sub_files = state.pending(scan.path, media_files, sub_files)
+    if not (media_files and sub_files):
+        if state is not None and not dry_run:
+            state.record(scan.path, scan.media_files, scan.sub_files)
+        return None
+    return media_files, sub_files
+
+
+def media_series(media_files):
+    """ Sorted series names of parsed media files
+    """
+    return sorted(set(info['series'] for info in media_files.values()))
+
+
+def _scan_stage(scans, config, directories, submit_series, errors, state=None, force=False, dry_run=False,
+                inspector=None, stop=None):
+    """ Scanner thread of process_directories(): queue every directory with work and start fetching its series
+
+    With an inspector, directories are held back until they have process_batch subtitles, so
+    their subtitles are inspected as one batch big enough for the process pool.
+    The queue ends with None, an exception is appended to errors. Scanning ends early once stop is set.
+    """
+    try:
+        held, held_subs = [], 0
+        for scan in METRICS.timed_iter(scans, 'scan'):
+            if stop is not None and stop.is_set():
+                return
+            pending = pending_directory(scan, config, state=state, force=force, dry_run=dry_run)
+            if pending is None:
+                continue
+            for series in media_series(pending[0]):
+                submit_series(series)
+            held.append((scan, pending[0], pending[1]))
+            held_subs += len(pending[1])
+            if inspector is None or held_subs >= inspector.process_batch:
+                _queue_inspected(directories, held, inspector)
+                held, held_subs = [], 0
+        _queue_inspected(directories, held, inspector)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        directories.put(None)
+
+
+def _queue_inspected(directories, held, inspector=None):
+    sub_infos = [{} for _ in held]
+    if inspector is not None and held:
+        with METRICS.timer('inspect'):
+            sub_infos = inspector.inspect_many([(scan.path, sub_files) for scan, _, sub_files in held])
+    for (scan, media_files, sub_files), sub_info in zip(held, sub_infos):
+        directories.put((scan, media_files, sub_files, sub_info))
+
+
+def _wait_for_series(media_files, series_futures):
+    """ Wait for the series of a directory to be resolved
+
+    Returns:
+        [list] -- series that could not be resolved
+    """
+    failed = []
+    for series in media_series(media_files):
+        try:
+            series_futures[series].result()
+        except Exception as e:
+            log.error("Cannot get metadata of series '{0}': {1}".format(series, e))
+            failed.append(series)
+    return failed
+
+
+def plan_directory(path, media_files, sub_files, series_table, episode_index, config, sub_info=None):
+    """ Match the subtitles of a directory and plan their renames
+
+    Arguments:
+        path {str} -- directory
+        media_files {dict} -- return of parse_media.parse_file_names()
+        sub_files {list} -- subtitle files in the directory
+        series_table {dict} -- return of update_series_alt_names()
+        episode_index {EpisodeIndex} -- episode names of the series
+        config {Config} -- loaded config
+
+    Keyword Arguments:
+        sub_info {dict} -- {subtitle file: sub_content.SubtitleInfo} (default: {None})
+
+    Returns:
+        [RenamePlan] -- plan for the directory
+    """
+    sub_info = sub_info or {}
+    with METRICS.timer('matching'):
+        matching_subs = match_directory(media_files, sub_files, series_table, episode_index, config=config,
+                                        sub_info=sub_info)
+        dir_plan = plan_renames(path, matching_subs, subtitle_language(sub_info, config['SUBTITLE_LANG']))
+    METRICS.incr('renames', len(dir_plan.conflicts), result='conflict')
+    METRICS.incr('renames', len(dir_plan.unchanged), result='unchanged')
+    return dir_plan
+
+
+def _match_stage(directories, series_futures, series_table, episode_index, config, executor, state=None,
+                 dry_run=False):
+    """ Matching side of process_directories(): plan and apply the renames of every queued directory
+
+    Returns:
+        [RenamePlan] -- renames planned for all directories
+    """
+    plan = RenamePlan()
+    # One journal run for the whole call, so --rollback undoes all of it
+    journal = None if dry_run else executor.open_journal()
+    try:
+        for scan, media_files, sub_files, sub_info in iter(directories.get, None):
+            failed = _wait_for_series(media_files, series_futures)
+            dir_plan = plan_directory(scan.path, media_files, sub_files, series_table, episode_index, config,
+                                      sub_info=sub_info)
+            plan.extend(dir_plan)
+            if not dry_run:
+                # A directory whose series failed is not recorded, the next run retries it
+                _apply_directory(scan, dir_plan, executor, journal, state=None if failed else state)
+    finally:
+        if journal is not None:
+            journal.close()
+    return plan
+
+
+def _apply_directory(scan, dir_plan, executor, journal, state=None):
+    with METRICS.timer('rename'):
+        results = executor.apply(dir_plan, journal=journal)
+    METRICS.incr('renames', sum(i.ok for i in results), result='done')
+    METRICS.incr('renames', sum(not i.ok for i in results), result='failed')
+    if state is not None:
+        record_state(state, scan, dir_plan.unchanged + [result.op for result in results if result.ok])
+
+
+def process_directories(scans, db_client, config, state=None, force=False, executor=None, dry_run=False,
+                        resolver=None, inspector=None):
+    """ Match and rename subtitles in scanned directories
+
+    The run is pipelined: a scanner thread parses directories as they are found and starts
+    resolving a series and fetching its episodes as soon as it is first seen, while the calling
+    thread matches and renames every directory as soon as the episodes of its series arrived.
+    Directories are handed over through a bounded queue (PIPELINE_QUEUE_SIZE).
+
+    With a state journal, directories unchanged since the last run are skipped and only media
+    files without a subtitle renamed for them are matched. A series that cannot be resolved is
+    logged and its media files are skipped.
+
+    With an inspector, the scanner thread also inspects the subtitles of every directory, and
+    subtitles are named after the language found in their content (SUBTITLE_LANG if unknown).
+
+    Arguments:
+        scans {iterable} -- parse_media.DirectoryScan of every directory
+        db_client {TVShowProvider} -- online database client
+        config {Config} -- loaded config
+
+    Keyword Arguments:
+        state {StateJournal} -- journal of earlier runs, updated with this run (default: {None})
+        force {bool} -- process every media file, only record the new state (default: {False})
+        executor {RenameExecutor} -- executor applying the renames (default: {None}, no journal)
+        dry_run {bool} -- only print the rename plan (default: {False})
+        resolver {SeriesResolver} -- index of known series names, consulted before searching (default: {None})
+        inspector {SubtitleInspector} -- subtitle content inspector (default: {None}, match on names only)
+
+    Returns:
+        [RenamePlan] -- renames planned for all directories
+    """
+    config = Config.coerce(config)
+    if not config.media_formats:
+        raise ValueError("Missing media file format, define it in config.json MEDIA_FILE_NAME_FORMATS")
+    executor = executor or RenameExecutor()
+
+    episode_index = EpisodeIndex()
+    series_table = {}
+    series_futures = {}
+    directories = queue.Queue(maxsize=config.get('PIPELINE_QUEUE_SIZE', 32))
+    scan_errors = []
+    fetch_pool = ThreadPoolExecutor(max_workers=max(1, getattr(db_client, 'max_workers', 1)))
+
+    def resolve(series):
+        series_table.update(resolve_series(series, db_client, config, episode_index, resolver=resolver))
+
+    def submit_series(series):
+        if series not in series_futures:
+            series_futures[series] = fetch_pool.submit(resolve, series)
+
+    stop = threading.Event()
+    scanner = threading.Thread(target=_scan_stage, args=(scans, config, directories, submit_series, scan_errors),
+                               kwargs={'state': state, 'force': force, 'dry_run': dry_run, 'inspector': inspector,
+                                       'stop': stop},
+                               name='subrename-scan', daemon=True)
+    scanner.start()
+    plan = None
+    try:
+        plan = _match_stage(directories, series_futures, series_table, episode_index, config, executor,
+                            state=state, dry_run=dry_run)
+    finally:
+        if plan is None:
+            # Matching failed: stop the scanner and unblock it, it may be waiting on the full queue
+            stop.set()
+            for _ in iter(directories.get, None):
+                pass
+        fetch_pool.shutdown(wait=False)
+        scanner.join()
+    if scan_errors:
+        raise scan_errors[0]
+
+    if not series_futures:
+        log.info("Nothing to do.")
+    if dry_run:
+        for line in plan.describe():
+            print(line)
+    return plan
+
+
+def _export_metrics(args, config, duration):
+    METRICS.set('run_duration_seconds', duration)
+    METRICS.set('last_run_timestamp_seconds', time.time())
+    json_path = args.metrics_json or config.get('METRICS_JSON')
+    prom_path = args.metrics_prom or config.get('METRICS_PROM')
+    try:
+        if json_path:
+            METRICS.write_json(expanduser(json_path))
+        if prom_path:
+            METRICS.write_prometheus(expanduser(prom_path))
+    except OSError as e:
+        log.error("Cannot write metrics: {0}".format(e))
+
+
+def _save_progress(state, resolver, inspector=None, cache=None):
+    # Everything learned by a run, written even if it failed
+    state.save()
+    resolver.save()
+    if inspector is not None:
+        inspector.save()
+    if cache is not None:
+        cache.flush()
+
+
+def _run_batch(args, db_client, config, executor, state, resolver, cache=None):
+    from subrename.batch import read_manifest, run_batch
+
+    roots = list(args.paths) + (read_manifest(args.manifest) if args.manifest else [])
+    METRICS.reset()
+    start = time.perf_counter()
+    try:
+        report = run_batch(roots, db_client, config, recursive=args.recursive, workers=args.workers,
+                           state=state, force=args.full, executor=executor, dry_run=args.dry_run, resolver=resolver,
+                           inspect=args.inspect or bool(config.get('INSPECT_SUBTITLES')))
+    finally:
+        _save_progress(state, resolver, cache=cache)
+        _export_metrics(args, config, time.perf_counter() - start)
+    if args.report:
+        report.write(expanduser(args.report))
+    for line in report.describe():
+        print(line)
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    path = args.path
+
+    config = load_config(path=args.config)
+    setup_logging(expanduser(config.get('LOG_FILE') or LOG_FILE))
+    media_exts = config.media_exts
+    subtitles_exts = config.subtitles_exts
+    max_workers = config.get('MAX_WORKERS', 8)
+
+    cache = ResponseCache.from_config(config, mode=args.cache_mode) if args.cache_mode else None
+    executor = RenameExecutor(journal_path=expanduser(config.get('RENAME_JOURNAL') or RENAME_JOURNAL),
+                              max_workers=max_workers, per_directory=config.get('RENAMES_PER_DIRECTORY', 2))
+    if args.rollback:
+        executor.rollback()
+        return
+    executor.resume()
+
+    if args.local_db:
+        config = Config(dict(config, LOCAL_DB_PATH=args.local_db, PROVIDERS=['local']))
+    db_client = create_provider(config, cache=cache)
+    state = StateJournal.from_config(config)
+    resolver = SeriesResolver.from_config(config)
+    if args.batch:
+        return _run_batch(args, db_client, config, executor, state, resolver, cache=cache)
+    inspector = None
+    if args.inspect or config.get('INSPECT_SUBTITLES'):
+        inspector = SubtitleInspector.from_config(config)
+        # Before the scanner and fetch threads of process_directories() exist
+        inspector.start()
+
+    scans = parse_media.scan_library(path, media_exts, subtitles_exts, recursive=args.recursive,
+                                     max_workers=max_workers)
+    METRICS.reset()
+    start = time.perf_counter()
+    try:
+        process_directories(scans, db_client, config, state=state, force=args.full,
+                            executor=executor, dry_run=args.dry_run, resolver=resolver, inspector=inspector)
+    finally:
+        _save_progress(state, resolver, inspector=inspector, cache=cache)
+        if inspector is not None and not args.watch:
+            inspector.close()
+        _export_metrics(args, config, time.perf_counter() - start)
+
+    if args.watch and not args.dry_run:
+        from subrename.watch import watch
+
+        def on_change(dir_paths):
+            log.info("Changes in {0}".format(sorted(dir_paths)))
+            dir_scans = [scan for dir_path in dir_paths
+                         for scan in parse_media.scan_library(dir_path, media_exts, subtitles_exts, recursive=False)]
+            start = time.perf_counter()
+            try:
+                process_directories(dir_scans, db_client, config, state=state, executor=executor,
+                                    resolver=resolver, inspector=inspector)
+            except Exception:
+                log.exception("Failed to process {0}".format(sorted(dir_paths)))
+            finally:
+                _save_progress(state, resolver, inspector=inspector, cache=cache)
+                _export_metrics(args, config, time.perf_counter() - start)
+
+        watch(path, on_change, recursive=args.recursive, debounce=config.get('WATCH_DEBOUNCE', 2.0))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,294 @@
+"""Index subtitle file names for episode name and season/episode number matching
+"""
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter, namedtuple
+
+from subrename.aho_corasick import Automaton
+
+log = logging.getLogger('subrename.matcher')
+
+NUMBER_PATTERN = '[0-9]{1,3}'
+PLACEHOLDER = re.compile(r'{(season|episode)}')
+FUZZY_THRESHOLD = 0.85
+DIGITS = re.compile('[0-9]+')
+
+SubtitlePatterns = namedtuple('SubtitlePatterns', ['season_episode', 'episode_only', 'combined'])
+
+
+def normalize_sub_name(sub_file):
+    """ Lower case file name with '.' and '_' turned into spaces
+    """
+    return sub_file.lower().replace('.', ' ').replace('_', ' ')
+
+
+def normalize_text(text):
+    """ NFKC normalized, case folded text with punctuation, symbols and repeated spaces collapsed to one space
+
+    Full-width and half-width forms, '.', '_', '-', brackets and quotes no longer make names differ.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return ' '.join(''.join(' ' if unicodedata.category(c)[0] in 'PSZ' else c for c in text).split())
+
+
+def ngrams(text, n=3):
+    """ Set of the n character substrings of text, the text itself if it is shorter
+    """
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def compile_format(fmt, capture=True):
+    """ Turn a format like 'S{season}E{episode}' into a regex
+
+    Literal text is matched case-insensitively (subtitle names are lower cased before matching),
+    placeholders match 1-3 digits.
+
+    Arguments:
+        fmt {str} -- format string with {season} and/or {episode}
+
+    Keyword Arguments:
+        capture {bool} -- use named groups, otherwise non-capturing groups (default: {True})
+
+    Returns:
+        [str] -- regex source
+    """
+    pattern = []
+    position = 0
+    for placeholder in PLACEHOLDER.finditer(fmt):
+        pattern.append(re.escape(fmt[position:placeholder.start()].lower()))
+        if capture:
+            pattern.append('(?P<{0}>{1})'.format(placeholder.group(1), NUMBER_PATTERN))
+        else:
+            pattern.append('(?:{0})'.format(NUMBER_PATTERN))
+        position = placeholder.end()
+    pattern.append(re.escape(fmt[position:].lower()))
+    return ''.join(pattern)
+
+
+def compile_sub_formats(season_episode_formats=(), episode_only_formats=()):
+    """ Compile subtitle number formats once, to be shared by all SubtitleIndex instances
+
+    Arguments:
+        season_episode_formats {iterable} -- formats with {season} and {episode}
+        episode_only_formats {iterable} -- formats with {episode}
+
+    Returns:
+        [SubtitlePatterns] -- per-format patterns and a combined pattern of all formats (None without formats)
+    """
+    season_episode_formats = list(season_episode_formats)
+    episode_only_formats = list(episode_only_formats)
+    # One pass over a name with all formats tells whether any per-format search can match
+    combined = [compile_format(i, capture=False) for i in season_episode_formats + episode_only_formats]
+    return SubtitlePatterns(tuple(re.compile(compile_format(i)) for i in season_episode_formats),
+                            tuple(re.compile(compile_format(i)) for i in episode_only_formats),
+                            re.compile('|'.join(combined)) if combined else None)
+
+
+class SubtitleIndex:
+    """ Parse every subtitle name once and index it by (season, episode) and by episode number
+
+    For each format only its first occurrence in a name is considered, and lookups return
+    subtitles in their original order, the same priority as scanning the list one by one.
+    """
+
+    def __init__(self, sub_files, season_episode_formats=(), episode_only_formats=(), patterns=None):
+        self.sub_files = list(sub_files)
+        self._normalized = [normalize_sub_name(i) for i in self.sub_files]
+        if patterns is None:
+            patterns = compile_sub_formats(season_episode_formats, episode_only_formats)
+        self._season_episode_patterns = patterns.season_episode
+        self._episode_patterns = patterns.episode_only
+        self._combined = patterns.combined
+
+        self._by_season_episode = {}
+        self._by_episode = {}
+        for index, name in enumerate(self._normalized):
+            self._index_name(index, name)
+
+    def _index_name(self, index, name):
+        if self._combined is None or not self._combined.search(name):
+            return
+
+        for pattern in self._season_episode_patterns:
+            match = pattern.search(name)
+            if match:
+                key = (int(match.group('season')), int(match.group('episode')))
+                self._add(self._by_season_episode, key, index)
+
+        for pattern in self._episode_patterns:
+            match = pattern.search(name)
+            if match:
+                self._add(self._by_episode, int(match.group('episode')), index)
+
+    @staticmethod
+    def _add(table, key, index):
+        indexes = table.setdefault(key, [])
+        if not indexes or indexes[-1] != index:
+            indexes.append(index)
+
+    def _first_with_series_name(self, indexes, series_names):
+        series_names = [sn.lower() for sn in series_names]
+        for index in indexes:
+            if any(sn in self._normalized[index] for sn in series_names):
+                return self.sub_files[index]
+
+    def match_season_episode(self, season, episode, series_names):
+        """ Match by season/episode number
+
+        Requires series name in subtitle file name
+
+        Arguments:
+            season {int} -- season number
+            episode {int} -- episode number
+            series_names {set} -- series names in all languages
+
+        Returns:
+            [str] -- if match is found, return matching file name, otherwise None
+        """
+        sub_file = self._first_with_series_name(self._by_season_episode.get((season, episode), ()), series_names)
+        if sub_file:
+            log.info("S/E match is found '{0}'".format(sub_file))
+        return sub_file
+
+    def match_episode(self, episode, series_names):
+        """ Match by episode number only
+
+        Requires series name in subtitle file name
+
+        Arguments:
+            episode {int} -- episode number
+            series_names {set} -- series names in all languages
+
+        Returns:
+            [str] -- if match is found, return matching file name, otherwise None
+        """
+        sub_file = self._first_with_series_name(self._by_episode.get(episode, ()), series_names)
+        if sub_file:
+            log.info("Episode number match is found '{0}'".format(sub_file))
+        return sub_file
+
+
+class EpisodeNameIndex:
+    """ Find which episode names occur in which subtitle names
+
+    All episode names of a series (in all languages) go into one automaton, and every
+    lower cased subtitle name is streamed through it once. For every name only the first
+    subtitle containing it is kept.
+
+    Arguments:
+        names {iterable} -- episode names
+        sub_files {list} -- subtitle files
+    """
+
+    def __init__(self, names, sub_files):
+        self.sub_files = list(sub_files)
+        automaton = Automaton(set(name.lower() for name in names if name))
+        self._first_sub = {}
+        for index, sub_file in enumerate(self.sub_files):
+            for pattern_index in automaton.find_all(sub_file.lower()):
+                self._first_sub.setdefault(automaton.patterns[pattern_index], index)
+
+    def match(self, names):
+        """ Match by exact name
+
+        Arguments:
+            names {iterable} -- possible episode names in different languages, tried in order
+
+        Returns:
+            [str] -- if match is found, return matching file name, otherwise None
+        """
+        for name in names:
+            index = self._first_sub.get(name.lower())
+            if index is not None:
+                sub_file = self.sub_files[index]
+                log.info('Name match FOUND: {0} in {1}'.format(name, sub_file))
+                return sub_file
+
+
+class FuzzyNameIndex:
+    """ Approximate episode name matching through an n-gram inverted index
+
+    Subtitle names (without extension) are normalized with normalize_text() and indexed by their
+    character trigrams. For an episode name, the subtitles sharing the most trigrams with it are
+    the only candidates scored: the fraction of the normalized name found, in order, in the
+    subtitle name, counting only runs of at least MIN_BLOCK characters so letters scattered over
+    the series name and episode tags add nothing. The best candidate scoring at least `threshold`
+    matches. Numbers are never approximated, a candidate must contain every number of the name.
+
+    Arguments:
+        sub_files {list} -- subtitle files
+
+    Keyword Arguments:
+        threshold {float} -- minimum score between 0 and 1 (default: {FUZZY_THRESHOLD})
+        max_candidates {int} -- subtitles scored per name (default: {5})
+    """
+    N = 3
+    MIN_LENGTH = 4
+    MIN_BLOCK = 3
+
+    def __init__(self, sub_files, threshold=FUZZY_THRESHOLD, max_candidates=5):
+        self.sub_files = list(sub_files)
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self._normalized = [normalize_text(os.path.splitext(i)[0]) for i in self.sub_files]
+        self._postings = {}
+        self._numbers = {}
+        for index, name in enumerate(self._normalized):
+            for gram in ngrams(name, self.N):
+                self._postings.setdefault(gram, []).append(index)
+            for number in set(DIGITS.findall(name)):
+                self._numbers.setdefault(number, set()).add(index)
+
+    def best(self, name):
+        """ Best scoring subtitle for one name
+
+        Returns:
+            [tuple] -- (subtitle index, score), (None, 0.0) without candidates
+        """
+        from difflib import SequenceMatcher
+
+        query = normalize_text(name)
+        if len(query) < self.MIN_LENGTH:
+            return None, 0.0
+        allowed = None
+        for number in set(DIGITS.findall(query)):
+            with_number = self._numbers.get(number, set())
+            allowed = with_number if allowed is None else allowed & with_number
+        if allowed is not None and not allowed:
+            return None, 0.0
+        counts = Counter()
+        for gram in ngrams(query, self.N):
+            postings = self._postings.get(gram, ())
+            counts.update(postings if allowed is None else [i for i in postings if i in allowed])
+        best = (None, 0.0)
+        for index, _ in counts.most_common(self.max_candidates):
+            matcher = SequenceMatcher(None, query, self._normalized[index], autojunk=False)
+            score = sum(block.size for block in matcher.get_matching_blocks()
+                        if block.size >= self.MIN_BLOCK) / len(query)
+            if score > best[1] or (score == best[1] and best[0] is not None and index < best[0]):
+                best = (index, score)
+        return best
+
+    def match(self, names):
+        """ Match by approximate name
+
+        Arguments:
+            names {iterable} -- possible episode names in different languages
+
+        Returns:
+            [str] -- best matching file name scoring at least the threshold, otherwise None
+        """
+        best = (None, 0.0)
+        for name in names:
+            index, score = self.best(name)
+            if index is not None and (score > best[1] or (score == best[1] and index < best[0])):
+                best = (index, score)
+        index, score = best
+        if index is not None and score >= self.threshold:
+            sub_file = self.sub_files[index]
+            log.info('Fuzzy name match FOUND: {0} ({1:.2f})'.format(sub_file, score))
+            return sub_file
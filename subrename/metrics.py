@@ -0,0 +1,206 @@
+"""Run instrumentation: stage timers, counters and latency histograms
+
+Metrics are collected in the module level registry METRICS and exported as a JSON run summary
+or as a Prometheus textfile-collector file.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = 'subrename_'
+
+HELP = {
+    'stage_seconds': ('counter', 'Seconds spent in a run stage, summed over threads'),
+    'stage_calls': ('counter', 'Number of times a run stage was entered'),
+    'http_requests': ('counter', 'HTTP requests to the online database by endpoint and status'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'http_retries': ('counter', 'Retried HTTP requests by endpoint and reason (status code or error)'),
+    'rate_limit_wait_seconds': ('counter', 'Seconds requests waited for the client rate limit'),
+    'cache_requests': ('counter', 'Response cache lookups by endpoint and result (hit, stale, miss)'),
+    'provider_requests': ('counter', 'Provider calls by provider, method and result'),
+    'hedged_requests': ('counter', 'Calls also sent to the next provider after HEDGE_AFTER'),
+    'coalesced_requests': ('counter', 'Calls answered by an identical call already in flight'),
+    'series_resolutions': ('counter', 'Series names resolved by the local index or by searching'),
+    'subtitle_inspections': ('counter', 'Subtitle files inspected, answered from the cache or unreadable'),
+    'matches': ('counter', 'Media files by the matching tier that found their subtitle'),
+    'renames': ('counter', 'Rename operations by result'),
+    'run_duration_seconds': ('gauge', 'Wall clock duration of the last run'),
+    'last_run_timestamp_seconds': ('gauge', 'Unix time the last run finished'),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(key, _escape(value)) for key, value in items) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """ Thread safe registry of counters, gauges and histograms with optional labels
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _labels_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage):
+        """ Time a block as a run stage, ex: with METRICS.timer('scan'): ...
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.incr('stage_seconds', time.perf_counter() - start, stage=stage)
+            self.incr('stage_calls', stage=stage)
+
+    def timed_iter(self, iterable, stage):
+        """ Iterate, timing only the time spent producing items (lazy scanners)
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def merge_counters(self, counters):
+        """ Add counters of another registry, ex: a worker process, given as summary()['counters']
+        """
+        for name, entries in counters.items():
+            for entry in entries:
+                self.incr(name, entry['value'], **entry['labels'])
+
+    def value(self, name, **labels):
+        """ Current value of a counter or gauge, 0 if never set
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    def summary(self):
+        """ JSON serializable snapshot of every metric
+        """
+        def entries(table, render):
+            result = {}
+            for (name, labels), value in sorted(table.items()):
+                result.setdefault(name, []).append({'labels': dict(labels), 'value': render(value)})
+            return result
+
+        with self._lock:
+            return {
+                'counters': entries(self._counters, lambda v: v),
+                'gauges': entries(self._gauges, lambda v: v),
+                'histograms': entries(self._histograms, lambda h: {
+                    'count': h.count, 'sum': h.sum,
+                    'buckets': [['+Inf' if b == float('inf') else b, c] for b, c in h.cumulative()]}),
+            }
+
+    def prometheus(self):
+        """ Metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            names = sorted(set(name for name, _ in list(self._counters) + list(self._gauges) +
+                               list(self._histograms)))
+            for name in names:
+                metric_type, help_text = HELP.get(name, ('untyped', name))
+                full_name = PREFIX + name + ('_total' if metric_type == 'counter' else '')
+                lines.append('# HELP {0} {1}'.format(full_name, help_text))
+                lines.append('# TYPE {0} {1}'.format(full_name, metric_type))
+                for (metric, labels), value in sorted(list(self._counters.items()) + list(self._gauges.items())):
+                    if metric == name:
+                        lines.append('{0}{1} {2}'.format(full_name, _format_labels(labels), value))
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append('{0}_bucket{1} {2}'.format(full_name, _format_labels(labels, [('le', le)]),
+                                                                count))
+                    lines.append('{0}_sum{1} {2}'.format(full_name, _format_labels(labels), histogram.sum))
+                    lines.append('{0}_count{1} {2}'.format(full_name, _format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_atomic(path, text):
+        dir_name = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dir_name, exist_ok=True)
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as fn:
+            fn.write(text)
+        os.replace(tmp_path, path)
+
+    def write_json(self, path):
+        self._write_atomic(path, json.dumps(self.summary(), indent=2, ensure_ascii=False))
+
+    def write_prometheus(self, path):
+        """ Write a textfile-collector file, atomically so the collector never reads half a file
+        """
+        self._write_atomic(path, self.prometheus())
+
+
+METRICS = Metrics()
@@ -2,13 +2,25 @@
 """
 import os
 import logging
-from parse import parse
-from pprint import pformat
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
 
-from subrename.utils import load_config
+from subrename.utils import Config, load_config
 
 log = logging.getLogger('subrename.parse_media')
 
+DirectoryScan = namedtuple('DirectoryScan', ['path', 'media_files', 'sub_files'])
+
+DEFAULT_MEDIA_FORMAT = '{series} - S{season}E{episode} - {quality}'
+FIELD_PATTERNS = {
+    'season': '[0-9]+',
+    'episode': '[0-9]+',
+    'absolute': '[0-9]+',
+}
+FIELD = re.compile(r'{(\w+)}')
+
 
 def get_file_names(path, exts):
     """Scan existing media file names
@@ -24,12 +36,142 @@ def get_file_names(path, exts):
 
     file_names = os.listdir(path)
     file_names = [file_name for file_name in file_names if any(file_name.lower().endswith(ext) for ext in exts)]
-    log.debug("Found files:")
-    log.debug(pformat(file_names))
+    if log.isEnabledFor(logging.DEBUG):
+        from pprint import pformat
+        log.debug("Found files:")
+        log.debug(pformat(file_names))
     return file_names
 
 
-def parse_file_name(file_name, fformat='{series} - S{season}E{episode} - {quality}'):
+def _scan_directory(path, media_exts, sub_exts):
+    """ Classify the entries of one directory using the data os.scandir already has
+
+    Returns:
+        [tuple] -- (DirectoryScan, list of sub directory paths)
+    """
+    media_files, sub_files, sub_dirs = [], [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(entry.path)
+                elif entry.is_file():
+                    name = entry.name.lower()
+                    if name.endswith(media_exts):
+                        media_files.append(entry.name)
+                    elif name.endswith(sub_exts):
+                        sub_files.append(entry.name)
+    except OSError as e:
+        log.warning("Cannot scan '{0}': {1}".format(path, e))
+    return DirectoryScan(path, sorted(media_files), sorted(sub_files)), sorted(sub_dirs)
+
+
+def scan_library(root, media_exts, sub_exts, recursive=True, max_workers=1):
+    """ Walk a library and classify media and subtitle files in one pass
+
+    Directories are yielded lazily as they are scanned, directories without any media or
+    subtitle file are skipped. Hidden entries are ignored.
+
+    Arguments:
+        root {str} -- library root
+        media_exts {iterable} -- media file extensions
+        sub_exts {iterable} -- subtitle file extensions
+
+    Keyword Arguments:
+        recursive {bool} -- walk sub directories (default: {True})
+        max_workers {int} -- scan sub trees on this many threads (default: {1})
+
+    Yields:
+        [DirectoryScan] -- (path, media file names, subtitle file names) of one directory
+    """
+    media_exts = tuple(ext.lower() for ext in media_exts)
+    sub_exts = tuple(ext.lower() for ext in sub_exts)
+
+    if max_workers <= 1 or not recursive:
+        pending = [root]
+        while pending:
+            scan, sub_dirs = _scan_directory(pending.pop(), media_exts, sub_exts)
+            if scan.media_files or scan.sub_files:
+                yield scan
+            if recursive:
+                pending.extend(reversed(sub_dirs))
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_scan_directory, root, media_exts, sub_exts)}
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                scan, sub_dirs = future.result()
+                futures.update(executor.submit(_scan_directory, i, media_exts, sub_exts) for i in sub_dirs)
+                if scan.media_files or scan.sub_files:
+                    yield scan
+
+
+@lru_cache(maxsize=None)
+def compile_media_format(fformat):
+    """ Compile a file name format like '{series} - S{season}E{episode} - {quality}' into a regex
+
+    Like the parse library, matching is case insensitive and the whole name has to match.
+    Number fields match digits, any other field matches at least one character.
+
+    Arguments:
+        fformat {str} -- file name format
+
+    Returns:
+        [re.Pattern] -- compiled pattern with a named group per field
+    """
+    pattern = []
+    position = 0
+    for field in FIELD.finditer(fformat):
+        pattern.append(re.escape(fformat[position:field.start()]))
+        pattern.append('(?P<{0}>{1})'.format(field.group(1), FIELD_PATTERNS.get(field.group(1), '.+?')))
+        position = field.end()
+    pattern.append(re.escape(fformat[position:]))
+    return re.compile(''.join(pattern) + r'\Z', re.IGNORECASE)
+
+
+def media_formats(config):
+    """ Media file name formats from config, MEDIA_FILE_NAME_FORMATS first
+
+    Arguments:
+        config {dict} -- loaded config
+
+    Returns:
+        [list] -- formats in the order they are tried
+    """
+    formats = list(config.get('MEDIA_FILE_NAME_FORMATS') or [])
+    if config.get('MEDIA_FILE_NAME_FORMAT') and config['MEDIA_FILE_NAME_FORMAT'] not in formats:
+        formats.append(config['MEDIA_FILE_NAME_FORMAT'])
+    return formats
+
+
+def _media_info(match):
+    fields = match.groupdict()
+    # A looser format can leave the separator of a stricter one in the name, ex: 'Show -'
+    series = fields['series'].rstrip(' -._').strip()
+    if ' ' not in series:
+        # scene style names separate words with dots or underscores
+        series = series.replace('.', ' ').replace('_', ' ').strip()
+    absolute = int(fields['absolute']) if fields.get('absolute') else None
+    if fields.get('episode'):
+        episode = int(fields['episode'])
+    elif absolute is not None:
+        episode = absolute
+    else:
+        return None
+
+    info = {'series': series,
+            'season': int(fields['season']) if fields.get('season') else None,
+            'episode': episode}
+    if absolute is not None:
+        info['absolute'] = absolute
+    return info
+
+
+def parse_file_name(file_name, fformat=DEFAULT_MEDIA_FORMAT):
     """ Parse file name to get series/season/episode info
 
     Arguments:
@@ -41,35 +183,100 @@ def parse_file_name(file_name, fformat='{series} - S{season}E{episode} - {qualit
     Returns:
         [dict] -- a dict including series/season/episode info
     """
-    p = parse(fformat, file_name)
-    if p:
-        return {'series': p['series'],
-                'season': int(p['season']),
-                'episode': int(p['episode'])}
+    match = compile_media_format(fformat).match(file_name)
+    if match:
+        return _media_info(match)
+
+
+class MediaNameParser:
+    """ Try several file name formats in order, the first format giving an episode wins
+
+    Results do not depend on the order names are parsed in.
+
+    Arguments:
+        formats {list} -- file name formats, a single format string is accepted as well
+    """
+
+    def __init__(self, formats):
+        if isinstance(formats, str):
+            formats = [formats]
+        if not formats:
+            raise ValueError("At least one media file name format is required")
+        self.formats = list(formats)
+        self._patterns = [compile_media_format(i) for i in self.formats]
+
+    def parse(self, file_name):
+        """ Parse one file name
+
+        Returns:
+            [dict] -- series/season/episode info, None if no format matches
+        """
+        for pattern in self._patterns:
+            match = pattern.match(file_name)
+            if match:
+                info = _media_info(match)
+                if info:
+                    return info
+
+    def parse_many(self, file_names):
+        """ Parse a directory listing, names not matching any format are dropped
+
+        Returns:
+            [dict] -- filenames <--> series/season/episode mapping
+        """
+        medias = {}
+        for file_name in file_names:
+            info = self.parse(file_name)
+            if info:
+                medias[file_name] = info
+            else:
+                log.debug("Cannot parse media file name '{0}'".format(file_name))
+        return medias
+
+
+def parse_file_names(file_names, fformat):
+    """ Parse a batch of media file names, names not matching any format are dropped
+
+    Arguments:
+        file_names {list} -- media file names
+        fformat {str|list} -- file name format, or formats tried in order
+
+    Returns:
+        [dict] -- filenames <--> series/season/episode mapping
+    """
+    return MediaNameParser(fformat).parse_many(file_names)
 
 
-def scan_media(path=None):
+def scan_media(path=None, recursive=False, config=None):
     """
     Scan given path to get a filenames <--> series/season/episode mapping
 
+    Keyword Arguments:
+        path {str} -- directory, default to CWD
+        recursive {bool} -- include sub directories, file names are then relative to path (default: {False})
+        config {Config} -- loaded config (default: {None}, use load_config())
+
     Returns:
         [dict] -- filenames <--> series/season/episode mapping
     """
-    config = load_config()
-    media_file_name_format = config.get('MEDIA_FILE_NAME_FORMAT')
-    media_file_exts = config.get('MEDIA_EXTS')
+    config = Config.coerce(load_config() if config is None else config)
 
     if path is None:
         path = os.getcwd()
-    if not media_file_name_format:
-        raise ValueError("Missing media file format, define it in config.json FILE_NAME_FORMAT")
-    log.info("Scanning '{0}' with format {1}".format(path, media_file_name_format))
-    medias = {}
+    if not config.media_formats:
+        raise ValueError("Missing media file format, define it in config.json MEDIA_FILE_NAME_FORMATS")
+    log.info("Scanning '{0}' with formats {1}".format(path, config.media_formats))
 
-    file_names = get_file_names(path, exts=media_file_exts)
-    for file_name in file_names:
-        info = parse_file_name(file_name, fformat=media_file_name_format)
-        if info:
-            medias[file_name] = info
+    if recursive:
+        file_names = [(os.path.relpath(os.path.join(scan.path, file_name), path), file_name)
+                      for scan in scan_library(path, config.media_exts, (), recursive=True)
+                      for file_name in scan.media_files]
+    else:
+        file_names = [(file_name, file_name) for file_name in get_file_names(path, exts=config.media_exts)]
+    medias = {}
+    parsed = parse_file_names([file_name for _, file_name in file_names], fformat=config.media_formats)
+    for key, file_name in file_names:
+        if file_name in parsed:
+            medias[key] = parsed[file_name]
 
     return medias
@@ -21,3 +21,8 @@ class TVShowProvider(ABC):
     @abstractmethod
     def get_episodes_by_series_id(self):
         pass
+
+    def iter_episodes_by_series_id(self, tvdb_id, language=None):
+        """ Iterate over all episodes of a series, providers able to stream pages should override this
+        """
+        return iter(self.get_episodes_by_series_id(tvdb_id, language=language))
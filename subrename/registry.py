@@ -0,0 +1,196 @@
+"""Registry of metadata providers and the chain combining them
+
+config.json selects the providers in order of preference:
+
+    "PROVIDERS": ["tvdb", "local"],
+    "HEDGE_AFTER": 0.5
+
+Every request goes to the first provider and falls back to the next one when it fails. With
+HEDGE_AFTER (seconds) the next provider is also asked when the current one has not answered within
+that budget, and whichever answers first wins. Identical requests in flight are coalesced.
+"""
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from subrename.local_db import LocalProvider
+from subrename.metrics import METRICS
+from subrename.providers import TVShowProvider
+
+log = logging.getLogger('subrename.registry')
+
+
+def _tvdb(config, cache):
+    from subrename.tvdb_api import TVDBClient, TokenStore
+    return TVDBClient(cache=cache, config=config, token_store=TokenStore.from_config(config))
+
+
+def _local(config, cache):
+    return LocalProvider.from_config(config)
+
+
+PROVIDERS = {
+    'tvdb': _tvdb,
+    'local': _local,
+}
+
+
+def register_provider(name, factory):
+    """ Make a provider available to the PROVIDERS setting
+
+    Arguments:
+        name {str} -- name used in config.json
+        factory {callable} -- function of (config, cache) returning a TVShowProvider
+    """
+    PROVIDERS[name] = factory
+
+
+def provider_names(config):
+    """ Configured provider names, the local database if LOCAL_DB_PATH is set, TheTVDB otherwise
+    """
+    names = config.get('PROVIDERS')
+    if names:
+        return list(names)
+    return ['local'] if config.get('LOCAL_DB_PATH') else ['tvdb']
+
+
+def create_provider(config, cache=None):
+    """ Create the configured providers
+
+    Arguments:
+        config {Config} -- loaded config
+
+    Keyword Arguments:
+        cache {ResponseCache} -- response cache of providers using one (default: {None})
+
+    Returns:
+        [ProviderChain] -- chain of the configured providers
+    """
+    providers = []
+    for name in provider_names(config):
+        if name not in PROVIDERS:
+            raise ValueError("Unknown provider '{0}', use one of {1}".format(name, sorted(PROVIDERS)))
+        providers.append((name, PROVIDERS[name](config, cache)))
+    return ProviderChain(providers, hedge_after=config.get('HEDGE_AFTER'))
+
+
+class ProviderChain(TVShowProvider):
+    """ Providers asked in order, with fallback, optional hedging and request coalescing
+
+    Concurrent calls with the same arguments share one request and receive the same result
+    object, which must not be modified.
+
+    Arguments:
+        providers {list} -- (name, TVShowProvider) pairs in order of preference
+
+    Keyword Arguments:
+        hedge_after {float} -- seconds to wait for a provider before also asking the next one,
+                               None to ask the next one only after a failure (default: {None})
+    """
+
+    def __init__(self, providers, hedge_after=None):
+        super().__init__()
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self.max_workers = max(getattr(provider, 'max_workers', 1) for _, provider in self.providers)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        if hedge_after is not None and len(self.providers) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers * len(self.providers))
+
+    def _call(self, method, *args, **kwargs):
+        key = (method, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            METRICS.incr('coalesced_requests', method=method)
+            return future.result()
+
+        try:
+            future.set_result(self._call_providers(method, args, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def _call_one(self, name, provider, method, args, kwargs):
+        try:
+            result = getattr(provider, method)(*args, **kwargs)
+        except Exception as e:
+            METRICS.incr('provider_requests', provider=name, method=method, result='error')
+            log.warning("Provider '{0}' failed on {1}{2}: {3}".format(name, method, args, e))
+            raise
+        METRICS.incr('provider_requests', provider=name, method=method, result='ok')
+        return result
+
+    def _call_providers(self, method, args, kwargs):
+        if self._executor is None:
+            return self._call_in_order(method, args, kwargs)
+        return self._call_hedged(method, args, kwargs)
+
+    def _call_in_order(self, method, args, kwargs):
+        error = None
+        for name, provider in self.providers:
+            try:
+                return self._call_one(name, provider, method, args, kwargs)
+            except Exception as e:
+                error = e
+        raise error
+
+    def _start_next(self, remaining, pending, method, args, kwargs):
+        # Ask the next provider, False once every provider has been asked
+        item = next(remaining, None)
+        if item is None:
+            return False
+        pending.add(self._executor.submit(self._call_one, item[0], item[1], method, args, kwargs))
+        return True
+
+    def _call_hedged(self, method, args, kwargs):
+        remaining = iter(self.providers)
+        pending = set()
+        errors = []
+        exhausted = not self._start_next(remaining, pending, method, args, kwargs)
+        while pending:
+            done, _ = wait(pending, timeout=None if exhausted else self.hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                exhausted = not self._start_next(remaining, pending, method, args, kwargs)
+                if not exhausted:
+                    METRICS.incr('hedged_requests', method=method)
+                    log.debug("No answer to {0}{1} within {2} s, hedging".format(method, args, self.hedge_after))
+                continue
+            for future in done:
+                pending.discard(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(e)
+                    exhausted = not self._start_next(remaining, pending, method, args, kwargs)
+        raise errors[-1]
+
+    def get_series_by_id(self, tvdb_id, language=None):
+        return self._call('get_series_by_id', tvdb_id, language=language)
+
+    def get_series_by_imdb_id(self, imdb_id):
+        return self._call('get_series_by_imdb_id', imdb_id)
+
+    def find_series_by_name(self, series_name):
+        return self._call('find_series_by_name', series_name)
+
+    def get_episodes_by_series_id(self, tvdb_id, language=None):
+        return self._call('get_episodes_by_series_id', tvdb_id, language=language)
+
+    def iter_episodes_by_series_id(self, tvdb_id, language=None):
+        """ Episodes of the first provider answering, a single provider streams its pages
+        """
+        if len(self.providers) == 1:
+            _, provider = self.providers[0]
+            return provider.iter_episodes_by_series_id(tvdb_id, language=language)
+        return iter(self.get_episodes_by_series_id(tvdb_id, language=language))
@@ -0,0 +1,327 @@
+"""Plan and apply subtitle renames
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger('subrename.renamer')
+
+JOURNAL_KEEP_RUNS = 20
+
+RenameOp = namedtuple('RenameOp', ['directory', 'media_file', 'src', 'dst'])
+Conflict = namedtuple('Conflict', ['directory', 'media_file', 'src', 'dst', 'reason'])
+OpResult = namedtuple('OpResult', ['op', 'ok', 'error', 'latency'])
+
+
+class RenamePlan:
+    """ Deduplicated, conflict checked renames
+
+    Attributes:
+        ops {list} -- RenameOp to apply
+        unchanged {list} -- RenameOp whose subtitle already has the target name
+        conflicts {list} -- Conflict for every match that cannot be applied
+    """
+
+    def __init__(self):
+        self.ops = []
+        self.unchanged = []
+        self.conflicts = []
+
+    def extend(self, other):
+        self.ops += other.ops
+        self.unchanged += other.unchanged
+        self.conflicts += other.conflicts
+        return self
+
+    def describe(self):
+        """ Human readable plan, one line per operation
+        """
+        lines = ['{0}: {1} -> {2}'.format(op.directory, op.src, op.dst) for op in self.ops]
+        lines += ['{0}: CONFLICT {1} -> {2} ({3})'.format(i.directory, i.src, i.dst, i.reason)
+                  for i in self.conflicts]
+        return lines
+
+    def __len__(self):
+        return len(self.ops)
+
+
+def subtitle_name(media_file, sub_file, language):
+    """ Name of a subtitle renamed after its media file, ex: 'show - S01E01 - hd.zh.srt'
+    """
+    filename, _ = os.path.splitext(media_file)
+    _, sub_ext = os.path.splitext(sub_file)
+    return '{0}.{1}{2}'.format(filename, language, sub_ext)
+
+
+def plan_renames(directory, matching_subs, language, exists=os.path.lexists):
+    """ Plan renames of one directory
+
+    A subtitle claimed by more than one media file is renamed for the first one only, two
+    subtitles are never renamed to the same name, and existing files are never overwritten.
+
+    Arguments:
+        directory {str} -- directory of the files
+        matching_subs {list} -- (media file, subtitle file) pairs
+        language {str|callable} -- language suffix, or function of the subtitle file returning it
+
+    Keyword Arguments:
+        exists {callable} -- path existence check (default: {os.path.lexists})
+
+    Returns:
+        [RenamePlan] -- plan for the directory
+    """
+    plan = RenamePlan()
+    claimed = {}
+    targets = {}
+    sources = set(sub_file for _, sub_file in matching_subs)
+    for media_file, sub_file in matching_subs:
+        sub_language = language(sub_file) if callable(language) else language
+        new_sub = subtitle_name(media_file, sub_file, sub_language)
+        if sub_file in claimed:
+            plan.conflicts.append(Conflict(directory, media_file, sub_file, new_sub,
+                                           "subtitle already matched to '{0}'".format(claimed[sub_file])))
+            continue
+        if new_sub in targets:
+            plan.conflicts.append(Conflict(directory, media_file, sub_file, new_sub,
+                                           "target already used by '{0}'".format(targets[new_sub])))
+            continue
+        op = RenameOp(directory, media_file, sub_file, new_sub)
+        if sub_file == new_sub:
+            plan.unchanged.append(op)
+        elif new_sub in sources:
+            plan.conflicts.append(Conflict(directory, media_file, sub_file, new_sub,
+                                           'target is another matching subtitle'))
+            continue
+        elif exists(os.path.join(directory, new_sub)):
+            plan.conflicts.append(Conflict(directory, media_file, sub_file, new_sub, 'target exists'))
+            continue
+        else:
+            plan.ops.append(op)
+        claimed[sub_file] = media_file
+        targets[new_sub] = sub_file
+    for conflict in plan.conflicts:
+        log.warning("Not renaming {0} to {1}: {2}".format(conflict.src, conflict.dst, conflict.reason))
+    return plan
+
+
+class RenameJournal:
+    """ Append-only JSON lines journal of rename operations
+
+    Every operation is written as 'begin' before and 'done' or 'failed' after the rename,
+    records of one run share a run id. Records of a rollback have kind 'rollback' and name the
+    run they undo.
+
+    Keyword Arguments:
+        kind {str} -- 'rename' or 'rollback' (default: {'rename'})
+        undoes {str} -- run id undone by a rollback (default: {None})
+    """
+
+    def __init__(self, path, kind='rename', undoes=None):
+        self.path = path
+        self.run_id = os.urandom(16).hex()
+        self.kind = kind
+        self.undoes = undoes
+        self._lock = threading.Lock()
+        self._fn = None
+
+    def write(self, status, op, **extra):
+        record = {'run': self.run_id, 'kind': self.kind, 'status': status, 'time': time.time(),
+                  'src': os.path.join(op.directory, op.src), 'dst': os.path.join(op.directory, op.dst)}
+        if self.undoes is not None:
+            record['undoes'] = self.undoes
+        record.update(extra)
+        with self._lock:
+            if self._fn is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._fn = open(self.path, 'a')
+            self._fn.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._fn.flush()
+
+    def close(self):
+        with self._lock:
+            if self._fn is not None:
+                os.fsync(self._fn.fileno())
+                self._fn.close()
+                self._fn = None
+
+    @staticmethod
+    def read(path):
+        """ Records of a journal, an unreadable last line (crash mid-write) is ignored
+        """
+        records = []
+        try:
+            with open(path) as fn:
+                for line in fn:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        log.warning("Ignoring broken journal line in '{0}'".format(path))
+        except FileNotFoundError:
+            pass
+        return records
+
+
+def _op_from_record(record):
+    return RenameOp(os.path.dirname(record['src']), None,
+                    os.path.basename(record['src']), os.path.basename(record['dst']))
+
+
+class RenameExecutor:
+    """ Apply a RenamePlan with bounded parallelism per directory
+
+    Arguments:
+        journal_path {str} -- append-only journal, no journal if None (default: {None})
+        max_workers {int} -- total number of renames in flight (default: {8})
+        per_directory {int} -- renames in flight in one directory (default: {2})
+    """
+
+    def __init__(self, journal_path=None, max_workers=8, per_directory=2):
+        self.journal_path = journal_path
+        self.max_workers = max_workers
+        self.per_directory = per_directory
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, directory):
+        with self._lock:
+            if directory not in self._semaphores:
+                self._semaphores[directory] = threading.BoundedSemaphore(self.per_directory)
+            return self._semaphores[directory]
+
+    def _apply(self, op, journal):
+        src = os.path.join(op.directory, op.src)
+        dst = os.path.join(op.directory, op.dst)
+        with self._semaphore(op.directory):
+            start = time.perf_counter()
+            try:
+                if journal is not None:
+                    journal.write('begin', op)
+                if os.path.lexists(dst):
+                    raise FileExistsError("'{0}' exists".format(dst))
+                os.rename(src, dst)
+            except OSError as e:
+                latency = time.perf_counter() - start
+                log.error("Failed to rename {0} to {1}: {2}".format(src, dst, e))
+                if journal is not None:
+                    journal.write('failed', op, error=str(e))
+                return OpResult(op, False, str(e), latency)
+            latency = time.perf_counter() - start
+            log.info("Renamed {0} to {1} in {2:.1f} ms".format(src, dst, latency * 1000))
+            if journal is not None:
+                journal.write('done', op, latency=latency)
+            return OpResult(op, True, None, latency)
+
+    def open_journal(self, kind='rename', undoes=None):
+        """ Journal of one run, to share between several apply() calls and close() after the last one
+
+        Returns:
+            [RenameJournal] -- journal of a new run, None without journal_path
+        """
+        return RenameJournal(self.journal_path, kind=kind, undoes=undoes) if self.journal_path else None
+
+    def apply(self, plan, journal=None):
+        """ Rename every operation of the plan
+
+        Arguments:
+            plan {RenamePlan} -- plan to apply
+
+        Keyword Arguments:
+            journal {RenameJournal} -- journal of the run, left open (default: {None}, a run of its own)
+
+        Returns:
+            [list] -- OpResult in plan order
+        """
+        ops = plan.ops if isinstance(plan, RenamePlan) else list(plan)
+        if not ops:
+            return []
+        own_journal = journal is None
+        if own_journal:
+            journal = self.open_journal()
+        try:
+            if self.max_workers <= 1 or len(ops) == 1:
+                results = [self._apply(op, journal) for op in ops]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ops))) as executor:
+                    results = list(executor.map(lambda op: self._apply(op, journal), ops))
+        finally:
+            if own_journal and journal is not None:
+                journal.close()
+        latencies = sorted(i.latency for i in results)
+        log.info("Applied {0}/{1} renames, median {2:.1f} ms, max {3:.1f} ms".format(
+            sum(i.ok for i in results), len(results),
+            latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+        return results
+
+    def resume(self):
+        """ Finish operations a crashed run started but did not record as done, then compact the journal
+
+        Returns:
+            [list] -- OpResult of the resumed operations
+        """
+        records = RenameJournal.read(self.journal_path)
+        ops = []
+        for record in _unfinished(records):
+            src_exists, dst_exists = os.path.lexists(record['src']), os.path.lexists(record['dst'])
+            if src_exists and not dst_exists:
+                ops.append(_op_from_record(record))
+        if ops:
+            log.info("Resuming {0} unfinished renames".format(len(ops)))
+        results = self.apply(ops)
+        self.compact()
+        return results
+
+    def compact(self, keep_runs=JOURNAL_KEEP_RUNS):
+        """ Rewrite the journal with the 'done' and 'failed' records of its last keep_runs runs
+
+        'begin' records are dropped, so call it only once unfinished runs were resumed, as resume() does.
+
+        Keyword Arguments:
+            keep_runs {int} -- runs kept for rollback (default: {JOURNAL_KEEP_RUNS})
+        """
+        if not self.journal_path:
+            return
+        records = RenameJournal.read(self.journal_path)
+        runs = list(OrderedDict.fromkeys(i['run'] for i in records))
+        keep = set(runs[-keep_runs:])
+        kept = [i for i in records if i['run'] in keep and i['status'] != 'begin']
+        if len(kept) == len(records):
+            return
+        tmp_path = '{0}.{1}.tmp'.format(self.journal_path, os.getpid())
+        with open(tmp_path, 'w') as fn:
+            for record in kept:
+                fn.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.journal_path)
+        log.info("Compacted rename journal from {0} to {1} records".format(len(records), len(kept)))
+
+    def rollback(self, run_id=None):
+        """ Undo the renames of a run, by default the last run neither a rollback nor rolled back
+
+        Returns:
+            [list] -- OpResult of the reverse renames
+        """
+        records = RenameJournal.read(self.journal_path)
+        if run_id is None:
+            undone = set(i.get('undoes') for i in records if i.get('kind') == 'rollback')
+            runs = [i['run'] for i in records if i['status'] == 'done' and i.get('kind', 'rename') != 'rollback'
+                    and i['run'] not in undone]
+            if not runs:
+                return []
+            run_id = runs[-1]
+        ops = [RenameOp(os.path.dirname(i['dst']), None, os.path.basename(i['dst']), os.path.basename(i['src']))
+               for i in reversed(records) if i['run'] == run_id and i['status'] == 'done']
+        log.info("Rolling back {0} renames of run {1}".format(len(ops), run_id))
+        journal = self.open_journal(kind='rollback', undoes=run_id)
+        try:
+            return self.apply(ops, journal=journal)
+        finally:
+            if journal is not None:
+                journal.close()
+
+
+def _unfinished(records):
+    finished = set((i['run'], i['src']) for i in records if i['status'] in ('done', 'failed'))
+    return [i for i in records if i['status'] == 'begin' and (i['run'], i['src']) not in finished]
@@ -0,0 +1,182 @@
+"""Persistent series name resolver
+
+Maps normalized series names and every alias learned from earlier runs (names of media files,
+names in other languages) to series ids, so known series are resolved without any search.
+Names shared by several series are never learned from other names, a year or an override
+has to pick between them every time.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from collections.abc import Mapping
+
+from subrename.matcher import normalize_text
+
+log = logging.getLogger('subrename.resolver')
+
+YEAR = re.compile(r'^(?P<name>.*?\S)[\s._]*[(\[]?(?P<year>(?:19|20)[0-9]{2})[)\]]?$')
+
+
+def split_year(series):
+    """ Split a trailing year off a series name, ex: 'Doctor Who (2005)' -> ('Doctor Who', 2005)
+
+    Returns:
+        [tuple] -- (name, year), year is None without one
+    """
+    match = YEAR.match(series.strip())
+    if match is None:
+        return series, None
+    return match.group('name'), int(match.group('year'))
+
+
+class SeriesResolver:
+    """ Series name to id index persisted as JSON
+
+    Manual overrides come from config.json SERIES_OVERRIDES and win over learned aliases:
+
+        "SERIES_OVERRIDES": {"Planetes": 75796, "Doctor Who": {"year": 2005}}
+
+    An id is used as such, {"name": ..., "year": ...} changes the name searched and picks the
+    series first aired in that year when several share the name.
+
+    Arguments:
+        path {str} -- JSON index file, created on save(), None to keep the index in memory
+
+    Keyword Arguments:
+        overrides {dict} -- {series name: id or {"name", "year"}} (default: {None})
+    """
+    VERSION = 1
+    DEFAULT_PATH = os.path.join('~', '.cache', 'subrename', 'series.json')
+
+    def __init__(self, path=None, overrides=None):
+        self.path = path
+        self._overrides = {normalize_text(name): value for name, value in (overrides or {}).items()}
+        self._aliases = {}
+        self._series = {}
+        self._ambiguous = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    @classmethod
+    def from_config(cls, config):
+        """ Resolver at SERIES_INDEX_PATH with SERIES_OVERRIDES of config.json
+        """
+        path = os.path.expanduser(config.get('SERIES_INDEX_PATH') or cls.DEFAULT_PATH)
+        return cls(path, overrides=config.get('SERIES_OVERRIDES'))
+
+    def _load(self):
+        try:
+            with open(self.path) as fn:
+                data = json.load(fn)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable series index '{0}': {1}".format(self.path, e))
+            return
+        if data.get('version') != self.VERSION:
+            log.warning("Ignoring series index '{0}' of version {1}".format(self.path, data.get('version')))
+            return
+        self._aliases = data.get('aliases', {})
+        self._series = data.get('series', {})
+        self._ambiguous = set(data.get('ambiguous', []))
+
+    def resolve(self, series):
+        """ Id of a series name from the overrides or the learned aliases
+
+        Returns:
+            [int] -- series id, None if the name is unknown
+        """
+        key = normalize_text(series)
+        override = self._overrides.get(key)
+        if override is not None and not isinstance(override, Mapping):
+            return override
+        with self._lock:
+            return self._aliases.get(key)
+
+    def search_query(self, series):
+        """ Name to search for and year the series was first aired in
+
+        Returns:
+            [tuple] -- (name, year), year is None if neither the name nor an override gives one
+        """
+        name, year = split_year(series)
+        override = self._overrides.get(normalize_text(series))
+        if isinstance(override, Mapping):
+            name = override.get('name') or name
+            year = override.get('year') or year
+        return name, year
+
+    def learn(self, series, series_id):
+        """ Remember that a name means series_id, aliases of another series are never replaced
+        """
+        key = normalize_text(series)
+        if not key:
+            return
+        with self._lock:
+            current = self._aliases.get(key)
+            if current is None:
+                self._aliases[key] = series_id
+                self._series.setdefault(str(series_id), {'names': {}})
+                self._dirty = True
+            elif current != series_id:
+                log.warning("'{0}' already means series {1}, not learning it for {2}".format(
+                    series, current, series_id))
+
+    def mark_ambiguous(self, series):
+        """ Remember that a name is shared by several series
+
+        The name is then only learned from itself (learn()), never from the names of a series
+        fetched in other languages (learn_name()), and an alias learned that way is dropped.
+        """
+        key = normalize_text(series)
+        if not key:
+            return
+        with self._lock:
+            if key in self._ambiguous:
+                return
+            self._ambiguous.add(key)
+            self._aliases.pop(key, None)
+            self._dirty = True
+
+    def names(self, series_id):
+        """ Names of a series learned so far
+
+        Returns:
+            [dict] -- {language: name}, name is None if the series has no name in the language
+        """
+        with self._lock:
+            return dict(self._series.get(str(series_id), {}).get('names', {}))
+
+    def learn_name(self, series_id, language, name):
+        """ Remember the name of a series in a language, None if it has none, and learn it as an alias
+
+        Names shared by several series (mark_ambiguous()) are not learned as aliases.
+        """
+        with self._lock:
+            entry = self._series.setdefault(str(series_id), {'names': {}})
+            if language in entry['names'] and entry['names'][language] == name:
+                return
+            entry['names'][language] = name
+            self._dirty = True
+        if name and normalize_text(name) not in self._ambiguous:
+            self.learn(name, series_id)
+
+    def save(self):
+        """ Write the index if it changed, atomically
+        """
+        with self._lock:
+            if self.path is None or not self._dirty:
+                return
+            data = json.dumps({'version': self.VERSION, 'aliases': self._aliases, 'series': self._series,
+                               'ambiguous': sorted(self._ambiguous)},
+                              ensure_ascii=False, sort_keys=True)
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as fn:
+            fn.write(data)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,204 @@
+"""Rate limited, retrying request scheduling for online database clients
+"""
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from subrename.metrics import METRICS
+
+log = logging.getLogger('subrename.scheduler')
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class TokenBucket:
+    """ Allow `rate` acquisitions per second on average and bursts of up to `capacity`
+
+    Thread safe, acquire() blocks until a token is available. pause() holds every caller off,
+    ex: after the server answered 429.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """ Take a token if there is one, else return the seconds to wait
+        """
+        with self._lock:
+            now = self._clock()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """ Wait for a token
+
+        Returns:
+            [float] -- seconds waited
+        """
+        waited = 0.0
+        while True:
+            delay = self._reserve()
+            if not delay:
+                return waited
+            self._sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._tokens = 0.0
+
+
+class RetryBudget:
+    """ Limit retries to a fraction of the requests made
+
+    Every first attempt deposits `ratio` retries, every retry withdraws one, `min_retries` are
+    always available. A failing server thus gets at most ratio extra load instead of max_retries times.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10):
+        self.ratio = ratio
+        self._balance = float(min_retries)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance += self.ratio
+
+    def withdraw(self):
+        """ Take one retry out of the budget
+
+        Returns:
+            [bool] -- True if the retry may be made
+        """
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+def retry_after(response, now=None):
+    """ Seconds asked for by a Retry-After header (delta seconds or HTTP date), None if absent
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None:
+        return None
+    return max(0.0, date.timestamp() - (time.time() if now is None else now))
+
+
+class RequestScheduler:
+    """ Send requests through a token bucket and retry transient failures
+
+    429 and 5xx responses, connection errors and timeouts are retried up to max_retries times,
+    after the Retry-After the server asked for or a jittered exponential backoff, as long as the
+    retry budget allows. A 429 pauses every request of the client, not only the one retried.
+
+    Keyword Arguments:
+        rate {float} -- requests per second (default: {10})
+        burst {int} -- requests allowed at once after idling (default: {20})
+        max_retries {int} -- retries of one request (default: {5})
+        backoff_base {float} -- first backoff in seconds, doubled every retry (default: {0.5})
+        backoff_max {float} -- longest backoff and longest Retry-After honored (default: {60})
+        retry_budget {RetryBudget} -- budget shared by all requests (default: {None}, RetryBudget())
+        retry_exceptions {tuple} -- exception types to retry besides RETRY_EXCEPTIONS (default: {()})
+    """
+    RETRY_EXCEPTIONS = (ConnectionError, TimeoutError)
+
+    def __init__(self, rate=10.0, burst=20, max_retries=5, backoff_base=0.5, backoff_max=60.0, retry_budget=None,
+                 retry_exceptions=(), clock=time.monotonic, sleep=time.sleep, rng=random.random):
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget = retry_budget or RetryBudget()
+        self.retry_exceptions = self.RETRY_EXCEPTIONS + tuple(retry_exceptions)
+        self._sleep = sleep
+        self._rng = rng
+
+    @classmethod
+    def from_config(cls, config, retry_exceptions=()):
+        """ Create a scheduler from the TVDB_RATE_LIMIT, TVDB_BURST, TVDB_MAX_RETRIES and TVDB_RETRY_BUDGET settings
+        """
+        return cls(rate=config.get('TVDB_RATE_LIMIT', 10.0), burst=config.get('TVDB_BURST', 20),
+                   max_retries=config.get('TVDB_MAX_RETRIES', 5),
+                   retry_budget=RetryBudget(ratio=config.get('TVDB_RETRY_BUDGET', 0.2)),
+                   retry_exceptions=retry_exceptions)
+
+    def backoff(self, attempt):
+        """ Full jitter exponential backoff of a retry, attempt counts from 0
+        """
+        return self._rng() * min(self.backoff_max, self.backoff_base * 2 ** attempt)
+
+    def call(self, send, label='other'):
+        """ Send a request, retrying transient failures
+
+        Arguments:
+            send {callable} -- function without arguments sending the request, returns the response
+
+        Keyword Arguments:
+            label {str} -- endpoint name for logs and metrics (default: {'other'})
+
+        Returns:
+            [Response] -- last response, may still be a 429 or 5xx once retries are exhausted
+        """
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            if waited:
+                METRICS.incr('rate_limit_wait_seconds', waited, endpoint=label)
+            try:
+                response = send()
+            except self.retry_exceptions as e:
+                if not self._may_retry(attempt, label, type(e).__name__):
+                    raise
+                delay = self.backoff(attempt)
+                log.warning("Request to {0} failed ({1}), retrying in {2:.1f} s".format(label, e, delay))
+            else:
+                if response.status_code not in RETRY_STATUSES or \
+                        not self._may_retry(attempt, label, str(response.status_code)):
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                delay = min(delay, self.backoff_max)
+                if response.status_code == 429:
+                    self.bucket.pause(delay)
+                log.warning("{0} answered {1}, retrying in {2:.1f} s".format(label, response.status_code, delay))
+            self._sleep(delay)
+            attempt += 1
+
+    def _may_retry(self, attempt, label, reason):
+        if attempt >= self.max_retries:
+            return False
+        if not self.retry_budget.withdraw():
+            log.warning("Retry budget exhausted, not retrying {0}".format(label))
+            return False
+        METRICS.incr('http_retries', endpoint=label, reason=reason)
+        return True
@@ -0,0 +1,145 @@
+"""Per-directory state journal for incremental re-runs
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger('subrename.state')
+
+
+def fingerprint(media_files, sub_files):
+    """ Content fingerprint of a directory from its media and subtitle names
+
+    Arguments:
+        media_files {iterable} -- media file names
+        sub_files {iterable} -- subtitle file names
+
+    Returns:
+        [str] -- hex digest
+    """
+    digest = hashlib.sha1()
+    for kind, names in (('m', media_files), ('s', sub_files)):
+        for name in sorted(names):
+            digest.update('{0}:{1}\0'.format(kind, name).encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+class StateJournal:
+    """ Remember what has been done in every directory
+
+    For each directory the journal stores its mtime, the fingerprint of its media and subtitle
+    names after the last run, and the renames already applied ({media file: renamed subtitle}).
+
+    Arguments:
+        path {str} -- JSON state file, created on save()
+    """
+    VERSION = 1
+    DEFAULT_PATH = os.path.join('~', '.cache', 'subrename', 'state.json')
+
+    def __init__(self, path):
+        self.path = path
+        self._dirs = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path) as fn:
+                data = json.load(fn)
+            if data.get('version') == self.VERSION:
+                self._dirs = data.get('dirs', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable state file '{0}': {1}".format(path, e))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(os.path.expanduser(config.get('STATE_PATH') or cls.DEFAULT_PATH))
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+
+    def is_unchanged(self, path, media_files, sub_files):
+        """ Whether a directory still looks like it did after the last run
+
+        Arguments:
+            path {str} -- directory
+            media_files {iterable} -- media file names currently in the directory
+            sub_files {iterable} -- subtitle file names currently in the directory
+
+        Returns:
+            [bool] -- True if mtime and fingerprint are both unchanged
+        """
+        entry = self._dirs.get(self._key(path))
+        if entry is None:
+            return False
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+        return entry['mtime'] == mtime and entry['fingerprint'] == fingerprint(media_files, sub_files)
+
+    def renames(self, path):
+        """ Renames applied in a directory by earlier runs
+
+        Returns:
+            [dict] -- {media file: renamed subtitle}
+        """
+        return dict(self._dirs.get(self._key(path), {}).get('renames', {}))
+
+    def pending(self, path, media_files, sub_files):
+        """ Drop media files already given a subtitle and the subtitles renamed for them
+
+        Arguments:
+            path {str} -- directory
+            media_files {dict} -- media file name to parsed info
+            sub_files {list} -- subtitle file names
+
+        Returns:
+            [tuple] -- (media files, subtitle files) that still need matching
+        """
+        renames = self.renames(path)
+        sub_names = set(sub_files)
+        done = {media for media, sub in renames.items() if sub in sub_names and media in media_files}
+        done_subs = set(renames[media] for media in done)
+        return ({media: info for media, info in media_files.items() if media not in done},
+                [sub for sub in sub_files if sub not in done_subs])
+
+    def record(self, path, media_files, sub_files, renames=None):
+        """ Record the state of a directory after processing it
+
+        Arguments:
+            path {str} -- directory
+            media_files {iterable} -- media file names after processing
+            sub_files {iterable} -- subtitle file names after processing
+
+        Keyword Arguments:
+            renames {dict} -- renames applied in this run, {media file: renamed subtitle} (default: {None})
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        key = self._key(path)
+        with self._lock:
+            entry = self._dirs.setdefault(key, {'renames': {}})
+            entry['mtime'] = mtime
+            entry['fingerprint'] = fingerprint(media_files, sub_files)
+            entry['renames'].update(renames or {})
+            self._dirty = True
+
+    def save(self):
+        """ Atomically write the journal if anything changed
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            dir_name = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(dir_name, exist_ok=True)
+            tmp_path = '{0}.tmp'.format(self.path)
+            with open(tmp_path, 'w') as fn:
+                json.dump({'version': self.VERSION, 'dirs': self._dirs}, fn, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
@@ -0,0 +1,382 @@
+"""Content inspection of subtitle files: encoding, language and ASS title
+
+Only a bounded prefix of every file is read through mmap. The encoding is sniffed from byte
+order marks, UTF-16 zero byte patterns, strict UTF-8 decoding, and otherwise the legacy CJK
+encoding whose decoding contains the most common characters. The language is classified from
+a histogram of the scripts of the dialogue text, and ASS files give their [Script Info] Title,
+which often names the series and episode of subtitles named only '1.ass' or 'track3.ass'.
+"""
+import codecs
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+from bisect import bisect_right
+from collections import Counter, namedtuple
+
+from subrename.metrics import METRICS
+
+log = logging.getLogger('subrename.sub_content')
+
+PREFIX_BYTES = 64 * 1024
+SNIFF_BYTES = 16 * 1024
+MIN_LETTERS = 20
+LEGACY_ENCODINGS = ('gb18030', 'big5', 'shift_jis', 'euc_kr')
+BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+# Frequent characters of Chinese (simplified, traditional), Korean and CJK punctuation; hiragana
+# is counted as a whole. Decoding with the wrong legacy encoding turns text into rare characters.
+COMMON_CHARS = frozenset(
+    '的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后'
+    '作里用道行所然家种事成方多经么去法学如都同现当没动面起看定天分还进好小部其些主样理心她本前开但因只'
+    '從這個們來為國說時會對於過後裡現當沒動還進麼實'
+    '이다는의에가을를하고지서한게요도니나어아그수사들있로것해대'
+    '，。！？、「」…')
+ENGLISH_WORDS = frozenset(['the', 'you', 'and', 'to', 'is', 'it', 'of', 'that', 'what', 'i', 'a', 'in', 'me',
+                           'this', 'we', 'for', 'your', 'on', 'have', 'be', 'no', 'not', 'do', 'are'])
+UNTITLED = frozenset(['', 'default aegisub file', '<untitled>', 'untitled'])
+MARKUP = re.compile(r'{[^}]*}|<[^>]*>|\\[Nnh]')
+WORD = re.compile(r'[^\W\d_]+')
+# (first, last code point, script), sorted
+SCRIPT_RANGES = ((0x0, 0x24f, 'latin'), (0x370, 0x3ff, 'greek'), (0x400, 0x4ff, 'cyrillic'),
+                 (0x590, 0x5ff, 'hebrew'), (0x600, 0x6ff, 'arabic'), (0xe00, 0xe7f, 'thai'),
+                 (0x1100, 0x11ff, 'hangul'), (0x3040, 0x30ff, 'kana'), (0x3130, 0x318f, 'hangul'),
+                 (0x31f0, 0x31ff, 'kana'), (0x3400, 0x4dbf, 'han'), (0x4e00, 0x9fff, 'han'),
+                 (0xac00, 0xd7a3, 'hangul'), (0xf900, 0xfaff, 'han'), (0xff66, 0xff9d, 'kana'))
+SCRIPT_STARTS = [i[0] for i in SCRIPT_RANGES]
+
+SubtitleInfo = namedtuple('SubtitleInfo', ['encoding', 'language', 'title'])
+
+
+def _decode(data, encoding, errors='strict'):
+    # Incremental decoding tolerates a multi-byte character cut off at the end of the prefix
+    return codecs.getincrementaldecoder(encoding)(errors).decode(data, final=False)
+
+
+def _common_count(text):
+    return sum(1 for c in text if c in COMMON_CHARS or 'ぁ' <= c <= 'ゟ')
+
+
+def sniff_encoding(data):
+    """ Guess the encoding of the start of a subtitle file
+
+    Arguments:
+        data {bytes} -- file prefix
+
+    Returns:
+        [str] -- codec name
+    """
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    sample = data[:SNIFF_BYTES]
+    encoding = _sniff_utf16(sample)
+    if encoding is not None:
+        return encoding
+    try:
+        _decode(sample, 'utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return _sniff_legacy(sample)
+
+
+def _sniff_utf16(sample):
+    # Mostly ASCII UTF-16 has zeros at one parity only, CJK characters such as '一' (00 4E) add a few
+    # at the other one
+    if len(sample) < 4:
+        return None
+    even_zeros = sample[0::2].count(0)
+    odd_zeros = sample[1::2].count(0)
+    if odd_zeros > len(sample) // 6 and even_zeros < odd_zeros // 4:
+        return 'utf-16-le'
+    if even_zeros > len(sample) // 6 and odd_zeros < even_zeros // 4:
+        return 'utf-16-be'
+
+
+def _sniff_legacy(sample):
+    # The legacy encoding whose decoding has the most common characters
+    best, best_count = None, 0
+    for encoding in LEGACY_ENCODINGS:
+        try:
+            count = _common_count(_decode(sample, encoding))
+        except UnicodeDecodeError:
+            continue
+        if count > best_count:
+            best, best_count = encoding, count
+    return best or 'cp1252'
+
+
+def dialogue_text(text):
+    """ Spoken text of SRT or ASS/SSA subtitles, without numbers, timings, styles and markup
+    """
+    lines = []
+    is_ass = '[Events]' in text or 'Dialogue:' in text
+    for line in text.splitlines():
+        if is_ass:
+            if line.startswith('Dialogue:'):
+                lines.append(line.split(',', 9)[-1])
+        elif '-->' not in line and not line.strip().isdigit():
+            lines.append(line)
+    return MARKUP.sub(' ', '\n'.join(lines))
+
+
+def script_histogram(text):
+    """ Number of letters of every script in text
+
+    Returns:
+        [Counter] -- {'han'|'kana'|'hangul'|'latin'|'cyrillic'|'greek'|'arabic'|'hebrew'|'thai': count}
+    """
+    counts = Counter(_script(c) for c in text if c.isalpha())
+    del counts[None]
+    return counts
+
+
+def _script(c):
+    o = ord(c)
+    index = bisect_right(SCRIPT_STARTS, o) - 1
+    if index >= 0 and o <= SCRIPT_RANGES[index][1]:
+        return SCRIPT_RANGES[index][2]
+
+
+SCRIPT_LANGUAGES = {'cyrillic': 'ru', 'greek': 'el', 'arabic': 'ar', 'hebrew': 'he', 'thai': 'th'}
+
+
+def classify_language(text):
+    """ Language of dialogue text from the scripts it is written in
+
+    CJK text wins over Latin text mixed in (bilingual subtitles are named after their CJK
+    language), Japanese is told from Chinese by its kana. Latin text is only recognized as
+    English, from its most frequent words.
+
+    Returns:
+        [str] -- language code, None if it cannot be told
+    """
+    counts = script_histogram(text)
+    total = sum(counts.values())
+    if total < MIN_LETTERS:
+        return None
+    cjk = counts['han'] + counts['kana'] + counts['hangul']
+    if cjk >= 0.15 * total:
+        if counts['hangul'] > counts['han'] + counts['kana']:
+            return 'ko'
+        if counts['kana'] >= 0.15 * (counts['han'] + counts['kana']):
+            return 'ja'
+        return 'zh'
+    script, _ = counts.most_common(1)[0]
+    if script == 'latin':
+        words = WORD.findall(text.lower())
+        if words and sum(1 for i in words if i in ENGLISH_WORDS) >= 0.1 * len(words):
+            return 'en'
+        return None
+    return SCRIPT_LANGUAGES.get(script)
+
+
+def ass_title(text):
+    """ Title of the [Script Info] section of an ASS/SSA subtitle, None if it has none
+    """
+    in_info = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            if in_info:
+                break
+            in_info = line.lower() == '[script info]'
+        elif in_info and line.lower().startswith('title:'):
+            title = line[len('title:'):].strip()
+            return title if title.lower() not in UNTITLED else None
+
+
+def read_prefix(path, size=PREFIX_BYTES):
+    """ First size bytes of a file, read through mmap
+    """
+    with open(path, 'rb') as fn:
+        if not os.fstat(fn.fileno()).st_size:
+            return b''
+        with mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:size]
+
+
+def inspect_file(path, prefix_bytes=PREFIX_BYTES):
+    """ Inspect one subtitle file
+
+    Arguments:
+        path {str} -- subtitle file
+
+    Keyword Arguments:
+        prefix_bytes {int} -- bytes read from the start of the file (default: {PREFIX_BYTES})
+
+    Returns:
+        [SubtitleInfo] -- encoding, language (None if unknown) and ASS title (None without one)
+    """
+    data = read_prefix(path, prefix_bytes)
+    encoding = sniff_encoding(data)
+    text = _decode(data, encoding, errors='replace')
+    return SubtitleInfo(encoding, classify_language(dialogue_text(text)), ass_title(text))
+
+
+def _inspect_safe(item):
+    # Runs in worker processes: no logging, errors are returned to the parent
+    path, prefix_bytes = item
+    try:
+        return inspect_file(path, prefix_bytes), None
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+
+class SubtitleInspector:
+    """ Inspect subtitle files, cached by (device, inode, size, mtime) in a JSON file
+
+    A renamed subtitle keeps its cache entry, entries of files not inspected by a run are dropped
+    when it is saved. Batches of at least `process_batch` files not in the cache are inspected on
+    a process pool, smaller batches in the calling thread. Call start() while the process has no
+    other threads to fork the pool then, a pool created on first use spawns its workers instead.
+
+    Arguments:
+        path {str} -- JSON cache file, created on save(), None to cache in memory only
+
+    Keyword Arguments:
+        max_workers {int} -- worker processes (default: {None}, os.cpu_count())
+        prefix_bytes {int} -- bytes read from the start of every file (default: {PREFIX_BYTES})
+        process_batch {int} -- smallest batch sent to the process pool (default: {64})
+    """
+    VERSION = 2
+    DEFAULT_PATH = os.path.join('~', '.cache', 'subrename', 'subtitles.json')
+
+    def __init__(self, path=None, max_workers=None, prefix_bytes=PREFIX_BYTES, process_batch=64):
+        self.path = path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.prefix_bytes = prefix_bytes
+        self.process_batch = process_batch
+        self._entries = {}
+        self._seen = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._pool = None
+        if path is not None:
+            self._load()
+
+    @classmethod
+    def from_config(cls, config):
+        """ Inspector caching in SUBTITLE_INFO_PATH, with INSPECT_WORKERS and INSPECT_BYTES of config.json
+        """
+        path = os.path.expanduser(config.get('SUBTITLE_INFO_PATH') or cls.DEFAULT_PATH)
+        return cls(path, max_workers=config.get('INSPECT_WORKERS'),
+                   prefix_bytes=config.get('INSPECT_BYTES') or PREFIX_BYTES)
+
+    def _load(self):
+        try:
+            with open(self.path) as fn:
+                data = json.load(fn)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable subtitle cache '{0}': {1}".format(self.path, e))
+            return
+        if data.get('version') == self.VERSION and data.get('prefix_bytes') == self.prefix_bytes:
+            self._entries = data.get('files', {})
+
+    @staticmethod
+    def _key(st):
+        # JSON object keys are strings
+        return '{0}:{1}:{2}:{3}'.format(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def inspect(self, directory, sub_files):
+        """ Inspect the subtitle files of a directory
+
+        Arguments:
+            directory {str} -- directory of the files
+            sub_files {list} -- subtitle file names
+
+        Returns:
+            [dict] -- {subtitle file: SubtitleInfo}, files that cannot be read are left out
+        """
+        return self.inspect_many([(directory, sub_files)])[0]
+
+    def inspect_many(self, directories):
+        """ Inspect the subtitle files of several directories as one batch
+
+        Arguments:
+            directories {list} -- (directory, subtitle file names) pairs
+
+        Returns:
+            [list] -- {subtitle file: SubtitleInfo} of every directory, in the same order
+        """
+        infos = [{} for _ in directories]
+        todo = []
+        for index, (directory, sub_files) in enumerate(directories):
+            for sub_file in sub_files:
+                path = os.path.abspath(os.path.join(directory, sub_file))
+                try:
+                    key = self._key(os.stat(path))
+                except OSError as e:
+                    log.warning("Cannot inspect '{0}': {1}".format(path, e))
+                    METRICS.incr('subtitle_inspections', result='failed')
+                    continue
+                with self._lock:
+                    entry = self._entries.get(key)
+                    self._seen.add(key)
+                if entry is not None:
+                    infos[index][sub_file] = SubtitleInfo(*entry[1:])
+                    METRICS.incr('subtitle_inspections', result='cached')
+                else:
+                    todo.append((index, sub_file, path, key))
+
+        results = self._map([(path, self.prefix_bytes) for _, _, path, _ in todo])
+        for (index, sub_file, path, key), (info, error) in zip(todo, results):
+            if info is None:
+                log.warning("Cannot inspect '{0}': {1}".format(path, error))
+                METRICS.incr('subtitle_inspections', result='failed')
+                continue
+            log.debug("Inspected '{0}': {1}".format(path, info))
+            METRICS.incr('subtitle_inspections', result='inspected')
+            infos[index][sub_file] = info
+            with self._lock:
+                self._entries[key] = [path] + list(info)
+                self._dirty = True
+        return infos
+
+    def start(self):
+        """ Start the worker processes, before any thread is started: forking with threads holding locks is unsafe
+        """
+        if self._pool is None and self.max_workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._pool.submit(os.getpid).result()
+
+    def _map(self, items):
+        if len(items) < self.process_batch or self.max_workers <= 1:
+            return [_inspect_safe(item) for item in items]
+        if self._pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Not started by start(), other threads may be running: spawn fresh interpreters rather than fork
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        chunksize = max(1, len(items) // (self.max_workers * 4))
+        return list(self._pool.map(_inspect_safe, items, chunksize=chunksize))
+
+    def save(self):
+        """ Atomically write the cache if anything changed, without the files this inspector has not seen
+        """
+        with self._lock:
+            entries = {key: entry for key, entry in self._entries.items() if key in self._seen}
+            if self.path is None or not (self._dirty or len(entries) < len(self._entries)):
+                return
+            self._entries = entries
+            data = json.dumps({'version': self.VERSION, 'prefix_bytes': self.prefix_bytes, 'files': entries},
+                              ensure_ascii=False)
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as fn:
+            fn.write(data)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        """ Stop the worker processes
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -1,20 +1,77 @@
 """
 TheTVDB API
 """
+import hashlib
 import json
 import logging
-from typing import List, Union
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Union
 from urllib.parse import urljoin
 
-import requests
-
+from subrename.metrics import METRICS
 from subrename.providers import TVShowProvider
+from subrename.scheduler import RETRY_STATUSES, RequestScheduler
 from subrename.utils import load_config
 
 
 log = logging.getLogger('subrename.tvdb_api')
 
 
+class TokenStore:
+    """ Keep the TheTVDB token on disk with its expiry, so later processes skip the login
+
+    The token is stored with a hash of the API url and credentials, never the credentials
+    themselves, and only reused by the same account while it has more than MARGIN left.
+
+    Arguments:
+        path {str} -- JSON token file, readable by the owner only
+    """
+    LIFETIME = 24 * 60 * 60
+    MARGIN = 60 * 60
+    DEFAULT_PATH = os.path.join('~', '.cache', 'subrename', 'token.json')
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_config(cls, config):
+        """ Token store at TOKEN_PATH of config.json
+        """
+        return cls(os.path.expanduser(config.get('TOKEN_PATH') or cls.DEFAULT_PATH))
+
+    @staticmethod
+    def account(base_url, auth_data):
+        key = json.dumps([base_url, sorted(auth_data.items())])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def load(self, account):
+        """ Stored token of the account, None if missing, expiring or of another account
+        """
+        try:
+            with open(self.path) as fn:
+                data = json.load(fn)
+        except (OSError, ValueError):
+            return None
+        if data.get('account') != account or data.get('expires_at', 0) - time.time() < self.MARGIN:
+            return None
+        return data.get('token')
+
+    def save(self, account, token):
+        data = {'account': account, 'token': token, 'expires_at': time.time() + self.LIFETIME}
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as fn:
+                json.dump(data, fn)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Cannot save TheTVDB token to '{0}': {1}".format(self.path, e))
+
+
 class TVDBClient(TVShowProvider):
     ID_KEY = 'id'
     SEASON_KEY = 'airedSeason'
@@ -23,23 +80,57 @@ class TVDBClient(TVShowProvider):
     EPISODE_NAME_KEY = 'episodeName'
     ABS_EPISODE_KEY = 'absoluteNumber'
 
-    def __init__(self):
-        config = load_config()
+    def __init__(self, cache=None, max_workers=None, config=None, token_store=None):
+        if config is None:
+            config = load_config()
         self._auth_data = {
             "username": config.get('TVDB_USER'),
             "userkey": config.get('TVDB_USERKEY'),
             "apikey": config.get('TVDB_API'),
         }
-        self.base_url = 'https://api.thetvdb.com'
+        self.base_url = config.get('TVDB_BASE_URL') or 'https://api.thetvdb.com'
         self._urls = self._generate_urls()
-        self.__saved_token = self._generate_token()
+        self.cache = cache
+        self.max_workers = max_workers or config.get('MAX_WORKERS', 8)
+        # Every request, logins included, goes through the rate limit and retries of the scheduler
+        self._scheduler = RequestScheduler.from_config(config)
+        # Pages are fetched in their own pool, callers may already fan out over the caller pool
+        self._page_executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        # Nothing is imported, connected or logged in until the first request: runs answered
+        # from the cache never pay for it
+        self.__session = None
+        self._session_lock = threading.Lock()
+        self._request_errors = (ConnectionError,)
+        self.token_store = token_store
+        self._account = TokenStore.account(self.base_url, self._auth_data)
+        self.__saved_token = None
+        self._token_lock = threading.Lock()
+
+    @property
+    def _offline(self):
+        return self.cache is not None and self.cache.offline
+
+    @property
+    def _session(self):
+        with self._session_lock:
+            if self.__session is None:
+                self.__session = self._create_session()
+            return self.__session
 
     @property
     def _token(self):
-        if self.__saved_token is None:
-            self.__saved_token = self._generate_token()
+        with self._token_lock:
+            if self.__saved_token is None and self.token_store is not None:
+                self.__saved_token = self.token_store.load(self._account)
+            if self.__saved_token is None:
+                self._set_token(self._generate_token())
+
+            return self.__saved_token
 
-        return self.__saved_token
+    def _set_token(self, token):
+        self.__saved_token = token
+        if self.token_store is not None:
+            self.token_store.save(self._account, token)
 
     def _generate_urls(self):
         urls = {
@@ -52,6 +143,18 @@ class TVDBClient(TVShowProvider):
 
         return {key: urljoin(self.base_url, url) for key, url in urls.items()}
 
+    def _create_session(self):
+        """ Keep-alive session with a connection pool large enough for all workers
+        """
+        import requests
+        self._request_errors = (ConnectionError, requests.RequestException)
+        self._scheduler.retry_exceptions += (requests.ConnectionError, requests.Timeout)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers * 2)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
     def _generate_token(self):
         url = self._urls["login"]
         headers = {
@@ -59,7 +162,8 @@ class TVDBClient(TVShowProvider):
             "Accept": "application/json",
         }
         log.info("Generate TheTVDB token.")
-        response = requests.post(url, headers=headers, data=json.dumps(self._auth_data))
+        response = self._scheduler.call(
+            lambda: self._session.post(url, headers=headers, data=json.dumps(self._auth_data)), label='login')
         if response.status_code == 401:
             raise ConnectionRefusedError("Invalid credentials.")
 
@@ -68,48 +172,110 @@ class TVDBClient(TVShowProvider):
 
         return response.json()["token"]
 
-    def _get_with_token(self, url, query_params=None, language=None):
+    def _get_with_token(self, url, query_params=None, language=None, if_modified_since=None, endpoint=None):
         headers = {
             "Accept": "application/json",
             "Authorization": "Bearer {0}".format(self._token),
         }
         if language:
             headers['Accept-Language'] = language
-        return requests.get(url, headers=headers, params=query_params)
+        if if_modified_since:
+            headers['If-Modified-Since'] = if_modified_since
+        return self._scheduler.call(lambda: self._session.get(url, headers=headers, params=query_params),
+                                    label=endpoint or 'other')
 
     def _refresh_token(self):
-        response = self._get_with_token(self._urls["refresh_token"])
+        response = self._get_with_token(self._urls["refresh_token"], endpoint="refresh_token")
         if response.status_code == 401:
             raise ConnectionRefusedError("Invalid token")
         if response.status_code != 200:
             raise ConnectionError("Unexpected Response.")
 
-        self.__saved_token = response.json()["token"]
+        self._set_token(response.json()["token"])
 
-    def _get(self, url, query_params=None, *, allow_401=True, language=None):
-        response = self._get_with_token(url, query_params, language=language)
-        if response.status_code == 200:
-            return response.json()
+    def _cache_lookup(self, url, query_params, language, endpoint):
+        """ Cached response of a request
 
-        elif response.status_code == 404:
-            raise LookupError("There are no data for this term.")
+        Raises:
+            LookupError: if the response is not cached in offline mode
+
+        Returns:
+            [tuple] -- (cache key, cached entry, whether the entry answers the request), key and
+                       entry are None without a cache, a stale entry is used to revalidate
+        """
+        if self.cache is None or not endpoint:
+            return None, None, False
+        cache_key = self.cache.make_key(url, query_params, language)
+        entry = self.cache.get(endpoint, cache_key)
+        if entry is not None and (entry.fresh or self.cache.offline):
+            METRICS.incr('cache_requests', endpoint=endpoint, result='hit')
+            return cache_key, entry, True
+        METRICS.incr('cache_requests', endpoint=endpoint, result='miss' if entry is None else 'stale')
+        if self.cache.offline:
+            raise LookupError("'{0}' is not cached, cannot fetch in offline mode.".format(url))
+        return cache_key, entry, False
+
+    def _get(self, url, query_params=None, *, allow_401=True, language=None, endpoint=None):
+        cache_key, stale, hit = self._cache_lookup(url, query_params, language, endpoint)
+        if hit:
+            return stale.data
 
-        elif response.status_code == 401 and allow_401:
+        start = time.perf_counter()
+        try:
+            response = self._get_with_token(url, query_params, language=language,
+                                            if_modified_since=stale.last_modified if stale else None,
+                                            endpoint=endpoint)
+        except self._request_errors:
+            METRICS.incr('http_requests', endpoint=endpoint or 'other', status='error')
+            if stale is None:
+                raise
+            log.warning("Request to '{0}' failed, using stale cached data.".format(url))
+            return stale.data
+        METRICS.observe('http_request_duration_seconds', time.perf_counter() - start, endpoint=endpoint or 'other')
+        METRICS.incr('http_requests', endpoint=endpoint or 'other', status=response.status_code)
+
+        if response.status_code == 401 and allow_401:
             try:
                 self._refresh_token()
             except ConnectionError:
-                self.__saved_token = self._generate_token()
+                self._set_token(self._generate_token())
+
+            return self._get(url, query_params, allow_401=False, language=language, endpoint=endpoint)
+        return self._response_data(url, response, endpoint, cache_key, stale)
 
-            return self._get(url, allow_401=False)
+    def _response_data(self, url, response, endpoint, cache_key=None, stale=None):
+        """ Data of a response, stored in the cache, or the stale cached data it allows to use
 
-        raise ConnectionError("Unexpected Response.")
+        Raises:
+            LookupError: on 404
+            ConnectionError: on any other unexpected status
+        """
+        if response.status_code == 304 and stale is not None:
+            self.cache.touch(cache_key)
+            return stale.data
+
+        if response.status_code == 200:
+            data = response.json()
+            if cache_key is not None:
+                self.cache.set(endpoint, cache_key, data, last_modified=response.headers.get('Last-Modified'))
+            return data
+
+        elif response.status_code == 404:
+            raise LookupError("There are no data for this term.")
+
+        elif response.status_code in RETRY_STATUSES and stale is not None:
+            log.warning("'{0}' still answers {1} after retries, using stale cached data.".format(
+                url, response.status_code))
+            return stale.data
+
+        raise ConnectionError("Unexpected Response {0}.".format(response.status_code))
 
     def get_series_by_id(self, tvdb_id: Union[str, int], language=None) -> dict:
         """
         Get the series info by its tvdb ib
         """
         url = self._urls["series"].format(id=tvdb_id)
-        return self._get(url, language=language)["data"]
+        return self._get(url, language=language, endpoint="series")["data"]
 
     def get_series_by_imdb_id(self, imdb_id: str) -> dict:
         """
@@ -117,7 +283,7 @@ class TVDBClient(TVShowProvider):
         """
         url = self._urls["search_series"]
         query_params = {"imdbId": imdb_id}
-        tvdb_id = self._get(url, query_params)["data"][0]["id"]
+        tvdb_id = self._get(url, query_params, endpoint="search_series")["data"][0]["id"]
         return self.get_series_by_id(tvdb_id)
 
     def find_series_by_name(self, series_name: str) -> List[dict]:
@@ -131,7 +297,7 @@ class TVDBClient(TVShowProvider):
         """
         url = self._urls["search_series"]
         query_params = {"name": series_name}
-        info = self._get(url, query_params)["data"]
+        info = self._get(url, query_params, endpoint="search_series")["data"]
 
         return [
             {
@@ -146,8 +312,27 @@ class TVDBClient(TVShowProvider):
         """
         Get all the episodes for a TV series
         """
+        return list(self.iter_episodes_by_series_id(tvdb_id, language=language))
+
+    def iter_episodes_by_series_id(self, tvdb_id: Union[str, int], language=None) -> Iterator[dict]:
+        """
+        Iterate over all the episodes for a TV series
+        The endpoint returns 100 episodes per page, once the first page tells
+        the last page number the remaining pages are fetched concurrently.
+        Episodes are yielded page by page, so a page can be released as soon
+        as it is consumed.
+        """
         log.info("Get episode metadata for '{0}', language '{1}'".format(tvdb_id, language))
         base_url = self._urls["series_episodes"].format(id=tvdb_id)
-        full_data = self._get(base_url, language=language)
+        first_page = self._get_episodes_page(base_url, 1, language)
+        last = (first_page.get('links') or {}).get('last') or 1
+
+        yield from first_page['data'] or []
+        del first_page
+        pages = self._page_executor.map(lambda page: self._get_episodes_page(base_url, page, language),
+                                        range(2, last + 1))
+        for page in pages:
+            yield from page['data'] or []
 
-        return full_data['data']
+    def _get_episodes_page(self, url, page, language):
+        return self._get(url, {"page": page}, language=language, endpoint="series_episodes")
@@ -1,10 +1,144 @@
 import json
 import os
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 
+_config = None
+_config_lock = threading.Lock()
 
-def load_config():
-    abs_path = os.path.abspath(__file__)
-    dir_name = os.path.dirname(abs_path)
-    with open(os.path.join(dir_name, 'config.json')) as fn:
-        config = fn.read()
-    return json.loads(config)
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+class Config(Mapping):
+    """ Validated, immutable view of config.json
+
+    Works like the dict it was built from (config['KEY'], config.get('KEY')), lists become tuples.
+    Artifacts derived from the settings are built once:
+
+        media_formats -- media file name formats in the order they are tried
+        media_exts / subtitles_exts -- lower cased extension tuples, ready for str.endswith()
+        search_languages -- languages to fetch names in, search_language_set as a frozenset
+        sub_patterns -- compiled subtitle number formats (matcher.SubtitlePatterns)
+    """
+    LIST_KEYS = ('MEDIA_FILE_NAME_FORMATS', 'MEDIA_EXTS', 'SUBTITLES_EXTS', 'SEARCH_LANGS',
+                 'SEASON_EPISODE_FORMATS', 'EPISODE_ONLY_FORMATS', 'PROVIDERS')
+    STR_KEYS = ('MEDIA_FILE_NAME_FORMAT', 'SUBTITLE_LANG')
+    DEFAULTS = {
+        'MEDIA_EXTS': ['.mkv', '.avi', '.mp4'],
+        'SUBTITLES_EXTS': ['.srt', '.ssa', '.ass'],
+        'SEARCH_LANGS': ['en'],
+    }
+
+    def __init__(self, data):
+        from subrename.matcher import compile_sub_formats
+        from subrename.parse_media import compile_media_format, media_formats
+
+        self._validate(data)
+        self._data = MappingProxyType({key: _freeze(value) for key, value in data.items()})
+
+        self.media_formats = tuple(media_formats(self))
+        for fformat in self.media_formats:
+            compile_media_format(fformat)
+        self.media_exts = tuple(i.lower() for i in self.get('MEDIA_EXTS', self.DEFAULTS['MEDIA_EXTS']))
+        self.subtitles_exts = tuple(i.lower() for i in self.get('SUBTITLES_EXTS', self.DEFAULTS['SUBTITLES_EXTS']))
+        self.search_languages = tuple(self.get('SEARCH_LANGS', self.DEFAULTS['SEARCH_LANGS']))
+        self.search_language_set = frozenset(self.search_languages)
+        self.sub_patterns = compile_sub_formats(self.get('SEASON_EPISODE_FORMATS', ()),
+                                                self.get('EPISODE_ONLY_FORMATS', ()))
+        self._frozen = True
+
+    @classmethod
+    def _validate(cls, data):
+        if not isinstance(data, Mapping):
+            raise ValueError("Config must be a JSON object, got {0}".format(type(data).__name__))
+        for key in cls.LIST_KEYS:
+            value = data.get(key)
+            if value is not None and (not isinstance(value, (list, tuple))
+                                      or not all(isinstance(i, str) for i in value)):
+                raise ValueError("Config {0} must be a list of strings".format(key))
+        for key in cls.STR_KEYS:
+            value = data.get(key)
+            if value is not None and not isinstance(value, str):
+                raise ValueError("Config {0} must be a string".format(key))
+
+    @classmethod
+    def coerce(cls, config):
+        """ Wrap a plain dict into a Config, pass a Config through
+        """
+        return config if isinstance(config, cls) else cls(config)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __reduce__(self):
+        return type(self), (_thaw(self._data),)
+
+    def __setattr__(self, key, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("Config is immutable")
+        super().__setattr__(key, value)
+
+
+def load_config(reload=False, path=None):
+    """ Load config.json once per process
+
+    Keyword Arguments:
+        reload {bool} -- read the file again (default: {False})
+        path {str} -- config file to load instead of the config.json next to this module (default: {None})
+
+    Returns:
+        [Config] -- loaded config
+    """
+    global _config
+    with _config_lock:
+        if _config is None or reload or path:
+            if path is None:
+                abs_path = os.path.abspath(__file__)
+                dir_name = os.path.dirname(abs_path)
+                path = os.path.join(dir_name, 'config.json')
+            with open(path) as fn:
+                config = fn.read()
+            _config = Config(json.loads(config))
+        return _config
+
+
+def parallel_map(func, items, max_workers=8):
+    """ Apply func to every item on a bounded thread pool
+
+    Arguments:
+        func {callable} -- function of one argument
+        items {iterable} -- arguments
+
+    Keyword Arguments:
+        max_workers {int} -- maximum number of threads (default: {8})
+
+    Returns:
+        [list] -- results in the order of items, the first exception raised is propagated
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
@@ -0,0 +1,236 @@
+"""Watch a library for new subtitle and media files
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+log = logging.getLogger('subrename.watch')
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _walk_dirs(root, recursive=True):
+    yield root
+    if not recursive:
+        return
+    for dir_path, dir_names, _ in os.walk(root):
+        dir_names[:] = [i for i in dir_names if not i.startswith('.')]
+        for dir_name in dir_names:
+            yield os.path.join(dir_path, dir_name)
+
+
+def _parse_events(data):
+    # (watch descriptor, mask, name) of the inotify events read at once
+    offset = 0
+    while offset < len(data):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        yield wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+        offset += length
+
+
+class InotifyWatcher:
+    """ Report changed directories using Linux inotify
+
+    Arguments:
+        root {str} -- library root
+
+    Keyword Arguments:
+        recursive {bool} -- watch sub directories, including ones created later (default: {True})
+    """
+
+    def __init__(self, root, recursive=True):
+        self.recursive = recursive
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        for path in _walk_dirs(root, recursive):
+            self._add_watch(path)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            log.warning("Cannot watch '{0}': {1}".format(path, os.strerror(ctypes.get_errno())))
+            return
+        self._dirs[wd] = path
+
+    def read(self, timeout):
+        """ Wait up to timeout seconds for events
+
+        Returns:
+            [set] -- directories with changes, None if the event queue overflowed
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return set()
+            raise
+
+        changed = set()
+        for wd, mask, name in _parse_events(data):
+            if mask & IN_Q_OVERFLOW:
+                return None
+            changed |= self._handle_event(wd, mask, name)
+        return changed
+
+    def _handle_event(self, wd, mask, name):
+        # Directories changed by one event, new sub directories are watched too
+        path = self._dirs.get(wd)
+        if mask & IN_IGNORED:
+            self._dirs.pop(wd, None)
+            return set()
+        if path is None or name.startswith('.'):
+            return set()
+        if not mask & IN_ISDIR:
+            return {path}
+        changed = set()
+        if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+            for sub_dir in _walk_dirs(os.path.join(path, name)):
+                self._add_watch(sub_dir)
+                changed.add(sub_dir)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """ Report changed directories by comparing directory mtimes, for platforms without inotify
+
+    Every poll_interval seconds each known directory is stat'ed, only directories whose mtime
+    changed are listed again to find new sub directories.
+
+    Arguments:
+        root {str} -- library root
+
+    Keyword Arguments:
+        recursive {bool} -- watch sub directories, including ones created later (default: {True})
+        interval {float} -- seconds between polls (default: {5.0})
+    """
+
+    def __init__(self, root, recursive=True, interval=5.0):
+        self.root = root
+        self.recursive = recursive
+        self.interval = interval
+        self._mtimes = {}
+        self._sub_dirs = {}
+        self._poll()
+        self._next_poll = time.monotonic() + interval
+
+    @staticmethod
+    def _list_sub_dirs(path):
+        try:
+            with os.scandir(path) as entries:
+                return [entry.path for entry in entries
+                        if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return []
+
+    def _poll(self):
+        mtimes, changed = {}, set()
+        todo = [self.root]
+        while todo:
+            path = todo.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            mtimes[path] = mtime
+            if self._mtimes.get(path) != mtime:
+                changed.add(path)
+                if self.recursive:
+                    self._sub_dirs[path] = self._list_sub_dirs(path)
+            todo.extend(self._sub_dirs.get(path, ()))
+        self._sub_dirs = dict((path, sub_dirs) for path, sub_dirs in self._sub_dirs.items() if path in mtimes)
+        self._mtimes = mtimes
+        return changed
+
+    def read(self, timeout):
+        """ Wait up to timeout seconds, polling if poll_interval has passed since the last poll
+
+        Returns:
+            [set] -- directories with changes, empty without a poll
+        """
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(0.0, wait))
+        self._next_poll = time.monotonic() + self.interval
+        return self._poll()
+
+    def close(self):
+        pass
+
+
+def create_watcher(root, recursive=True, poll_interval=5.0):
+    """ inotify watcher on Linux, polling watcher elsewhere or if inotify is unavailable
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, recursive=recursive)
+        except (OSError, AttributeError) as e:
+            log.warning("inotify is unavailable ({0}), polling instead".format(e))
+    return PollingWatcher(root, recursive=recursive, interval=poll_interval)
+
+
+def watch(root, callback, recursive=True, debounce=2.0, poll_interval=5.0, stop_event=None):
+    """ Call callback with the set of changed directories until stop_event is set
+
+    Changes are collected until nothing happened for debounce seconds, so a subtitle drop of
+    many files is handled in one callback.
+
+    Arguments:
+        root {str} -- library root
+        callback {callable} -- called with a set of directory paths
+
+    Keyword Arguments:
+        recursive {bool} -- watch sub directories (default: {True})
+        debounce {float} -- quiet period in seconds before calling back (default: {2.0})
+        poll_interval {float} -- seconds between polls of the polling fallback (default: {5.0})
+        stop_event {threading.Event} -- stop watching once set (default: {None})
+    """
+    watcher = create_watcher(root, recursive=recursive, poll_interval=poll_interval)
+    log.info("Watching '{0}' with {1}".format(root, type(watcher).__name__))
+    if isinstance(watcher, PollingWatcher):
+        # Quiet periods shorter than a poll cannot be seen
+        debounce = max(debounce, poll_interval)
+    pending = set()
+    try:
+        while stop_event is None or not stop_event.is_set():
+            changed = watcher.read(debounce if pending else 1.0)
+            if changed is None:
+                log.warning("Too many changes, rescanning everything")
+                changed = set(_walk_dirs(root, recursive))
+            if changed:
+                pending |= changed
+                continue
+            if pending:
+                batch, pending = pending, set()
+                callback(set(i for i in batch if os.path.isdir(i)))
+    finally:
+        watcher.close()
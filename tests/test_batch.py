@@ -0,0 +1,119 @@
+import json
+import os
+import pickle
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from subrename import batch, main
+from subrename.episodes import EpisodeIndex
+from subrename.metrics import METRICS
+from subrename.providers import TVShowProvider
+from subrename.state import StateJournal
+
+CONFIG = {
+    "MEDIA_FILE_NAME_FORMATS": ["{series} - S{season}E{episode} - {quality}"],
+    "MEDIA_EXTS": [".mkv"],
+    "SUBTITLES_EXTS": [".srt"],
+    "SEARCH_LANGS": ["en"],
+    "SUBTITLE_LANG": "zh",
+    "SEASON_EPISODE_FORMATS": ["S{season}E{episode}"],
+}
+
+
+class FakeProvider(TVShowProvider):
+    max_workers = 2
+    SERIES = {'Planetes': 75796, 'Cowboy Bebop': 76885}
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def find_series_by_name(self, series_name):
+        self.calls.append(('search', series_name))
+        if series_name not in self.SERIES:
+            raise LookupError("There are no data for this term.")
+        return [{'name': series_name, 'air_date': '', 'tvdb_id': self.SERIES[series_name]}]
+
+    def get_series_by_id(self, tvdb_id, language=None):
+        return {'seriesName': None}
+
+    def get_series_by_imdb_id(self, imdb_id):
+        raise LookupError(imdb_id)
+
+    def get_episodes_by_series_id(self, tvdb_id, language=None):
+        self.calls.append(('episodes', tvdb_id, language))
+        return [{'airedSeason': 1, 'airedEpisodeNumber': i, 'episodeName': 'Episode {0}'.format(i)}
+                for i in range(1, 4)]
+
+
+class TestBatch(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.root = self.tmp.name
+        self.folders = []
+        for series, folder in [('Planetes', 'a/Season 1'), ('Planetes', 'b/Season 1'),
+                               ('Cowboy Bebop', 'c/Season 1'), ('Unknown', 'd/Season 1')]:
+            directory = os.path.join(self.root, folder)
+            os.makedirs(directory)
+            self.folders.append(directory)
+            for episode in (1, 2):
+                open(os.path.join(directory, '{0} - S01E0{1} - hd.mkv'.format(series, episode)), 'w').close()
+                open(os.path.join(directory, '{0}.S01E0{1}.srt'.format(series.lower(), episode)), 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_worker_processes(self):
+        provider = FakeProvider()
+        state = StateJournal(os.path.join(self.root, 'state.json'))
+        METRICS.reset()
+        report = batch.run_batch(self.folders[:3], provider, CONFIG, workers=2, shard_size=1, state=state)
+        self.assertEqual(report.totals()['renamed'], 6)
+        self.assertEqual(report.failed, [])
+        self.assertIn('Planetes - S01E01 - hd.zh.srt', os.listdir(self.folders[1]))
+        # Series shared by several folders are resolved and fetched once, by this process
+        self.assertEqual(sorted(provider.calls), [('episodes', 75796, 'en'), ('episodes', 76885, 'en'),
+                                                  ('search', 'Cowboy Bebop'), ('search', 'Planetes')])
+        self.assertEqual(METRICS.value('matches', tier='season_episode'), 6)
+
+        report = batch.run_batch(self.folders[:3], provider, CONFIG, workers=2, state=state)
+        self.assertEqual(report.totals()['skipped'], 3)
+
+    def test_failures_are_isolated(self):
+        match_directory = main.match_directory
+
+        def failing(media_files, sub_files, *args, **kwargs):
+            if any(i.startswith('cowboy') for i in sub_files):
+                raise RuntimeError('boom')
+            return match_directory(media_files, sub_files, *args, **kwargs)
+
+        manifest = os.path.join(self.root, 'folders.txt')
+        with open(manifest, 'w') as fn:
+            fn.write('# nightly\n\n' + '\n'.join(self.folders + [os.path.join(self.root, 'missing')]) + '\n')
+        state = StateJournal(os.path.join(self.root, 'state.json'))
+        with mock.patch('subrename.main.match_directory', side_effect=failing):
+            report = batch.run_batch(batch.read_manifest(manifest), FakeProvider(), CONFIG, workers=1, state=state)
+        self.assertEqual(report.failed, sorted(self.folders[2:] + [os.path.join(self.root, 'missing')]))
+        self.assertEqual(report.directories[self.folders[2]]['errors'], ['RuntimeError: boom'])
+        self.assertIn("Cannot get metadata of series 'Unknown'", report.directories[self.folders[3]]['errors'][0])
+        self.assertEqual(report.totals()['renamed'], 4)
+        for folder, recorded in [(self.folders[0], True), (self.folders[2], False)]:
+            names = sorted(os.listdir(folder))
+            self.assertEqual(state.is_unchanged(folder, [i for i in names if i.endswith('.mkv')],
+                                                [i for i in names if i.endswith('.srt')]), recorded)
+
+        path = os.path.join(self.root, 'report.json')
+        report.write(path)
+        with open(path) as fn:
+            self.assertEqual(json.load(fn)['totals']['failed'], 3)
+
+    def test_episode_subset_pickles(self):
+        index = EpisodeIndex()
+        index.add_episodes('A', [{'airedSeason': 1, 'airedEpisodeNumber': 1, 'absoluteNumber': 1,
+                                  'episodeName': 'One'}], language='en')
+        index.add_episodes('B', [{'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': 'Uno'}], language='es')
+        subset = pickle.loads(pickle.dumps(index.subset(['A', 'C'])))
+        self.assertEqual(subset.names('A', 1, 1), {'One'})
+        self.assertEqual(subset.names_by_absolute('A', 1), {'One'})
+        self.assertNotIn('B', subset)
+        self.assertNotIn('C', subset)
@@ -0,0 +1,98 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from subrename import tvdb_api
+from subrename.cache import ResponseCache
+
+
+class TestResponseCache(TestCase):
+    def test_get_set(self):
+        cache = ResponseCache(':memory:')
+        key = cache.make_key('http://tvdb/series/1', {'name': 'x'}, 'ja')
+        self.assertIsNone(cache.get('series', key))
+        cache.set('series', key, {'data': {'seriesName': 'x'}})
+        entry = cache.get('series', key)
+        self.assertEqual(entry.data, {'data': {'seriesName': 'x'}})
+        self.assertTrue(entry.fresh)
+
+    def test_key_includes_language(self):
+        self.assertNotEqual(ResponseCache.make_key('u', None, 'en'), ResponseCache.make_key('u', None, 'ja'))
+        self.assertEqual(ResponseCache.make_key('u', {'a': 1, 'b': 2}), ResponseCache.make_key('u', {'b': 2, 'a': 1}))
+
+    def test_ttl_expired(self):
+        cache = ResponseCache(':memory:', ttls={'series': 0})
+        cache.set('series', 'k', [1])
+        self.assertFalse(cache.get('series', 'k').fresh)
+
+    def test_eviction(self):
+        cache = ResponseCache(':memory:', max_entries=2)
+        with patch('subrename.cache.time') as py_time:
+            for i, key in enumerate(['a', 'b']):
+                py_time.time.return_value = i
+                cache.set('series', key, i)
+            py_time.time.return_value = 3
+            cache.get('series', 'a')
+            py_time.time.return_value = 4
+            cache.set('series', 'c', 2)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('series', 'b'))
+        self.assertIsNotNone(cache.get('series', 'a'))
+
+    def test_hits_do_not_write(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite')
+            cache = ResponseCache(path, max_entries=2)
+            with patch('subrename.cache.time') as py_time:
+                for i, key in enumerate(['a', 'b']):
+                    py_time.time.return_value = i
+                    cache.set('series', key, i)
+                changes = cache._conn.total_changes
+                py_time.time.return_value = 3
+                for _ in range(10):
+                    cache.get('series', 'a')
+                self.assertEqual(cache._conn.total_changes, changes)
+                cache.close()
+
+                # The access times are written on close, 'a' is more recent than 'b'
+                cache = ResponseCache(path, max_entries=2)
+                self.assertEqual(cache._conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+                py_time.time.return_value = 4
+                cache.set('series', 'c', 2)
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get('series', 'b'))
+            self.assertIsNotNone(cache.get('series', 'a'))
+            cache.close()
+
+    def test_refresh_mode_ignores_entries(self):
+        cache = ResponseCache(':memory:', mode='refresh')
+        cache.set('series', 'k', [1])
+        self.assertIsNone(cache.get('series', 'k'))
+
+
+class TestTVDBClientCache(TestCase):
+    @patch.object(tvdb_api, 'load_config')
+    def test_offline_served_from_cache(self, cfg):
+        cfg.return_value = {}
+        cache = ResponseCache(':memory:', ttls={'series': 0}, mode='offline')
+        client = tvdb_api.TVDBClient(cache=cache)
+        url = client._urls['series'].format(id=1)
+        cache.set('series', cache.make_key(url, None, 'ja'), {'data': {'seriesName': 'name'}})
+        with patch.object(client, '_get_with_token') as get:
+            self.assertEqual(client.get_series_by_id(1, language='ja'), {'seriesName': 'name'})
+            with self.assertRaises(LookupError):
+                client.get_series_by_id(2, language='ja')
+            get.assert_not_called()
+
+    @patch.object(tvdb_api, 'load_config')
+    def test_fetch_once(self, cfg):
+        cfg.return_value = {}
+        cache = ResponseCache(':memory:')
+        with patch.object(tvdb_api.TVDBClient, '_generate_token', return_value='token'):
+            client = tvdb_api.TVDBClient(cache=cache)
+        response = MagicMock(status_code=200, headers={})
+        response.json.return_value = {'data': []}
+        with patch.object(client, '_get_with_token', return_value=response) as get:
+            client.get_episodes_by_series_id(1, language='en')
+            client.get_episodes_by_series_id(1, language='en')
+            self.assertEqual(get.call_count, 1)
@@ -0,0 +1,73 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from subrename import main, parse_media
+from subrename.local_db import LocalProvider
+
+CONFIG = {
+    "MEDIA_FILE_NAME_FORMATS": ["{series} - S{season}E{episode} - {quality}"],
+    "SEARCH_LANGS": ["en", "ja"],
+    "SUBTITLE_LANG": "zh",
+    "SEASON_EPISODE_FORMATS": ["S{season}E{episode}"],
+    "EPISODE_ONLY_FORMATS": [],
+}
+
+DUMP = [
+    {'id': 75796, 'seriesName': {'en': 'Planetes', 'ja': 'プラネテス'}, 'imdbId': 'tt0816398', 'firstAired': '2003-10-04',
+     'episodes': {'en': [{'airedSeason': 1, 'airedEpisodeNumber': 1, 'absoluteNumber': 1,
+                          'episodeName': 'Outside the Window'},
+                         {'airedSeason': 1, 'airedEpisodeNumber': 2, 'absoluteNumber': 2,
+                          'episodeName': 'Like a Dream'}],
+                  'ja': [{'airedSeason': 1, 'airedEpisodeNumber': 1, 'absoluteNumber': 1,
+                          'episodeName': '大気の外で'}]}},
+    {'id': 1, 'seriesName': 'Planetes Redux', 'episodes': []},
+]
+
+
+class TestLocalProvider(TestCase):
+    def setUp(self):
+        self.provider = LocalProvider(':memory:')
+        self.assertEqual(self.provider.import_series(DUMP), 2)
+
+    def test_find_series_by_name(self):
+        self.assertEqual(self.provider.find_series_by_name('planetes'), [
+            {'name': 'Planetes', 'air_date': '2003-10-04', 'tvdb_id': 75796},
+            {'name': 'Planetes Redux', 'air_date': None, 'tvdb_id': 1}])
+        self.assertEqual(self.provider.find_series_by_name('プラネテス')[0]['tvdb_id'], 75796)
+        with self.assertRaises(LookupError):
+            self.provider.find_series_by_name('Unknown')
+
+    def test_series(self):
+        self.assertEqual(self.provider.get_series_by_id(75796, language='ja')['seriesName'], 'プラネテス')
+        self.assertIsNone(self.provider.get_series_by_id(1, language='ja')['seriesName'])
+        self.assertEqual(self.provider.get_series_by_imdb_id('tt0816398')['id'], 75796)
+        with self.assertRaises(LookupError):
+            self.provider.get_series_by_id(2)
+
+    def test_episodes(self):
+        self.assertEqual([i['episodeName'] for i in self.provider.get_episodes_by_series_id(75796)],
+                         ['Outside the Window', 'Like a Dream'])
+        self.assertEqual(self.provider.get_episode(75796, 1, 1, language='ja')['episodeName'], '大気の外で')
+        self.assertIsNone(self.provider.get_episode(75796, 1, 2, language='ja'))
+        self.assertEqual(self.provider.get_episodes_by_series_id(1), [])
+        with self.assertRaises(LookupError):
+            self.provider.get_episodes_by_series_id(2)
+
+    def test_reimport_replaces(self):
+        self.provider.import_series([dict(DUMP[0], episodes={'en': DUMP[0]['episodes']['en'][:1]})])
+        self.assertEqual(len(self.provider.get_episodes_by_series_id(75796)), 1)
+        self.assertEqual(self.provider.get_episodes_by_series_id(75796, language='ja'), [])
+
+    def test_process_directories_offline(self):
+        with TemporaryDirectory() as root:
+            for name in ['Planetes - S01E01 - dvdrip.mkv', '[Sub] 大気の外で.ass']:
+                open(os.path.join(root, name), 'w').close()
+            dump = os.path.join(root, 'dump.jsonl')
+            with open(dump, 'w') as fn:
+                fn.writelines(json.dumps(i) + '\n' for i in DUMP)
+            provider = LocalProvider(os.path.join(root, 'db', 'metadata.sqlite'))
+            provider.import_dump(dump)
+            plan = main.process_directories(parse_media.scan_library(root, ['.mkv'], ['.ass']), provider, CONFIG)
+            self.assertEqual([(op.src, op.dst) for op in plan.ops],
+                             [('[Sub] 大気の外で.ass', 'Planetes - S01E01 - dvdrip.zh.ass')])
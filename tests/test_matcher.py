@@ -0,0 +1,71 @@
+from unittest import TestCase
+from subrename.aho_corasick import Automaton
+from subrename.matcher import EpisodeNameIndex, FuzzyNameIndex, SubtitleIndex, normalize_text
+
+SEASON_EPISODE_FORMATS = ["S{season}E{episode}", "Season {season} Episode {episode}"]
+EPISODE_ONLY_FORMATS = ["EP{episode}", "[{episode}]", "第{episode}話"]
+
+
+class TestSubtitleIndex(TestCase):
+    def setUp(self):
+        self.sub_files = [
+            'Other.Show.S01E02.srt',
+            'planetes.S01E02.ass',
+            'Planetes_Season 1 Episode 02.srt',
+            '[Fansub] Planetes [03].ass',
+            'プラネテス 第04話.ass',
+        ]
+        self.index = SubtitleIndex(self.sub_files, SEASON_EPISODE_FORMATS, EPISODE_ONLY_FORMATS)
+
+    def test_match_season_episode(self):
+        self.assertEqual(self.index.match_season_episode(1, 2, {'Planetes'}), 'planetes.S01E02.ass')
+        self.assertEqual(self.index.match_season_episode(1, 2, {'Other Show'}), 'Other.Show.S01E02.srt')
+        self.assertIsNone(self.index.match_season_episode(1, 3, {'Planetes'}))
+
+    def test_match_episode(self):
+        self.assertEqual(self.index.match_episode(3, {'Planetes'}), '[Fansub] Planetes [03].ass')
+        self.assertEqual(self.index.match_episode(4, {'Planetes', 'プラネテス'}), 'プラネテス 第04話.ass')
+        self.assertIsNone(self.index.match_episode(4, {'Planetes'}))
+
+    def test_no_formats(self):
+        index = SubtitleIndex(self.sub_files)
+        self.assertIsNone(index.match_season_episode(1, 2, {'Planetes'}))
+
+
+class TestEpisodeNameIndex(TestCase):
+    def test_automaton_overlapping_patterns(self):
+        automaton = Automaton(['he', 'she', 'hers', 'his'])
+        self.assertEqual(set(automaton.patterns[i] for i in automaton.find_all('ushers')), {'he', 'she', 'hers'})
+
+    def test_first_sub_per_name(self):
+        sub_files = ['Planetes - Fools.srt', 'Planetes - Return Trip.ass', 'プラネテス 帰還.srt', 'Return Trip v2.srt']
+        index = EpisodeNameIndex(['Return Trip', '帰還', 'Fools', 'Unknown'], sub_files)
+        self.assertEqual(index.match(['return trip']), 'Planetes - Return Trip.ass')
+        self.assertEqual(index.match(['Unknown', '帰還']), 'プラネテス 帰還.srt')
+        self.assertIsNone(index.match(['Unknown']))
+
+
+class TestFuzzyNameIndex(TestCase):
+    SUBS = ['[Sub] Ｏｕｔｓｉｄｅ　ｏｆ the Atmosphere!.ass', '[Sub] Like_a_Dream.srt', '[Sub] Chapter 12.srt']
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text('Ｏｕｔｓｉｄｅ　the_Window!'), 'outside the window')
+
+    def test_match_variants(self):
+        index = FuzzyNameIndex(self.SUBS)
+        self.assertEqual(index.match(['Outside the Atmosphere']), self.SUBS[0])
+        self.assertEqual(index.match(['like a dream']), self.SUBS[1])
+
+    def test_threshold_and_numbers(self):
+        index = FuzzyNameIndex(self.SUBS)
+        self.assertIsNone(index.match(['Chapter 13']))
+        self.assertEqual(index.match(['Chapter 12']), self.SUBS[2])
+        self.assertIsNone(index.match(['Something else entirely']))
+        self.assertIsNone(FuzzyNameIndex(self.SUBS, threshold=1.0).match(['Outside the Atmospheres']))
+
+    def test_scattered_letters_do_not_match(self):
+        # 'the end' is spread over 'the expanse s01e01' in blocks of one and two letters
+        subs = ['The.Expanse.S01E{0:02d}.srt'.format(i) for i in range(1, 11)]
+        index = FuzzyNameIndex(subs)
+        self.assertLess(index.best('The End')[1], index.threshold)
+        self.assertIsNone(index.match(['The End', 'Back to the Butcher']))
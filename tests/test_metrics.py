@@ -0,0 +1,50 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from subrename.metrics import Metrics
+
+
+class TestMetrics(TestCase):
+    def test_counters_and_timer(self):
+        metrics = Metrics()
+        metrics.incr('matches', tier='name')
+        metrics.incr('matches', 2, tier='name')
+        with metrics.timer('scan'):
+            pass
+        self.assertEqual(metrics.value('matches', tier='name'), 3)
+        self.assertEqual(metrics.value('matches', tier='episode'), 0)
+        self.assertEqual(metrics.value('stage_calls', stage='scan'), 1)
+
+    def test_timed_iter(self):
+        metrics = Metrics()
+        self.assertEqual(list(metrics.timed_iter(iter([1, 2]), 'scan')), [1, 2])
+        self.assertEqual(metrics.value('stage_calls', stage='scan'), 3)
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.incr('http_requests', endpoint='series', status=200)
+        metrics.observe('http_request_duration_seconds', 0.02, endpoint='series')
+        metrics.observe('http_request_duration_seconds', 20, endpoint='series')
+        metrics.set('run_duration_seconds', 1.5)
+        text = metrics.prometheus()
+        self.assertIn('# TYPE subrename_http_requests_total counter', text)
+        self.assertIn('subrename_http_requests_total{endpoint="series",status="200"} 1', text)
+        self.assertIn('subrename_http_request_duration_seconds_bucket{endpoint="series",le="0.025"} 1', text)
+        self.assertIn('subrename_http_request_duration_seconds_bucket{endpoint="series",le="+Inf"} 2', text)
+        self.assertIn('subrename_http_request_duration_seconds_count{endpoint="series"} 2', text)
+        self.assertIn('subrename_run_duration_seconds 1.5', text)
+
+    def test_write(self):
+        metrics = Metrics()
+        metrics.incr('cache_requests', endpoint='series', result='hit')
+        with TemporaryDirectory() as tmp:
+            json_path, prom_path = os.path.join(tmp, 'run.json'), os.path.join(tmp, 'prom', 'subrename.prom')
+            metrics.write_json(json_path)
+            metrics.write_prometheus(prom_path)
+            with open(json_path) as fn:
+                summary = json.load(fn)
+            self.assertEqual(summary['counters']['cache_requests'],
+                             [{'labels': {'endpoint': 'series', 'result': 'hit'}, 'value': 1}])
+            self.assertEqual(sorted(os.listdir(tmp)), ['prom', 'run.json'])
+            self.assertEqual(os.listdir(os.path.join(tmp, 'prom')), ['subrename.prom'])
@@ -1,3 +1,5 @@
+import os
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import patch
 from subrename import parse_media
@@ -34,3 +36,67 @@ class TestParseMedia(TestCase):
                                                              'season': 5,
                                                              'episode': 2}
                          })
+
+    def test_parse_file_names_multiple_formats(self):
+        formats = ["{series} - S{season}E{episode} - {quality}",
+                   "{series}.S{season}E{episode}.{quality}",
+                   "[{group}] {series} - {absolute} [{quality}]{ext}"]
+        self.assertEqual(parse_media.parse_file_names([
+            'show a - S02E03 - dvdrip.mkv',
+            'show.c.S01E01.1080p.avi',
+            'Show.D.s01e12.x264.mkv',
+            '[Group] Planetes - 26 [1080p].mkv',
+            'random video.mp4'], fformat=formats), {
+            'show a - S02E03 - dvdrip.mkv': {'series': 'show a', 'season': 2, 'episode': 3},
+            'show.c.S01E01.1080p.avi': {'series': 'show c', 'season': 1, 'episode': 1},
+            'Show.D.s01e12.x264.mkv': {'series': 'Show D', 'season': 1, 'episode': 12},
+            '[Group] Planetes - 26 [1080p].mkv': {'series': 'Planetes', 'season': None, 'episode': 26,
+                                                  'absolute': 26},
+        })
+
+    def test_parser_keeps_priority_order(self):
+        formats = ["{series} - S{season}E{episode} - {quality}",
+                   "{series}.S{season}E{episode}.{quality}",
+                   "{series} S{season}E{episode} {quality}"]
+        file_names = ['Other S01E01 720p.mkv', 'Show - S01E02 - 720p.mkv', 'show.c.S01E01.1080p.avi']
+        expected = {'Other S01E01 720p.mkv': {'series': 'Other', 'season': 1, 'episode': 1},
+                    'Show - S01E02 - 720p.mkv': {'series': 'Show', 'season': 1, 'episode': 2},
+                    'show.c.S01E01.1080p.avi': {'series': 'show c', 'season': 1, 'episode': 1}}
+        self.assertEqual(parse_media.parse_file_names(file_names, fformat=formats), expected)
+        self.assertEqual(parse_media.parse_file_names(file_names[::-1], fformat=formats), expected)
+        # Separators left over by a looser format are stripped
+        self.assertEqual(parse_media.parse_file_name('Show - S01E02 - 720p.mkv', formats[2])['series'], 'Show')
+
+
+class TestScanLibrary(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.root = self.tmp.name
+        for path in ['show a/Season 1/show a - S01E01 - dvdrip.mkv',
+                     'show a/Season 1/show a - S01E01.ass',
+                     'show a/Season 2/show a - S02E01 - dvdrip.MKV',
+                     'show a/Season 2/notes.txt',
+                     'show b/show b - S01E01.srt',
+                     '.hidden/show c - S01E01 - x.mkv']:
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _scan(self, **kwargs):
+        scans = parse_media.scan_library(self.root, ['.mkv'], ['.srt', '.ass'], **kwargs)
+        return sorted((os.path.relpath(scan.path, self.root), scan.media_files, scan.sub_files) for scan in scans)
+
+    def test_scan_library_recursive(self):
+        expected = [
+            (os.path.join('show a', 'Season 1'), ['show a - S01E01 - dvdrip.mkv'], ['show a - S01E01.ass']),
+            (os.path.join('show a', 'Season 2'), ['show a - S02E01 - dvdrip.MKV'], []),
+            ('show b', [], ['show b - S01E01.srt']),
+        ]
+        self.assertEqual(self._scan(), expected)
+        self.assertEqual(self._scan(max_workers=4), expected)
+
+    def test_scan_library_flat(self):
+        self.assertEqual(self._scan(recursive=False), [])
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+import time
+from unittest import TestCase
+from subrename import registry
+from subrename.local_db import LocalProvider
+from subrename.providers import TVShowProvider
+
+
+class SlowProvider(TVShowProvider):
+    def __init__(self, name, delay=0.0, fail=False):
+        super().__init__()
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.release = threading.Event()
+
+    def find_series_by_name(self, series_name):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("{0} is down".format(self.name))
+        return [{'name': series_name, 'air_date': '', 'tvdb_id': self.name}]
+
+    def get_series_by_id(self, tvdb_id, language=None):
+        self.calls += 1
+        self.release.wait(5)
+        return {'seriesName': self.name}
+
+    def get_series_by_imdb_id(self, imdb_id):
+        raise LookupError(imdb_id)
+
+    def get_episodes_by_series_id(self, tvdb_id, language=None):
+        return []
+
+
+class TestProviderChain(TestCase):
+    def test_fallback(self):
+        primary, secondary = SlowProvider('primary', fail=True), SlowProvider('secondary')
+        chain = registry.ProviderChain([('a', primary), ('b', secondary)])
+        self.assertEqual(chain.find_series_by_name('Planetes')[0]['tvdb_id'], 'secondary')
+        with self.assertRaises(LookupError):
+            chain.get_series_by_imdb_id('tt1')
+
+    def test_hedge(self):
+        primary, secondary = SlowProvider('primary', delay=1.0), SlowProvider('secondary')
+        chain = registry.ProviderChain([('a', primary), ('b', secondary)], hedge_after=0.05)
+        start = time.perf_counter()
+        self.assertEqual(chain.find_series_by_name('Planetes')[0]['tvdb_id'], 'secondary')
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_no_hedge_within_budget(self):
+        primary, secondary = SlowProvider('primary'), SlowProvider('secondary')
+        chain = registry.ProviderChain([('a', primary), ('b', secondary)], hedge_after=1.0)
+        self.assertEqual(chain.find_series_by_name('Planetes')[0]['tvdb_id'], 'primary')
+        self.assertEqual(secondary.calls, 0)
+
+    def test_coalesce(self):
+        provider = SlowProvider('primary')
+        chain = registry.ProviderChain([('a', provider)])
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(chain.get_series_by_id(1, language='ja')))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while not chain._in_flight:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        provider.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'seriesName': 'primary'}] * 4)
+        self.assertEqual(provider.calls, 1)
+
+    def test_provider_names(self):
+        with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')) as fn:
+            config = json.load(fn)
+        self.assertEqual(registry.provider_names(config), ['tvdb'])
+        self.assertEqual(registry.provider_names(dict(config, LOCAL_DB_PATH='metadata.sqlite')), ['local'])
+        self.assertEqual(registry.provider_names(dict(config, PROVIDERS=['tvdb', 'local'],
+                                                      LOCAL_DB_PATH='metadata.sqlite')), ['tvdb', 'local'])
+
+    def test_create_provider(self):
+        chain = registry.create_provider({'PROVIDERS': ['local'], 'LOCAL_DB_PATH': ':memory:'})
+        self.assertIsInstance(chain.providers[0][1], LocalProvider)
+        with self.assertRaises(ValueError):
+            registry.create_provider({'PROVIDERS': ['nope']})
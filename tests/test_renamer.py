@@ -0,0 +1,82 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from subrename.renamer import RenameExecutor, RenameJournal, plan_renames
+
+
+class TestRenamer(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.journal = os.path.join(self.dir, 'journal', 'renames.jsonl')
+        for name in ['ep1.srt', 'ep2.ass', 'ep3.srt', 'b - S01E03.zh.srt']:
+            open(os.path.join(self.dir, name), 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_plan_conflicts(self):
+        plan = plan_renames(self.dir, [
+            ('a - S01E01.mkv', 'ep1.srt'),
+            ('a - S01E02.mkv', 'ep1.srt'),
+            ('a - S01E01.mp4', 'ep2.srt'),
+            ('b - S01E03.mkv', 'ep3.srt'),
+            ('c - S01E04.mkv', 'c - S01E04.zh.srt'),
+        ], 'zh')
+        self.assertEqual([(op.src, op.dst) for op in plan.ops], [('ep1.srt', 'a - S01E01.zh.srt')])
+        self.assertEqual([op.src for op in plan.unchanged], ['c - S01E04.zh.srt'])
+        self.assertEqual([(i.src, i.reason) for i in plan.conflicts], [
+            ('ep1.srt', "subtitle already matched to 'a - S01E01.mkv'"),
+            ('ep2.srt', "target already used by 'ep1.srt'"),
+            ('ep3.srt', 'target exists'),
+        ])
+
+    def test_apply_and_rollback(self):
+        plan = plan_renames(self.dir, [('a - S01E01.mkv', 'ep1.srt'), ('a - S01E02.mkv', 'ep2.ass')], 'zh')
+        executor = RenameExecutor(self.journal, max_workers=2)
+        results = executor.apply(plan)
+        self.assertTrue(all(i.ok for i in results))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'a - S01E02.zh.ass')))
+        self.assertEqual([i['status'] for i in RenameJournal.read(self.journal)].count('done'), 2)
+
+        executor.rollback()
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'ep1.srt')))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'a - S01E02.zh.ass')))
+
+        # The rollback is not undone by a second rollback, which has nothing left to undo
+        self.assertEqual(executor.rollback(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'ep1.srt')))
+
+    def test_rollback_skips_undone_runs(self):
+        executor = RenameExecutor(self.journal)
+        executor.apply(plan_renames(self.dir, [('a - S01E01.mkv', 'ep1.srt')], 'zh'))
+        executor.apply(plan_renames(self.dir, [('a - S01E02.mkv', 'ep2.ass')], 'zh'))
+        executor.rollback()
+        executor.rollback()
+        self.assertEqual(sorted(os.listdir(self.dir)), ['b - S01E03.zh.srt', 'ep1.srt', 'ep2.ass', 'ep3.srt',
+                                                        'journal'])
+
+    def test_compact(self):
+        executor = RenameExecutor(self.journal)
+        for media, sub in [('a - S01E01.mkv', 'ep1.srt'), ('a - S01E02.mkv', 'ep2.ass'), ('a - S01E03.mkv', 'ep3.srt')]:
+            executor.apply(plan_renames(self.dir, [(media, sub)], 'zh'))
+        executor.compact(keep_runs=2)
+        records = RenameJournal.read(self.journal)
+        self.assertEqual([(i['status'], os.path.basename(i['src'])) for i in records],
+                         [('done', 'ep2.ass'), ('done', 'ep3.srt')])
+        executor.rollback()
+        executor.rollback()
+        self.assertEqual(executor.rollback(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'a - S01E01.zh.srt')))
+
+    def test_resume_unfinished(self):
+        plan = plan_renames(self.dir, [('a - S01E01.mkv', 'ep1.srt')], 'zh')
+        journal = RenameJournal(self.journal)
+        journal.write('begin', plan.ops[0])
+        journal.close()
+        results = RenameExecutor(self.journal).resume()
+        self.assertEqual(len(results), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'a - S01E01.zh.srt')))
+        # Finished runs are compacted on the next start, the begin records are dropped
+        RenameExecutor(self.journal).resume()
+        self.assertEqual([i['status'] for i in RenameJournal.read(self.journal)], ['done'])
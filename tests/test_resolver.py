@@ -0,0 +1,84 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from subrename import main
+from subrename.resolver import SeriesResolver, split_year
+
+
+class SearchProvider:
+    max_workers = 1
+    RESULTS = [{'name': 'Doctor Who', 'air_date': '1963-11-23', 'tvdb_id': 76107},
+               {'name': 'Doctor Who (2005)', 'air_date': '2005-03-26', 'tvdb_id': 78804},
+               {'name': 'Doctor Who Confidential', 'air_date': '2005-03-26', 'tvdb_id': 79412}]
+
+    def __init__(self):
+        self.searches = []
+
+    def find_series_by_name(self, series_name):
+        self.searches.append(series_name)
+        return self.RESULTS
+
+
+class RemakeProvider(SearchProvider):
+    RESULTS = [{'name': 'Doctor Who', 'air_date': '1963-11-23', 'tvdb_id': 76107},
+               {'name': 'Doctor Who', 'air_date': '2005-03-26', 'tvdb_id': 78804}]
+
+    def get_series_by_id(self, tvdb_id, language=None):
+        return {'seriesName': 'Doctor Who'}
+
+
+def _media(*series):
+    return {name: {'series': name} for name in series}
+
+
+class TestSeriesResolver(TestCase):
+    def test_split_year(self):
+        self.assertEqual(split_year('Doctor Who (2005)'), ('Doctor Who', 2005))
+        self.assertEqual(split_year('Doctor.Who.2005'), ('Doctor.Who', 2005))
+        self.assertEqual(split_year('Planetes'), ('Planetes', None))
+
+    def test_year_disambiguation(self):
+        provider = SearchProvider()
+        table = main.get_series_ids(_media('Doctor Who', 'doctor who 2005', 'Doctor Who 1963'), provider)
+        self.assertEqual({name: i['id'] for name, i in table.items()},
+                         {'Doctor Who': 76107, 'doctor who 2005': 78804, 'Doctor Who 1963': 76107})
+        self.assertEqual(provider.searches, ['Doctor Who', 'Doctor Who', 'doctor who'])
+
+    def test_override(self):
+        resolver = SeriesResolver(overrides={'Dr Who': 78804, 'Doctor Who': {'year': 2005}})
+        provider = SearchProvider()
+        table = main.get_series_ids(_media('dr who', 'Doctor Who'), provider, resolver=resolver)
+        self.assertEqual({name: i['id'] for name, i in table.items()}, {'dr who': 78804, 'Doctor Who': 78804})
+        self.assertEqual(provider.searches, ['Doctor Who'])
+
+    def test_shared_names_are_not_learned(self):
+        config = {'SEARCH_LANGS': ['en']}
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'series.json')
+            resolver = SeriesResolver(path)
+            table = main.get_series_ids(_media('Doctor Who (2005)'), RemakeProvider(), resolver=resolver)
+            main.update_series_alt_names(table, RemakeProvider(), config=config, resolver=resolver)
+            resolver.save()
+
+            resolver = SeriesResolver(path)
+            self.assertEqual(resolver.resolve('doctor who 2005'), 78804)
+            self.assertIsNone(resolver.resolve('Doctor Who'))
+            self.assertEqual(resolver.names(78804), {'en': 'Doctor Who'})
+            with self.assertRaisesRegex(ValueError, 'More than one match'):
+                main.get_series_ids(_media('Doctor Who'), RemakeProvider(), resolver=resolver)
+
+    def test_persisted_aliases(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index', 'series.json')
+            resolver = SeriesResolver(path)
+            resolver.learn('Planetes', 75796)
+            resolver.learn_name(75796, 'ja', 'プラネテス')
+            resolver.learn_name(75796, 'zh', None)
+            resolver.learn('プラネテス', 1)
+            resolver.save()
+
+            resolver = SeriesResolver(path)
+            self.assertEqual(resolver.resolve(' PLANETES '), 75796)
+            self.assertEqual(resolver.resolve('プラネテス'), 75796)
+            self.assertEqual(resolver.names(75796), {'ja': 'プラネテス', 'zh': None})
+            self.assertIsNone(resolver.resolve('Unknown'))
@@ -0,0 +1,58 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from subrename.scheduler import RequestScheduler, RetryBudget, TokenBucket, retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _response(status, headers=None):
+    return MagicMock(status_code=status, headers=headers or {})
+
+
+class TestScheduler(TestCase):
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+        self.assertEqual([bucket.acquire() for _ in range(2)], [0.0, 0.0])
+        self.assertAlmostEqual(bucket.acquire(), 0.5)
+        bucket.pause(10)
+        self.assertAlmostEqual(bucket.acquire(), 10.0)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(_response(429, {'Retry-After': '7'})), 7.0)
+        self.assertEqual(retry_after(_response(429, {'Retry-After': 'Thu, 01 Jan 1970 00:00:30 GMT'}), now=10), 20.0)
+        self.assertIsNone(retry_after(_response(503)))
+
+    def test_backoff_and_give_up(self):
+        clock = FakeClock()
+        scheduler = RequestScheduler(rate=100, max_retries=3, backoff_base=1, clock=clock, sleep=clock.sleep,
+                                     rng=lambda: 1.0)
+        send = MagicMock(return_value=_response(503))
+        self.assertEqual(scheduler.call(send).status_code, 503)
+        self.assertEqual(send.call_count, 4)
+        self.assertAlmostEqual(clock.now, 1 + 2 + 4, places=1)
+
+    def test_connection_error_retried(self):
+        clock = FakeClock()
+        scheduler = RequestScheduler(clock=clock, sleep=clock.sleep)
+        send = MagicMock(side_effect=[ConnectionError('reset'), _response(200)])
+        self.assertEqual(scheduler.call(send).status_code, 200)
+
+    def test_retry_budget(self):
+        clock = FakeClock()
+        scheduler = RequestScheduler(max_retries=5, retry_budget=RetryBudget(ratio=0, min_retries=2),
+                                     clock=clock, sleep=clock.sleep)
+        send = MagicMock(return_value=_response(500))
+        scheduler.call(send)
+        self.assertEqual(send.call_count, 3)
+        scheduler.call(send)
+        self.assertEqual(send.call_count, 4)
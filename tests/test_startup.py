@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+# A run with nothing to do (cron on an unchanged library) must not import requests, log in
+# or touch the network; import and run together have to fit in this budget
+COLD_START_TARGET = 0.5
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from subrename import main
+imported = time.perf_counter()
+main.main(sys.argv[1:])
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'total': done - start,
+                  'modules': sorted(m for m in ('requests', 'ctypes', 'difflib') if m in sys.modules)}))
+"""
+
+
+class TestColdStart(TestCase):
+    def test_cold_start(self):
+        with TemporaryDirectory() as tmp:
+            library = os.path.join(tmp, 'library')
+            os.makedirs(library)
+            config_path = os.path.join(tmp, 'config.json')
+            with open(config_path, 'w') as fn:
+                json.dump({'MEDIA_FILE_NAME_FORMATS': ['{series} - S{season}E{episode} - {quality}'],
+                           'TVDB_BASE_URL': 'http://127.0.0.1:9', 'TOKEN_PATH': os.path.join(tmp, 'token.json'),
+                           'CACHE_PATH': os.path.join(tmp, 'cache.sqlite'),
+                           'STATE_PATH': os.path.join(tmp, 'state.json'),
+                           'RENAME_JOURNAL': os.path.join(tmp, 'renames.jsonl'),
+                           'LOG_FILE': os.path.join(tmp, 'subrename.log')}, fn)
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            result = subprocess.run([sys.executable, '-c', SCRIPT, library, '-r', '--config', config_path],
+                                    cwd=tmp, env=dict(os.environ, PYTHONPATH=root), stdout=subprocess.PIPE,
+                                    check=True)
+            timings = json.loads(result.stdout.decode().splitlines()[-1])
+            self.assertEqual(timings['modules'], [])
+            self.assertFalse(os.path.exists(os.path.join(tmp, 'token.json')))
+            self.assertLess(timings['total'], COLD_START_TARGET, timings)
+
+    def test_import_has_no_side_effects(self):
+        with TemporaryDirectory() as tmp:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            subprocess.run([sys.executable, '-c', 'import subrename.main'], cwd=tmp,
+                           env=dict(os.environ, PYTHONPATH=root), check=True)
+            self.assertEqual(os.listdir(tmp), [])
@@ -0,0 +1,94 @@
+import os
+import sys
+import threading
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock, skipUnless
+from subrename import watch
+from subrename.state import StateJournal
+
+
+class TestStateJournal(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = os.path.join(self.tmp.name, 'season')
+        os.mkdir(self.dir)
+        self.state_path = os.path.join(self.tmp.name, 'state', 'state.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_unchanged_after_save(self):
+        state = StateJournal(self.state_path)
+        self.assertFalse(state.is_unchanged(self.dir, ['a.mkv'], ['a.zh.srt']))
+        state.record(self.dir, ['a.mkv'], ['a.zh.srt'], {'a.mkv': 'a.zh.srt'})
+        state.save()
+
+        state = StateJournal(self.state_path)
+        self.assertTrue(state.is_unchanged(self.dir, ['a.mkv'], ['a.zh.srt']))
+        self.assertFalse(state.is_unchanged(self.dir, ['a.mkv', 'b.mkv'], ['a.zh.srt']))
+
+    def test_pending_skips_done_media(self):
+        state = StateJournal(self.state_path)
+        state.record(self.dir, ['a.mkv'], ['a.zh.srt'], {'a.mkv': 'a.zh.srt'})
+        media_files = {'a.mkv': {'episode': 1}, 'b.mkv': {'episode': 2}}
+        self.assertEqual(state.pending(self.dir, media_files, ['a.zh.srt', 'ep2.srt']),
+                         ({'b.mkv': {'episode': 2}}, ['ep2.srt']))
+        # the renamed subtitle is gone, match the media file again
+        self.assertEqual(state.pending(self.dir, media_files, ['ep2.srt']), (media_files, ['ep2.srt']))
+
+
+class TestWatch(TestCase):
+    def test_watch_reports_changed_directory(self):
+        with TemporaryDirectory() as root:
+            season = os.path.join(root, 'season')
+            os.mkdir(season)
+            changes = []
+            stop = threading.Event()
+
+            def callback(dir_paths):
+                changes.append(dir_paths)
+                stop.set()
+
+            thread = threading.Thread(target=watch.watch, args=(root, callback),
+                                      kwargs={'debounce': 0.1, 'poll_interval': 0.1, 'stop_event': stop})
+            thread.start()
+            try:
+                # give the watcher time to register before creating the file
+                threading.Event().wait(0.3)
+                open(os.path.join(season, 'show - S01E01.srt'), 'w').close()
+                thread.join(timeout=5)
+            finally:
+                stop.set()
+                thread.join()
+            self.assertEqual(changes, [{season}])
+
+    def test_polling_watcher(self):
+        with TemporaryDirectory() as root:
+            season = os.path.join(root, 'season')
+            os.mkdir(season)
+            with mock.patch('os.walk', side_effect=AssertionError('listed every file')):
+                watcher = watch.PollingWatcher(root, interval=0.2)
+                with mock.patch.object(watcher, '_poll', wraps=watcher._poll) as poll:
+                    # Waiting less than the interval does not poll
+                    self.assertEqual(watcher.read(0.01), set())
+                    self.assertEqual(poll.call_count, 0)
+
+                    open(os.path.join(season, 'show - S01E01.srt'), 'w').close()
+                    os.makedirs(os.path.join(root, 'new', 'season 2'))
+                    self.assertEqual(watcher.read(1.0), {season, root, os.path.join(root, 'new'),
+                                                         os.path.join(root, 'new', 'season 2')})
+                    self.assertEqual(watcher.read(1.0), set())
+                    self.assertEqual(poll.call_count, 2)
+
+    @skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+    def test_inotify_watches_new_directories(self):
+        with TemporaryDirectory() as root:
+            watcher = watch.InotifyWatcher(root)
+            try:
+                new = os.path.join(root, 'new')
+                os.mkdir(new)
+                self.assertEqual(watcher.read(1.0), {new})
+                open(os.path.join(new, 'show - S01E01.srt'), 'w').close()
+                self.assertEqual(watcher.read(1.0), {new})
+            finally:
+                watcher.close()
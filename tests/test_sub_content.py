@@ -0,0 +1,138 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from subrename.metrics import METRICS
+from subrename.sub_content import SubtitleInfo, SubtitleInspector, classify_language, dialogue_text, \
+    inspect_file, sniff_encoding
+
+SRT = '1\n00:00:01,000 --> 00:00:02,000\n{0}\n\n2\n00:00:03,000 --> 00:00:04,000\n{1}\n\n'
+ZH = SRT.format('我们到底在这里做什么？', '他们已经来了，我们走吧。') * 3
+ZH_HANT = SRT.format('我們到底在這裡做什麼？', '他們已經來了，我們走吧。') * 3
+JA = SRT.format('ここは大気の外です。', '私たちは宇宙で働いている。') * 3
+KO = SRT.format('우리는 여기서 무엇을 하고 있는 거지?', '그게 사실이야?') * 3
+EN = SRT.format('What are you doing here?', 'I told you that it is not safe.') * 3
+FR = SRT.format("Qu'est-ce que tu fais ici?", "Je t'ai dit que ce n'était pas sûr.") * 3
+ASS = ('[Script Info]\nTitle: Planetes - 01\nScriptType: v4.00+\n\n[V4+ Styles]\nFormat: Name, Fontname\n'
+       'Style: Default,Arial\n\n[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, '
+       'Effect, Text\n' + 'Dialogue: 0,0:00:01.00,0:00:02.00,Default,,0,0,0,,{\\i1}ここは大気の外です。\\N私たちは宇宙で'
+       '働いている。\n' * 3)
+
+
+class TestSniffing(TestCase):
+    def test_encodings(self):
+        for text, encoding, expected in [(ZH, 'utf-8', 'utf-8'), (ZH, 'gb18030', 'gb18030'), (ZH, 'utf-16', 'utf-16'),
+                                         (ZH, 'utf-8-sig', 'utf-8-sig'), (ZH_HANT, 'big5', 'big5'),
+                                         (JA, 'shift_jis', 'shift_jis'), (JA, 'utf-16-le', 'utf-16-le'),
+                                         (KO, 'euc_kr', 'euc_kr'), (FR, 'cp1252', 'cp1252')]:
+            self.assertEqual(sniff_encoding(text.encode(encoding)), expected, (text[:40], encoding))
+
+    def test_utf16_cjk(self):
+        # '一' is 00 4E in UTF-16LE, a zero byte at the even offsets of mostly odd zeros
+        text = SRT.format('一二三，一个一个地来。', '他一直在这里。') * 3
+        self.assertEqual(sniff_encoding(text.encode('utf-16-le')), 'utf-16-le')
+        self.assertEqual(sniff_encoding(text.encode('utf-16-be')), 'utf-16-be')
+
+    def test_cut_multibyte_character(self):
+        data = ZH.encode('utf-8')
+        self.assertEqual(sniff_encoding(data[:data.index('我'.encode()) + 1]), 'utf-8')
+
+    def test_languages(self):
+        for text, expected in [(ZH, 'zh'), (ZH_HANT, 'zh'), (JA, 'ja'), (KO, 'ko'), (EN, 'en'), (FR, None),
+                               (SRT.format('你在这里做什么？', 'What are you doing here?') * 3, 'zh'),
+                               (SRT.format('OK', '1') * 2, None)]:
+            self.assertEqual(classify_language(dialogue_text(text)), expected, text[:60])
+
+    def test_ass(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, '1.ass')
+            with open(path, 'w', encoding='utf-16') as fn:
+                fn.write(ASS)
+            self.assertEqual(inspect_file(path), SubtitleInfo('utf-16', 'ja', 'Planetes - 01'))
+            open(path, 'w').close()
+            self.assertEqual(inspect_file(path), SubtitleInfo('utf-8', None, None))
+
+
+class TestSubtitleInspector(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.root = self.tmp.name
+        for name, text, encoding in [('a.srt', ZH, 'gb18030'), ('b.srt', EN, 'utf-8'), ('c.ass', ASS, 'utf-8')]:
+            with open(os.path.join(self.root, name), 'w', encoding=encoding) as fn:
+                fn.write(text)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cache(self):
+        path = os.path.join(self.root, 'cache', 'subtitles.json')
+        inspector = SubtitleInspector(path)
+        METRICS.reset()
+        infos = inspector.inspect(self.root, ['a.srt', 'b.srt', 'c.ass', 'missing.srt'])
+        self.assertEqual({name: info.language for name, info in infos.items()},
+                         {'a.srt': 'zh', 'b.srt': 'en', 'c.ass': 'ja'})
+        self.assertEqual(METRICS.value('subtitle_inspections', result='inspected'), 3)
+        self.assertEqual(METRICS.value('subtitle_inspections', result='failed'), 1)
+        inspector.save()
+
+        with open(os.path.join(self.root, 'b.srt'), 'w') as fn:
+            fn.write(FR)
+        inspector = SubtitleInspector(path)
+        self.assertEqual(inspector.inspect(self.root, ['a.srt', 'b.srt', 'c.ass']), {
+            'a.srt': SubtitleInfo('gb18030', 'zh', None), 'b.srt': SubtitleInfo('utf-8', None, None),
+            'c.ass': SubtitleInfo('utf-8', 'ja', 'Planetes - 01')})
+        self.assertEqual(METRICS.value('subtitle_inspections', result='cached'), 2)
+        self.assertEqual(METRICS.value('subtitle_inspections', result='inspected'), 4)
+
+    def test_cache_follows_renames(self):
+        path = os.path.join(self.root, 'cache', 'subtitles.json')
+        inspector = SubtitleInspector(path)
+        inspector.inspect(self.root, ['a.srt', 'b.srt', 'c.ass'])
+        inspector.save()
+
+        os.rename(os.path.join(self.root, 'a.srt'), os.path.join(self.root, 'Planetes - 01.zh.srt'))
+        inspector = SubtitleInspector(path)
+        METRICS.reset()
+        infos = inspector.inspect(self.root, ['Planetes - 01.zh.srt', 'b.srt'])
+        self.assertEqual(infos['Planetes - 01.zh.srt'], SubtitleInfo('gb18030', 'zh', None))
+        self.assertEqual(METRICS.value('subtitle_inspections', result='cached'), 2)
+        inspector.save()
+
+        # c.ass was not seen by the last run and is dropped from the cache
+        inspector = SubtitleInspector(path)
+        METRICS.reset()
+        inspector.inspect(self.root, ['c.ass'])
+        self.assertEqual(METRICS.value('subtitle_inspections', result='inspected'), 1)
+
+    def test_inspect_many(self):
+        other = os.path.join(self.root, 'other')
+        os.makedirs(other)
+        with open(os.path.join(other, 'd.srt'), 'w') as fn:
+            fn.write(JA)
+        inspector = SubtitleInspector(process_batch=4)
+        with mock.patch.object(inspector, '_map', wraps=inspector._map) as inspect_map:
+            infos = inspector.inspect_many([(self.root, ['a.srt', 'b.srt', 'c.ass']), (other, ['d.srt'])])
+        self.assertEqual([{name: info.language for name, info in i.items()} for i in infos],
+                         [{'a.srt': 'zh', 'b.srt': 'en', 'c.ass': 'ja'}, {'d.srt': 'ja'}])
+        self.assertEqual([len(i[0][0]) for i in inspect_map.call_args_list], [4])
+
+    def test_process_pool(self):
+        inspector = SubtitleInspector(max_workers=2, process_batch=2)
+        try:
+            infos = inspector.inspect(self.root, ['a.srt', 'b.srt', 'c.ass'])
+        finally:
+            inspector.close()
+        self.assertEqual(infos['c.ass'].title, 'Planetes - 01')
+        self.assertEqual(len(infos), 3)
+
+    def test_started_pool(self):
+        inspector = SubtitleInspector(max_workers=2, process_batch=2)
+        inspector.start()
+        try:
+            pool = inspector._pool
+            self.assertIsNotNone(pool)
+            infos = inspector.inspect(self.root, ['a.srt', 'b.srt', 'c.ass'])
+            self.assertIs(inspector._pool, pool)
+        finally:
+            inspector.close()
+        self.assertEqual(infos['a.srt'].language, 'zh')
@@ -1,32 +1,257 @@
-from unittest import TestCase
-from subrename import main
+import os
+import threading
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+from subrename import main, parse_media
+from subrename.episodes import EpisodeIndex
+from subrename.metrics import METRICS
+from subrename.providers import TVShowProvider
+from subrename.renamer import RenameExecutor, RenameJournal
+from subrename.resolver import SeriesResolver
+from subrename.state import StateJournal
+from subrename.sub_content import SubtitleInspector
+
+CONFIG = {
+    "MEDIA_FILE_NAME_FORMATS": ["{series} - S{season}E{episode} - {quality}"],
+    "MEDIA_EXTS": [".mkv"],
+    "SUBTITLES_EXTS": [".srt", ".ass"],
+    "SEARCH_LANGS": ["en", "ja"],
+    "SUBTITLE_LANG": "zh",
+    "SEASON_EPISODE_FORMATS": ["S{season}E{episode}"],
+    "EPISODE_ONLY_FORMATS": ["第{episode}話"],
+}
+
+
+class FakeProvider(TVShowProvider):
+    max_workers = 4
+    SERIES = {'Planetes': 75796, 'Other': 1}
+    NAMES = {('Planetes', 'ja'): 'プラネテス'}
+    EPISODES = {
+        (75796, 'en'): [{'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': 'Outside the Window'},
+                        {'airedSeason': 1, 'airedEpisodeNumber': 2, 'episodeName': 'Like a Dream'}],
+        (75796, 'ja'): [{'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': '大気の外で'}],
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def find_series_by_name(self, series_name):
+        self.calls.append(('search', series_name))
+        if series_name not in self.SERIES:
+            raise LookupError("There are no data for this term.")
+        return [{'name': series_name, 'air_date': '', 'tvdb_id': self.SERIES[series_name]}]
+
+    def get_series_by_id(self, tvdb_id, language=None):
+        self.calls.append(('series', tvdb_id, language))
+        series = [name for name, i in self.SERIES.items() if i == tvdb_id][0]
+        return {'seriesName': self.NAMES.get((series, language))}
+
+    def get_series_by_imdb_id(self, imdb_id):
+        raise LookupError(imdb_id)
+
+    def get_episodes_by_series_id(self, tvdb_id, language=None):
+        self.calls.append(('episodes', tvdb_id, language))
+        return self.EPISODES.get((tvdb_id, language), [])
+
+
+class FailingProvider(FakeProvider):
+    def find_series_by_name(self, series_name):
+        self.calls.append(('search', series_name))
+        raise ConnectionError("Service unavailable")
 
 
 class TestMain(TestCase):
-    @staticmethod
-    def test_find_episode_metadata_for_media():
-        data_cache = {
-            'show_A': [
-                {'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': 'EP1'},
-                {'airedSeason': 1, 'airedEpisodeNumber': 2, 'episodeName': 'EP2'},
-                {'airedSeason': 1, 'airedEpisodeNumber': 3, 'episodeName': 'EP3'},
-                {'airedSeason': 1, 'airedEpisodeNumber': 4, 'episodeName': 'EP4'},
-                {'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': 'ABC'},
-            ]
-        }
+    def test_find_episode_metadata_for_media(self):
+        episode_index = EpisodeIndex()
+        episode_index.add_episodes('show_A', [
+            {'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': 'EP1'},
+            {'airedSeason': 1, 'airedEpisodeNumber': 2, 'episodeName': 'EP2'},
+            {'airedSeason': 1, 'airedEpisodeNumber': 3, 'episodeName': 'EP3'},
+            {'airedSeason': 1, 'airedEpisodeNumber': 4, 'episodeName': 'EP4'},
+        ])
+        episode_index.add_episodes('show_A', [
+            {'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': 'ABC'},
+        ])
         metadata = {'series': 'show_A', 'season': 1, 'episode': 1}
-        main.find_episode_metadata_for_media(metadata, data_cache) == {'series': 'show_A',
-                                                                       'season': 1,
-                                                                       'episode': 1,
-                                                                       'names': {'EP1', 'ABC'}}
+        self.assertEqual(main.find_episode_metadata_for_media(metadata, episode_index),
+                         {'series': 'show_A',
+                          'season': 1,
+                          'episode': 1,
+                          'names': {'EP1', 'ABC'}})
         metadata = {'series': 'show_A', 'season': 1, 'episode': 2}
-        main.find_episode_metadata_for_media(metadata, data_cache) == {'series': 'show_A',
-                                                                       'season': 1,
-                                                                       'episode': 1,
-                                                                       'names': {'EP2'}}
+        self.assertEqual(main.find_episode_metadata_for_media(metadata, episode_index),
+                         {'series': 'show_A',
+                          'season': 1,
+                          'episode': 2,
+                          'names': {'EP2'}})
 
         metadata = {'series': 'show_A', 'season': 2, 'episode': 1}
-        main.find_episode_metadata_for_media(metadata, data_cache) == {'series': 'show_A',
-                                                                       'season': 1,
-                                                                       'episode': 1,
-                                                                       'names': set()}
+        self.assertEqual(main.find_episode_metadata_for_media(metadata, episode_index),
+                         {'series': 'show_A',
+                          'season': 2,
+                          'episode': 1,
+                          'names': set()})
+        self.assertNotIn('names', metadata)
+
+    def test_find_episode_metadata_by_absolute_number(self):
+        episode_index = EpisodeIndex()
+        episode_index.add_episodes('show_B', [
+            {'airedSeason': 2, 'airedEpisodeNumber': 1, 'absoluteNumber': 27, 'episodeName': 'EP27'},
+        ])
+        metadata = {'series': 'show_B', 'season': 1, 'episode': 27, 'absolute': 27}
+        self.assertEqual(main.find_episode_metadata_for_media(metadata, episode_index)['names'], {'EP27'})
+
+    def test_numbers_win_over_approximate_names(self):
+        names = ['Dulcinea', 'The Big Empty', 'The End', 'CQB', 'Back to the Butcher', 'Rock Bottom',
+                 'Windmills', 'Salvage', 'Critical Mass', 'Leviathan Wakes']
+        episode_index = EpisodeIndex()
+        episode_index.add_episodes('The Expanse', [
+            {'airedSeason': 1, 'airedEpisodeNumber': i + 1, 'episodeName': name} for i, name in enumerate(names)
+        ], language='en')
+        sub_files = ['The.Expanse.S01E{0:02d}.srt'.format(i) for i in range(1, 11)]
+        media_files = dict(('The Expanse - S01E{0:02d} - 720p.mkv'.format(i),
+                            {'series': 'The Expanse', 'season': 1, 'episode': i}) for i in (3, 7))
+        series_table = {'The Expanse': {'id': 280619, 'names': {'The Expanse'}}}
+        matching_subs = main.match_directory(media_files, sub_files, series_table, episode_index, config=CONFIG)
+        self.assertEqual(sorted(matching_subs), [('The Expanse - S01E03 - 720p.mkv', 'The.Expanse.S01E03.srt'),
+                                                 ('The Expanse - S01E07 - 720p.mkv', 'The.Expanse.S01E07.srt')])
+
+    def test_episode_index_keeps_only_matching_fields(self):
+        episode_index = EpisodeIndex()
+        episode_index.add_episodes('show_C', iter([
+            {'airedSeason': 1, 'airedEpisodeNumber': 1, 'absoluteNumber': 1, 'episodeName': 'Pilot',
+             'overview': 'long text', 'guestStars': ['someone']},
+        ]), language='en')
+        episode_index.add_episodes('show_C', iter([
+            {'airedSeason': 1, 'airedEpisodeNumber': 1, 'episodeName': 'パイロット'},
+        ]), language='ja')
+        record, = episode_index.records('show_C')
+        self.assertEqual((record.season, record.episode, record.absolute), (1, 1, 1))
+        self.assertEqual(record.names, ('Pilot', 'パイロット'))
+        self.assertIs(episode_index.names('show_C', 1, 1), episode_index.names('show_C', 1, 1))
+        self.assertFalse(hasattr(record, '__dict__'))
+
+
+class TestProcessDirectories(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.root = self.tmp.name
+        for path in ['Season 1/Planetes - S01E01 - dvdrip.mkv',
+                     'Season 1/Planetes - S01E02 - dvdrip.mkv',
+                     'Season 1/Unknown - S01E01 - dvdrip.mkv',
+                     'Season 1/[Sub] 大気の外で.ass',
+                     'Season 1/planetes.S01E02.srt',
+                     'Season 1/unknown.S01E01.srt']:
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _scans(self):
+        return parse_media.scan_library(self.root, ['.mkv'], ['.srt', '.ass'])
+
+    def test_process_directories(self):
+        provider = FakeProvider()
+        METRICS.reset()
+        plan = main.process_directories(self._scans(), provider, CONFIG)
+        self.assertEqual(len(plan), 2)
+        self.assertEqual(METRICS.value('matches', tier='name'), 1)
+        self.assertEqual(METRICS.value('matches', tier='season_episode'), 1)
+        self.assertEqual(METRICS.value('renames', result='done'), 2)
+        self.assertEqual(METRICS.value('stage_calls', stage='series_resolution'), 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'Season 1'))), [
+            'Planetes - S01E01 - dvdrip.mkv',
+            'Planetes - S01E01 - dvdrip.zh.ass',
+            'Planetes - S01E02 - dvdrip.mkv',
+            'Planetes - S01E02 - dvdrip.zh.srt',
+            'Unknown - S01E01 - dvdrip.mkv',
+            'unknown.S01E01.srt',
+        ])
+        self.assertEqual(sorted(i for i in provider.calls if i[0] == 'episodes'),
+                         [('episodes', 75796, 'en'), ('episodes', 75796, 'ja')])
+
+    def test_dry_run(self):
+        plan = main.process_directories(self._scans(), FakeProvider(), CONFIG, dry_run=True)
+        self.assertEqual(len(plan), 2)
+        self.assertIn('[Sub] 大気の外で.ass', os.listdir(os.path.join(self.root, 'Season 1')))
+
+    def test_known_series_are_not_searched(self):
+        resolver = SeriesResolver(os.path.join(self.root, 'series.json'))
+        main.process_directories(self._scans(), FakeProvider(), CONFIG, dry_run=True, resolver=resolver)
+        resolver.save()
+
+        provider = FakeProvider()
+        resolver = SeriesResolver(os.path.join(self.root, 'series.json'))
+        plan = main.process_directories(self._scans(), provider, CONFIG, dry_run=True, resolver=resolver)
+        self.assertEqual(len(plan), 2)
+        self.assertEqual([i for i in provider.calls if i[0] != 'episodes'], [('search', 'Unknown')])
+        self.assertEqual(resolver.resolve('プラネテス'), 75796)
+
+    def test_inspected_subtitles(self):
+        directory = os.path.join(self.root, 'Mixed')
+        os.makedirs(directory)
+        for name, text in [('Planetes - S01E01 - dvdrip.mkv', ''), ('Planetes - S01E02 - dvdrip.mkv', ''),
+                           ('planetes.S01E01.a.srt', 'What are you doing here? I told you that it is not safe.'),
+                           ('planetes.S01E01.b.srt', '我们到底在这里做什么？他们已经来了，我们走吧。'),
+                           ('2.ass', '[Script Info]\nTitle: Planetes S01E02\n\n[Events]\n' +
+                            'Dialogue: 0,0:00:01.00,0:00:02.00,Default,,0,0,0,,ここは大気の外です。\n' * 3)]:
+            with open(os.path.join(directory, name), 'w') as fn:
+                fn.write(text)
+        scans = parse_media.scan_library(directory, ['.mkv'], ['.srt', '.ass'])
+        plan = main.process_directories(scans, FakeProvider(), CONFIG, dry_run=True, inspector=SubtitleInspector())
+        self.assertEqual(sorted((op.src, op.dst) for op in plan.ops), [
+            ('2.ass', 'Planetes - S01E02 - dvdrip.ja.ass'),
+            ('planetes.S01E01.b.srt', 'Planetes - S01E01 - dvdrip.zh.srt'),
+        ])
+
+    def test_failed_series_are_retried(self):
+        state = StateJournal(os.path.join(self.root, 'state.json'))
+        main.process_directories(self._scans(), FailingProvider(), CONFIG, state=state)
+
+        provider = FakeProvider()
+        plan = main.process_directories(self._scans(), provider, CONFIG, state=state)
+        self.assertIn(('search', 'Planetes'), provider.calls)
+        self.assertEqual(len(plan), 2)
+
+    def test_one_journal_run_per_call(self):
+        directory = os.path.join(self.root, 'Season 2')
+        os.makedirs(directory)
+        for name in ['Planetes - S01E02 - dvdrip.mkv', 'planetes.S01E02.srt']:
+            open(os.path.join(directory, name), 'w').close()
+        journal_path = os.path.join(self.root, 'renames.jsonl')
+        executor = RenameExecutor(journal_path=journal_path)
+        main.process_directories(self._scans(), FakeProvider(), CONFIG, executor=executor)
+        records = RenameJournal.read(journal_path)
+        self.assertEqual(len([i for i in records if i['status'] == 'done']), 3)
+        self.assertEqual(len(set(i['run'] for i in records)), 1)
+
+        executor.rollback()
+        # The rollback undoes the renames of both directories
+        self.assertEqual(sorted(os.listdir(directory)), ['Planetes - S01E02 - dvdrip.mkv', 'planetes.S01E02.srt'])
+        self.assertIn('[Sub] 大気の外で.ass', os.listdir(os.path.join(self.root, 'Season 1')))
+
+    def test_subtitles_inspected_in_batches(self):
+        directory = os.path.join(self.root, 'Season 2')
+        os.makedirs(directory)
+        for name in ['Planetes - S01E02 - dvdrip.mkv', 'planetes.S01E02.srt']:
+            open(os.path.join(directory, name), 'w').close()
+        inspector = SubtitleInspector(process_batch=4)
+        with mock.patch.object(inspector, 'inspect_many', wraps=inspector.inspect_many) as inspect_many:
+            plan = main.process_directories(self._scans(), FakeProvider(), CONFIG, dry_run=True, inspector=inspector)
+        self.assertEqual(len(plan), 3)
+        self.assertEqual([len(i[0][0]) for i in inspect_many.call_args_list], [2])
+
+    def test_failed_matching_stops_the_scanner(self):
+        for number in range(2, 8):
+            directory = os.path.join(self.root, 'Season {0}'.format(number))
+            os.makedirs(directory)
+            for name in ['Planetes - S01E02 - dvdrip.mkv', 'planetes.S01E02.srt']:
+                open(os.path.join(directory, name), 'w').close()
+        config = dict(CONFIG, PIPELINE_QUEUE_SIZE=1)
+        with mock.patch('subrename.main.plan_directory', side_effect=RuntimeError('boom')):
+            with self.assertRaisesRegex(RuntimeError, 'boom'):
+                main.process_directories(self._scans(), FakeProvider(), config, dry_run=True)
+        self.assertFalse([i for i in threading.enumerate() if i.name == 'subrename-scan'])
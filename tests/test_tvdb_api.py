@@ -0,0 +1,62 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from subrename import tvdb_api
+from subrename.scheduler import RequestScheduler
+
+
+def _response(data, last=None):
+    response = MagicMock(status_code=200, headers={})
+    response.json.return_value = {'data': data, 'links': {'last': last}}
+    return response
+
+
+class TestTVDBClient(TestCase):
+    @patch.object(tvdb_api, 'load_config')
+    @patch.object(tvdb_api.TVDBClient, '_generate_token')
+    def test_get_episodes_follows_pages(self, token, cfg):
+        cfg.return_value = {'MAX_WORKERS': 2}
+        client = tvdb_api.TVDBClient()
+        pages = {page: _response([{'id': page}], last=3) for page in (1, 2, 3)}
+        with patch.object(client, '_get_with_token',
+                          side_effect=lambda url, params, **kwargs: pages[params['page']]) as get:
+            episodes = client.get_episodes_by_series_id(75796, language='en')
+        self.assertEqual(episodes, [{'id': 1}, {'id': 2}, {'id': 3}])
+        self.assertEqual(get.call_count, 3)
+
+    @patch.object(tvdb_api, 'load_config')
+    @patch.object(tvdb_api.TVDBClient, '_generate_token')
+    def test_retry_after_and_401_replay(self, token, cfg):
+        cfg.return_value = {'MAX_WORKERS': 1}
+        client = tvdb_api.TVDBClient()
+        sleeps = []
+        clock = MagicMock(side_effect=lambda: sum(sleeps))
+        client._scheduler = RequestScheduler(clock=clock, sleep=sleeps.append)
+        throttled = MagicMock(status_code=429, headers={'Retry-After': '3'})
+        expired = MagicMock(status_code=401, headers={})
+        responses = [throttled, expired, _response([{'id': 1}])]
+        with patch.object(client._session, 'get', side_effect=responses) as get, \
+                patch.object(client, '_refresh_token'):
+            data = client._get(client._urls['series_episodes'].format(id=1), {'page': 2}, language='ja',
+                               endpoint='series_episodes')
+        self.assertEqual(data['data'], [{'id': 1}])
+        self.assertEqual(sleeps, [3.0])
+        self.assertEqual(get.call_args[1]['params'], {'page': 2})
+        self.assertEqual(get.call_args[1]['headers']['Accept-Language'], 'ja')
+
+    @patch.object(tvdb_api, 'load_config')
+    def test_lazy_login_and_persisted_token(self, cfg):
+        cfg.return_value = {'MAX_WORKERS': 1, 'TVDB_API': 'key'}
+        with TemporaryDirectory() as tmp:
+            store = tvdb_api.TokenStore(os.path.join(tmp, 'token.json'))
+            with patch.object(tvdb_api.TVDBClient, '_generate_token', return_value='token-1') as login:
+                client = tvdb_api.TVDBClient(token_store=store)
+                login.assert_not_called()
+                self.assertEqual(client._token, 'token-1')
+                self.assertEqual(tvdb_api.TVDBClient(token_store=store)._token, 'token-1')
+                login.assert_called_once_with()
+
+                cfg.return_value = {'MAX_WORKERS': 1, 'TVDB_API': 'other key'}
+                self.assertEqual(tvdb_api.TVDBClient(token_store=store)._token, 'token-1')
+                self.assertEqual(login.call_count, 2)
@@ -0,0 +1,47 @@
+import json
+import pickle
+from unittest import TestCase
+from unittest.mock import patch, mock_open
+from subrename import utils
+from subrename.utils import Config
+
+
+class TestConfig(TestCase):
+    def setUp(self):
+        self.data = {
+            "MEDIA_FILE_NAME_FORMAT": "{series} - S{season}E{episode} - {quality}",
+            "MEDIA_EXTS": [".MKV", ".avi"],
+            "SEARCH_LANGS": ["en", "ja"],
+            "SEASON_EPISODE_FORMATS": ["S{season}E{episode}"],
+            "CACHE_TTLS": {"series": 10},
+        }
+
+    def test_derived_artifacts(self):
+        config = Config(self.data)
+        self.assertEqual(config.media_formats, ("{series} - S{season}E{episode} - {quality}",))
+        self.assertEqual(config.media_exts, ('.mkv', '.avi'))
+        self.assertEqual(config.search_language_set, {'en', 'ja'})
+        self.assertEqual(len(config.sub_patterns.season_episode), 1)
+        self.assertEqual(config['SEARCH_LANGS'], ('en', 'ja'))
+        self.assertEqual(config.get('MISSING', 1), 1)
+
+    def test_immutable(self):
+        config = Config(self.data)
+        with self.assertRaises(TypeError):
+            config['CACHE_TTLS']['series'] = 1
+        with self.assertRaises(AttributeError):
+            config.media_exts = ()
+        self.assertEqual(pickle.loads(pickle.dumps(config)), config)
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            Config({"MEDIA_EXTS": ".mkv"})
+
+    def test_load_config_once(self):
+        opener = mock_open(read_data=json.dumps(self.data))
+        with patch.object(utils, '_config', None), patch('builtins.open', opener):
+            config = utils.load_config()
+            self.assertIs(utils.load_config(), config)
+            self.assertEqual(opener.call_count, 1)
+            self.assertIsNot(utils.load_config(reload=True), config)
+            self.assertEqual(opener.call_count, 2)